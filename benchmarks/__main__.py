@@ -0,0 +1,278 @@
+"""Benchmarks of di itself, run against fake `docker` and `docker-compose`
+executables so that results only depend on di and the configured latencies.
+
+    $ python -m benchmarks --runs 20 --latency 0.05 --output new.json
+    $ python -m benchmarks --compare old.json --threshold 10
+    $ python -m benchmarks --against master
+
+Timings only compare on the same machine and interpreter, so `--against`
+first runs the benchmarks of another commit in a temporary git worktree, as
+`tox -e bench` does in CI with the previous commit, or the base of a pull
+request, unless `BENCH_REF` says otherwise.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from collections import OrderedDict
+from tempfile import TemporaryDirectory
+
+from di import __version__
+from di.checks import Checks
+from di.testing import EXAMPLE_CONF, FakeDockerCLI
+from di.utils import get_statistics
+
+BENCHMARKS = ('import', 'settings', 'render', 'start', 'check', 'stop')
+
+# All that `import di.cli` may load of di, commands and checks being imported on demand
+CLI_MODULES = {'di', 'di.cli', 'di.commands', 'di.commands.utils'}
+
+# Slow to import and only needed by some commands
+DEFERRED_MODULES = ('concurrent.futures', 'http.client', 'toml', 'urllib.request')
+
+# In-process calls take well under a millisecond, so each of their samples averages this many
+LOOPS = 100
+
+
+def time_call(func, *args, **kwargs):
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    return (time.perf_counter() - start) * 1000
+
+
+def time_loop(func, *args, **kwargs):
+    start = time.perf_counter()
+    for _ in range(LOOPS):
+        func(*args, **kwargs)
+    return (time.perf_counter() - start) * 1000 / LOOPS
+
+
+def run_di(*args, env=None):
+    process = subprocess.run(
+        [sys.executable, '-m', 'di', *args], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env
+    )
+    if process.returncode:
+        raise RuntimeError('`di {}` failed:\n{}'.format(' '.join(args), process.stdout.decode()))
+
+
+def bench_import(runs):
+    """Interpreter startup alone, then with `di.cli` imported, as seen by every invocation."""
+    results = OrderedDict()
+    for name, code in (('interpreter', 'pass'), ('import di.cli', 'import di.cli')):
+        results[name] = [
+            time_call(subprocess.run, [sys.executable, '-c', code], check=True) for _ in range(runs)
+        ]
+
+    return results
+
+
+def find_eager_imports():
+    """Returns modules that `import di.cli` loads but should not. Unlike timings,
+    this does not depend on the machine, so it can fail the suite on its own.
+    """
+    process = subprocess.run(
+        [sys.executable, '-c', 'import json, sys, di.cli; print(json.dumps(sorted(sys.modules)))'],
+        stdout=subprocess.PIPE, check=True
+    )
+    modules = json.loads(process.stdout.decode())
+
+    return [
+        module for module in modules
+        if (module.startswith('di.') and module not in CLI_MODULES) or module in DEFERRED_MODULES
+    ]
+
+
+def bench_settings(runs):
+    from di import settings
+
+    with TemporaryDirectory() as d:
+        settings_file = settings.SETTINGS_FILE
+        settings.SETTINGS_FILE = os.path.join(d, 'settings.toml')
+        try:
+            settings.save_settings(settings.copy_default_settings())
+            return OrderedDict([('load_settings', [time_loop(settings.load_settings) for _ in range(runs)])])
+        finally:
+            settings.SETTINGS_FILE = settings_file
+
+
+def render(check_class, d):
+    check_class(
+        d=d, api_key='${DD_API_KEY}', conf_path='', conf_contents=EXAMPLE_CONF, agent_version='6'
+    ).release_ports()
+
+
+def bench_render(runs):
+    """Constructing a check renders all of its files."""
+    results = OrderedDict()
+    with TemporaryDirectory() as d:
+        for check_name, flavors in Checks.items():
+            for check_class in OrderedDict.fromkeys(flavors.values()):
+                results['{}:{}'.format(check_name, check_class.flavor)] = [
+                    time_loop(render, check_class, d) for _ in range(runs)
+                ]
+
+    return results
+
+
+def bench_lifecycle(runs, fake):
+    """Full `di start`, `di check` and `di stop` invocations of one environment."""
+    results = OrderedDict((command, []) for command in ('start', 'check', 'stop'))
+
+    with TemporaryDirectory() as d:
+        env = dict(os.environ)
+        env.update(fake.env_vars)
+        # Keeps the user's settings and caches out of the measurements
+        env['XDG_DATA_HOME'] = os.path.join(d, 'data')
+        location = os.path.join(d, 'envs')
+
+        for _ in range(runs):
+            results['start'].append(time_call(run_di, 'start', 'nginx', '-l', location, '-f', env=env))
+            results['check'].append(time_call(run_di, 'check', 'nginx', '-l', location, env=env))
+            results['stop'].append(time_call(run_di, 'stop', 'nginx', '-l', location, env=env))
+
+    return results
+
+
+def run_benchmarks(names, runs, latency):
+    results = OrderedDict()
+
+    def record(group, samples):
+        for name, values in samples.items():
+            results['{}: {}'.format(group, name)] = get_statistics(values)
+
+    if 'import' in names:
+        record('import', bench_import(runs))
+    if 'settings' in names:
+        record('settings', bench_settings(runs))
+    if 'render' in names:
+        record('render', bench_render(runs))
+
+    lifecycle = [name for name in ('start', 'check', 'stop') if name in names]
+    if lifecycle:
+        with FakeDockerCLI(latency=latency) as fake:
+            samples = bench_lifecycle(runs, fake)
+        record('cli', OrderedDict((name, samples[name]) for name in lifecycle))
+
+    return OrderedDict([
+        ('meta', OrderedDict([
+            ('di', __version__),
+            ('python', platform.python_version()),
+            ('implementation', platform.python_implementation()),
+            ('platform', platform.platform()),
+            ('runs', runs),
+            ('latency', latency),
+            ('unit', 'ms'),
+        ])),
+        ('results', results),
+    ])
+
+
+def compare(results, baseline, threshold):
+    """Prints the change of every median and returns the benchmarks that regressed more than `threshold` percent."""
+    regressions = []
+    for name, stats in results['results'].items():
+        old = baseline['results'].get(name)
+        if not old:
+            print('{:<32}{:>10.2f}{:>12}'.format(name, stats['median'], 'new'))
+            continue
+
+        change = (stats['median'] - old['median']) / old['median'] * 100
+        print('{:<32}{:>10.2f}{:>+11.1f}%'.format(name, stats['median'], change))
+        if change > threshold:
+            regressions.append(name)
+
+    return regressions
+
+
+def run_at_ref(ref, names, runs, latency):
+    """Runs the benchmarks of the commit `ref` and returns its results, or None if it could not be benchmarked."""
+    with TemporaryDirectory() as d:
+        worktree = os.path.join(d, 'worktree')
+        process = subprocess.run(
+            ['git', 'worktree', 'add', '--detach', worktree, ref], stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+        )
+        if process.returncode:
+            print(process.stdout.decode().rstrip())
+            return None
+
+        try:
+            output = os.path.join(d, 'baseline.json')
+            process = subprocess.run(
+                [sys.executable, '-m', 'benchmarks', *names, '--runs', str(runs), '--latency', str(latency),
+                 '--output', output],
+                cwd=worktree, env=dict(os.environ, PYTHONPATH=worktree)
+            )
+            if process.returncode:
+                return None
+
+            with open(output) as f:
+                return json.loads(f.read())
+        finally:
+            subprocess.run(['git', 'worktree', 'remove', '--force', worktree])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='Benchmarks the di CLI.')
+    parser.add_argument('benchmarks', nargs='*', metavar='BENCHMARK',
+                        help='Any of {}, defaulting to all of them.'.format(', '.join(BENCHMARKS)))
+    parser.add_argument('--runs', '-n', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0,
+                        help='Seconds every fake `docker`/`docker-compose` invocation takes.')
+    parser.add_argument('--output', '-o', help='Writes results to this file as JSON.')
+    parser.add_argument('--compare', '-c', help='A previous JSON output to compare medians against.')
+    parser.add_argument('--against', '-a', metavar='REF',
+                        help='A commit to benchmark first and compare medians against.')
+    parser.add_argument('--threshold', type=float, default=10,
+                        help='Percent by which a median may grow before it is a regression.')
+    args = parser.parse_args(argv)
+
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error('unknown benchmarks: {}'.format(', '.join(sorted(unknown))))
+    if args.compare and args.against:
+        parser.error('--compare and --against are mutually exclusive')
+
+    benchmarks = args.benchmarks or BENCHMARKS
+    if 'import' in benchmarks:
+        eager_imports = find_eager_imports()
+        if eager_imports:
+            print('`import di.cli` must not load: {}'.format(', '.join(eager_imports)))
+            return 1
+
+    baseline = None
+    if args.against:
+        print('Baseline at `{}`:'.format(args.against))
+        baseline = run_at_ref(args.against, args.benchmarks, args.runs, args.latency)
+        if baseline is None:
+            print('Unable to benchmark `{}`.'.format(args.against))
+            return 1
+        print()
+    elif args.compare:
+        with open(args.compare) as f:
+            baseline = json.loads(f.read())
+
+    results = run_benchmarks(benchmarks, args.runs, args.latency)
+
+    print('{:<32}{:>10}{:>10}{:>10}{:>10}'.format('ms', 'min', 'median', 'p95', 'max'))
+    for name, stats in results['results'].items():
+        print('{:<32}{:>10.2f}{:>10.2f}{:>10.2f}{:>10.2f}'.format(name, *stats.values()))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(json.dumps(results, indent=2))
+
+    if baseline is not None:
+        print()
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print('Regressed by more than {}%: {}'.format(args.threshold, ', '.join(regressions)))
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,3 +1,5 @@
+import re
+
 A5_CHECK_DIR = '/etc/dd-agent/checks.d'
 A5_CONF_DIR = '/etc/dd-agent/conf.d'
 A5_EXE_PATH = '/opt/datadog-agent/agent/agent.py'
@@ -26,3 +28,43 @@ def get_conf_example_glob(check, agent_version_major):
         return '{conf_dir}/{check}.d/conf*'.format(conf_dir=A6_CONF_DIR, check=check)
     else:
         return '{conf_dir}/{check}*'.format(conf_dir=A5_CONF_DIR, check=check)
+
+
+# Printed by Agent 6 for every check it runs, e.g. `Average Execution Time : 12ms`
+A6_STAT_PATTERNS = {
+    'execution_time': re.compile(r'Average Execution Time\s*:\s*([\d.]+)(ms|s)'),
+    'total_runs': re.compile(r'Total Runs\s*:\s*(\d+)'),
+    'metrics': re.compile(r'\bMetrics\s*:\s*(\d+)'),
+    'events': re.compile(r'\bEvents\s*:\s*(\d+)'),
+    'service_checks': re.compile(r'Service Checks\s*:\s*(\d+)'),
+}
+A6_CHECK_VERSION_PATTERN = re.compile(r'^\s*(\w+) \(([^)]+)\)\s*$', re.MULTILINE)
+
+
+def get_check_times_args(times, pause=0):
+    """Arguments for Agent 6 to run a check several times in one process, `pause` being in seconds."""
+    return ['--check-times', str(times), '--pause', str(int(pause * 1000))]
+
+
+def parse_check_stats(output, check=None):
+    """Extracts the statistics an agent reports after running a check. Agent 5
+    reports none of these, so missing values are None.
+    """
+    stats = {}
+    for stat, pattern in A6_STAT_PATTERNS.items():
+        match = pattern.search(output)
+        if not match:
+            stats[stat] = None
+        elif stat == 'execution_time':
+            value = float(match.group(1))
+            stats[stat] = value * 1000 if match.group(2) == 's' else value
+        else:
+            stats[stat] = int(match.group(1))
+
+    stats['version'] = None
+    for name, version in A6_CHECK_VERSION_PATTERN.findall(output):
+        if check is None or name == check:
+            stats['version'] = version
+            break
+
+    return stats
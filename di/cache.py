@@ -0,0 +1,132 @@
+import json
+import os
+import threading
+import time
+
+from atomicwrites import atomic_write
+
+from di.utils import APP_DIR, dir_exists, ensure_parent_dir_exists, remove_path
+
+CACHE_DIR = os.path.join(APP_DIR, 'cache')
+IMAGE_CACHE_DIR = os.path.join(CACHE_DIR, 'images')
+PULLS_FILE = os.path.join(CACHE_DIR, 'pulls.json')
+PLUGINS_FILE = os.path.join(CACHE_DIR, 'plugins.json')
+
+__pulls_lock = threading.Lock()
+
+# Digest -> lock, as environments sharing an image update its entry concurrently
+__image_cache_locks = {}
+__image_cache_locks_lock = threading.Lock()
+
+
+def get_image_cache_file(digest):
+    # Colons are not allowed in file names on Windows
+    return os.path.join(IMAGE_CACHE_DIR, '{}.json'.format(digest.replace(':', '_')))
+
+
+def load_image_cache(digest):
+    try:
+        with open(get_image_cache_file(digest), 'r') as f:
+            return json.loads(f.read())
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def save_image_cache(digest, data):
+    cache_file = get_image_cache_file(digest)
+    ensure_parent_dir_exists(cache_file)
+
+    data['digest'] = digest
+    with atomic_write(cache_file, overwrite=True) as f:
+        f.write(json.dumps(data, indent=2, sort_keys=True))
+
+
+def get_image_cache_lock(digest):
+    with __image_cache_locks_lock:
+        return __image_cache_locks.setdefault(digest, threading.Lock())
+
+
+def update_image_cache(digest, image=None, agent_version=None, example_confs=None):
+    with get_image_cache_lock(digest):
+        data = load_image_cache(digest)
+
+        if image:
+            images = data.setdefault('images', [])
+            if image not in images:
+                images.append(image)
+
+        if agent_version:
+            data['agent_version'] = str(agent_version)
+
+        if example_confs:
+            data.setdefault('example_confs', {}).update(example_confs)
+
+        save_image_cache(digest, data)
+        return data
+
+
+def get_cached_agent_version(digest):
+    return load_image_cache(digest).get('agent_version', '')
+
+
+def get_cached_example_conf(digest, check):
+    return load_image_cache(digest).get('example_confs', {}).get(check)
+
+
+def remove_image_cache(digest):
+    remove_path(get_image_cache_file(digest))
+
+
+def list_image_caches():
+    if not dir_exists(IMAGE_CACHE_DIR):
+        return []
+
+    caches = []
+    for entry in sorted(os.listdir(IMAGE_CACHE_DIR)):
+        if entry.endswith('.json'):
+            data = load_image_cache(entry[:-len('.json')].replace('_', ':', 1))
+            if data:
+                caches.append(data)
+
+    return caches
+
+
+def load_pull_records():
+    try:
+        with open(PULLS_FILE, 'r') as f:
+            return json.loads(f.read())
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def get_pull_record(image):
+    return load_pull_records().get(image, {})
+
+
+def record_pull(image, digest, timestamp=None):
+    with __pulls_lock:
+        records = load_pull_records()
+        records[image] = {'digest': digest, 'time': time.time() if timestamp is None else timestamp}
+
+        ensure_parent_dir_exists(PULLS_FILE)
+        with atomic_write(PULLS_FILE, overwrite=True) as f:
+            f.write(json.dumps(records, indent=2, sort_keys=True))
+
+
+def load_plugin_cache():
+    try:
+        with open(PLUGINS_FILE, 'r') as f:
+            return json.loads(f.read())
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def save_plugin_cache(key, plugins, sources=()):
+    ensure_parent_dir_exists(PLUGINS_FILE)
+    with atomic_write(PLUGINS_FILE, overwrite=True) as f:
+        f.write(json.dumps({'key': key, 'plugins': plugins, 'sources': list(sources)}, indent=2, sort_keys=True))
+
+
+def clear_image_cache():
+    # Pull times and plugin metadata are not entries of `di cache ls` and are kept
+    remove_path(IMAGE_CACHE_DIR)
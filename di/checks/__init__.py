@@ -1,16 +1,18 @@
 from collections import OrderedDict as __OD
 
 from di.utils import DEFAULT_NAME
-from .envoy import EnvoyFront
-from .nginx import NginxStub
+from .registry import Flavors, discover_plugins, register_plugins
 
 Checks = __OD([
-    ('envoy', __OD([
-        (DEFAULT_NAME, EnvoyFront),
-        (EnvoyFront.flavor, EnvoyFront),
+    ('envoy', Flavors([
+        (DEFAULT_NAME, 'di.checks.envoy.front:EnvoyFront'),
+        ('front', 'di.checks.envoy.front:EnvoyFront'),
     ])),
-    ('nginx', __OD([
-        (DEFAULT_NAME, NginxStub),
-        (NginxStub.flavor, NginxStub),
+    ('nginx', Flavors([
+        (DEFAULT_NAME, 'di.checks.nginx.stub:NginxStub'),
+        ('stub', 'di.checks.nginx.stub:NginxStub'),
     ])),
 ])
+
+# Checks from installed packages, see `di.checks.registry`
+register_plugins(Checks, discover_plugins())
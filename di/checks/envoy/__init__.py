@@ -1 +0,0 @@
-from .front import EnvoyFront
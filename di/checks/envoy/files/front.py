@@ -4,9 +4,7 @@ version: '3'
 services:
 
   front-envoy:
-    build:
-      context: .
-      dockerfile: Dockerfile-frontenvoy
+    image: {front_image}
     volumes:
       - ./front-envoy.yaml:/etc/front-envoy.yaml
     networks:
@@ -15,13 +13,11 @@ services:
       - "80"
       - "8001"
     ports:
-      - "8000:80"
-      - "8001:8001"
+      - "{front_port}:80"
+      - "{admin_port}:8001"
 
   service1:
-    build:
-      context: .
-      dockerfile: Dockerfile-service
+    image: {service_image}
     volumes:
       - ./service-envoy.yaml:/etc/service-envoy.yaml
     networks:
@@ -34,9 +30,7 @@ services:
       - "80"
 
   service2:
-    build:
-      context: .
-      dockerfile: Dockerfile-service
+    image: {service_image}
     volumes:
       - ./service-envoy.yaml:/etc/service-envoy.yaml
     networks:
@@ -57,12 +51,13 @@ services:
       {conf_mount}
       {check_mount}
       {base_mount}
+      {cache_mount}
     networks:
       - envoymesh
 
 networks:
   envoymesh: {{}}
-"""
+{cache_volumes}"""
 
 DOCKERFILE_FRONT = """\
 FROM envoyproxy/envoy:{version}
@@ -1,4 +1,6 @@
-from di.structures import DockerCheck, File
+from collections import OrderedDict
+
+from di.structures import Build, DockerCheck, File
 from .files.front import (
     COMPOSE_YAML, DOCKERFILE_FRONT, DOCKERFILE_SERVICE, FRONT_CONFIG,
     SERVICE_CONFIG, START_SERVICE_SCRIPT, SERVICE_APP
@@ -8,7 +10,12 @@ from .files.front import (
 class EnvoyFront(DockerCheck):
     name = 'envoy'
     flavor = 'front'
-    requires_build = True
+    requires_build = False
+    host_ports = OrderedDict([
+        ('front_port', 80),
+        ('admin_port', 8001),
+    ])
+    agent_network = 'envoymesh'
 
     def __init__(self, d, api_key, conf_path, conf_contents, agent_version, check_dirs=None,
                  instance_name=None, no_instance=False, direct=False, **options):
@@ -20,44 +27,42 @@ class EnvoyFront(DockerCheck):
         # Correct domain; localhost is per container
         conf_contents = conf_contents.replace('localhost:80', 'front-envoy:8001', 1)
 
-        dockerfile_front = self.locate_file('Dockerfile-frontenvoy')
-        dockerfile_service = self.locate_file('Dockerfile-service')
         front_config = self.locate_file('front-envoy.yaml')
         service_config = self.locate_file('service-envoy.yaml')
-        start_service_script = self.locate_file('start_service.sh')
-        service_app = self.locate_file('service.py')
 
         self.files.update({
             self.conf_path_local: File(
                 self.conf_path_local,
-                conf_contents
+                conf_contents,
+                services=('agent', )
             ),
             self.compose_path: File(
                 self.compose_path,
                 self.format_compose_file(COMPOSE_YAML)
             ),
-            dockerfile_front: File(
-                dockerfile_front,
-                DOCKERFILE_FRONT.format(**self.options)
-            ),
-            dockerfile_service: File(
-                dockerfile_service,
-                DOCKERFILE_SERVICE
-            ),
             front_config: File(
                 front_config,
-                FRONT_CONFIG
+                FRONT_CONFIG,
+                services=('front-envoy', )
             ),
             service_config: File(
                 service_config,
-                SERVICE_CONFIG
-            ),
-            start_service_script: File(
-                start_service_script,
-                START_SERVICE_SCRIPT
-            ),
-            service_app: File(
-                service_app,
-                SERVICE_APP
+                SERVICE_CONFIG,
+                services=('service1', 'service2')
             ),
         })
+
+    @classmethod
+    def get_builds(cls, options):
+        # Images are built once per distinct set of inputs and then shared by all instances
+        return OrderedDict([
+            ('front_image', Build(
+                'envoy-front',
+                DOCKERFILE_FRONT.format(**options)
+            )),
+            ('service_image', Build(
+                'envoy-service',
+                DOCKERFILE_SERVICE,
+                {'service.py': SERVICE_APP, 'start_service.sh': START_SERVICE_SCRIPT}
+            )),
+        ])
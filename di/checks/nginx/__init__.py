@@ -1 +0,0 @@
-from .stub import NginxStub
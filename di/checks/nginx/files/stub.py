@@ -17,7 +17,8 @@ services:
       {conf_mount}
       {check_mount}
       {base_mount}
-"""
+      {cache_mount}
+{cache_volumes}"""
 
 STATUS_CONF = """\
 server {
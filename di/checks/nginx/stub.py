@@ -22,7 +22,8 @@ class NginxStub(DockerCheck):
         self.files.update({
             self.conf_path_local: File(
                 self.conf_path_local,
-                conf_contents
+                conf_contents,
+                services=('agent', )
             ),
             self.compose_path: File(
                 self.compose_path,
@@ -30,6 +31,11 @@ class NginxStub(DockerCheck):
             ),
             status_path: File(
                 status_path,
-                STATUS_CONF
+                STATUS_CONF,
+                services=('nginx', )
             ),
         })
+
+    @classmethod
+    def get_service_images(cls, options):
+        return ['nginx:{version}'.format(**options)]
@@ -0,0 +1,149 @@
+import hashlib
+import os
+import sys
+from collections import OrderedDict
+from collections.abc import Mapping
+from importlib import import_module
+
+from di.cache import load_plugin_cache, save_plugin_cache
+from di.utils import DEFAULT_NAME
+
+# Entry points named `CHECK.FLAVOR`, or just `CHECK` for its default flavor,
+# whose values are the `module:class` paths of check classes
+ENTRY_POINT_GROUP = 'di.checks'
+# The directories distributions are installed into, e.g. `dist-packages` on Debian
+SITE_DIR_NAMES = ('site-packages', 'dist-packages')
+
+
+def load_object(path):
+    module, _, name = path.partition(':')
+    return getattr(import_module(module), name)
+
+
+class Flavors(Mapping):
+    """Maps flavors to check classes given as `module:class` paths, importing
+    a flavor's module, and with it its templates, only once it is requested.
+    """
+    def __init__(self, flavors):
+        self.paths = OrderedDict(flavors)
+        self.classes = {}
+
+    def register(self, flavor, path):
+        """Adds a flavor unless it already exists, returning whether it was added."""
+        if flavor in self.paths:
+            return False
+
+        self.paths[flavor] = path
+        return True
+
+    def __getitem__(self, flavor):
+        check_class = self.classes.get(flavor)
+        if check_class is None:
+            check_class = self.classes[flavor] = load_object(self.paths[flavor])
+        return check_class
+
+    def __contains__(self, flavor):
+        return flavor in self.paths
+
+    def __iter__(self):
+        return iter(self.paths)
+
+    def __len__(self):
+        return len(self.paths)
+
+
+def get_site_dirs(paths=None):
+    """Returns the entries of `sys.path` that distributions are installed into.
+    Others, like the current directory, only change what is importable.
+    """
+    return [
+        path for path in (sys.path if paths is None else paths)
+        if os.path.basename(os.path.normpath(path)) in SITE_DIR_NAMES
+    ]
+
+
+def get_distributions_key(sources=(), paths=None):
+    """Fingerprints installed plugins by modification time. Site directories
+    change whenever a distribution is installed, upgraded or removed in them,
+    and `sources`, the metadata directories of known plugins, whenever one is
+    reinstalled in place, e.g. in development mode. This only needs a few stats,
+    rather than reading every distribution's metadata.
+    """
+    digest = hashlib.sha256()
+
+    file_paths = get_site_dirs(paths) + [os.path.join(source, 'entry_points.txt') for source in sorted(sources)]
+    for file_path in file_paths:
+        try:
+            mtime = os.stat(file_path).st_mtime
+        except OSError:
+            mtime = None
+        digest.update('{}:{}\0'.format(file_path, mtime).encode('utf-8', 'surrogateescape'))
+
+    return digest.hexdigest()
+
+
+def iter_entry_points(group):
+    """Yields the name, `module:class` path and metadata directory of every
+    entry point of `group`, by the precedence of their distributions.
+    """
+    try:
+        from importlib.metadata import distributions
+    except ImportError:
+        import pkg_resources
+
+        for entry_point in pkg_resources.iter_entry_points(group):
+            dist = entry_point.dist
+            yield (
+                entry_point.name,
+                '{}:{}'.format(entry_point.module_name, '.'.join(entry_point.attrs)),
+                getattr(dist, 'egg_info', None) or dist.location
+            )
+        return
+
+    for dist in distributions():
+        # Only path based distributions, i.e. nearly all of them, have a metadata directory
+        source = getattr(dist, '_path', None)
+        for entry_point in dist.entry_points:
+            if entry_point.group == group:
+                # Drop any extras, e.g. `module:class [extra]`
+                yield entry_point.name, entry_point.value.split('[')[0].strip(), source and str(source)
+
+
+def discover_plugins(group=ENTRY_POINT_GROUP, paths=None):
+    """Returns a mapping of check to flavor to `module:class` path of every
+    installed plugin, reusing the last discovery if no plugin may have changed.
+    """
+    cache = load_plugin_cache()
+    if cache.get('key') == get_distributions_key(cache.get('sources', ()), paths):
+        return cache['plugins']
+
+    plugins = {}
+    sources = set()
+    for name, path, source in iter_entry_points(group):
+        check_name, _, flavor = name.partition('.')
+        plugins.setdefault(check_name, {}).setdefault(flavor or DEFAULT_NAME, path)
+        if source:
+            sources.add(source)
+
+    try:
+        save_plugin_cache(get_distributions_key(sources, paths), plugins, sorted(sources))
+    except OSError:  # no cov
+        pass
+
+    return plugins
+
+
+def register_plugins(checks, plugins):
+    """Adds plugins to `checks` without replacing existing checks or flavors. A new
+    check with no explicit default flavor defaults to its first flavor by name.
+    """
+    for check_name, flavors in sorted(plugins.items()):
+        if check_name not in checks:
+            checks[check_name] = Flavors([])
+
+        registry = checks[check_name]
+        for flavor, path in sorted(flavors.items()):
+            registry.register(flavor, path)
+
+        if DEFAULT_NAME not in registry and registry.paths:
+            registry.register(DEFAULT_NAME, next(iter(registry.paths.values())))
@@ -1,19 +1,46 @@
 import click
 
-from di.commands import (
-    check, config, start, stop, test
-)
-from di.commands.utils import CONTEXT_SETTINGS
+from di.commands.utils import CONTEXT_SETTINGS, LazyGroup
 
+# Commands are imported on demand, as most invocations only need one of them.
+# Their short help is repeated here so that listing them imports none.
+COMMANDS = {
+    'cache': ('di.commands.cache:cache', 'Locates, inspects, or prunes caches'),
+    'check': ('di.commands.check:check', 'Runs checks'),
+    'config': ('di.commands.config:config', 'Locates, updates, or restores the config file'),
+    'down': ('di.commands.down:down', 'Stops environments listed in a manifest'),
+    'ls': ('di.commands.ls:list_envs', 'Lists environments'),
+    'pool': ('di.commands.pool:pool', 'Manages idle agent containers for fast starts'),
+    'start': ('di.commands.start:start', 'Starts fully functioning integrations'),
+    'stop': ('di.commands.stop:stop', 'Stops integrations'),
+    'test': ('di.commands.test:test', 'Tests a check running in dev mode'),
+    'up': ('di.commands.up:up', 'Creates environments listed in a manifest'),
+}
 
-@click.group(context_settings=CONTEXT_SETTINGS)
-@click.version_option()
-def di():
-    pass
 
+def report_spans(timings, trace_file):
+    from di.trace import format_timings, get_spans, write_chrome_trace
+
+    spans = get_spans()
+    if timings:
+        click.echo()
+        click.echo(format_timings(spans))
+    if trace_file:
+        write_chrome_trace(trace_file, spans)
+
+
+@click.group(cls=LazyGroup, lazy_commands=COMMANDS, context_settings=CONTEXT_SETTINGS)
+@click.option('--timings', is_flag=True,
+              help='Prints how long each phase of the command took, e.g. pulls, builds and compose up.')
+@click.option('--trace', 'trace_file',
+              help='Writes the phases of the command to this file in the Chrome trace format, '
+                   'for viewing in about:tracing or Perfetto.')
+@click.version_option()
+@click.pass_context
+def di(ctx, timings, trace_file):
+    if timings or trace_file:
+        from di.trace import enable_tracing
 
-di.add_command(check)
-di.add_command(config)
-di.add_command(start)
-di.add_command(stop)
-di.add_command(test)
+        enable_tracing()
+        # Also runs when the command exits early with `sys.exit`
+        ctx.call_on_close(lambda: report_spans(timings, trace_file))
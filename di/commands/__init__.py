@@ -1,5 +0,0 @@
-from .check import check
-from .config import config
-from .start import start
-from .stop import stop
-from .test import test
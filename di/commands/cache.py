@@ -0,0 +1,174 @@
+import sys
+from fnmatch import fnmatch
+
+import click
+
+from di.cache import CACHE_DIR, clear_image_cache, list_image_caches, remove_image_cache
+from di.commands.utils import CONTEXT_SETTINGS, echo_failure, echo_info, echo_success, echo_waiting, echo_warning
+from di.docker import get_image_digest, list_cache_volumes, remove_volumes
+from di.metadata import index_environments
+from di.settings import load_settings
+from di.utils import CHECKS_DIR
+
+
+@click.group(context_settings=CONTEXT_SETTINGS, invoke_without_command=True,
+             short_help='Locates, inspects, or prunes caches')
+@click.pass_context
+def cache(ctx):
+    """Locates, inspects, or prunes the cache of image introspection
+    results, i.e. agent versions and example configuration files, and
+    the volumes of test dependencies of dev environments.
+
+    \b
+    $ di cache
+    "/home/ofek/.local/share/di-dev/cache"
+    """
+    if not ctx.invoked_subcommand:
+        echo_info('"{}"'.format(CACHE_DIR))
+
+
+@cache.command('ls', context_settings=CONTEXT_SETTINGS,
+               short_help='Lists cached images')
+def list_cache():
+    """Lists cached images.
+
+    \b
+    $ di cache ls
+    sha256:6d4f2c91a0b3
+      images: datadog/agent-dev:master
+      agent: 6
+      example confs: nginx
+    """
+    caches = list_image_caches()
+    if not caches:
+        echo_info('The cache is empty.')
+        return
+
+    for data in caches:
+        echo_success(data['digest'][:19])
+        echo_info('  images: {}'.format(', '.join(data.get('images', []))))
+        echo_info('  agent: {}'.format(data.get('agent_version', '?')))
+        echo_info('  example confs: {}'.format(', '.join(sorted(data.get('example_confs', {})))))
+
+
+@cache.command(context_settings=CONTEXT_SETTINGS,
+               short_help='Removes entries of images no longer present')
+@click.option('--all', '-a', 'prune_all', is_flag=True,
+              help='Removes every image entry, present or not.')
+def prune(prune_all):
+    """Removes cache entries of images that are no longer present locally.
+
+    \b
+    $ di cache prune
+    Pruning the cache... success!
+    Removed 1 entry.
+    """
+    echo_waiting('Pruning the cache... ', nl=False)
+
+    if prune_all:
+        removed = len(list_image_caches())
+        clear_image_cache()
+    else:
+        removed = 0
+        for data in list_image_caches():
+            if not get_image_digest(data['digest']):
+                remove_image_cache(data['digest'])
+                removed += 1
+
+    echo_success('success!')
+    echo_info('Removed {} entr{}.'.format(removed, 'y' if removed == 1 else 'ies'))
+
+
+def get_volume_environments(location):
+    """Maps cache volumes to the environments under `location` they belong to."""
+    return {
+        environment['metadata']['cache_volume']: environment
+        for environment in index_environments(location)
+        if environment['metadata'].get('cache_volume')
+    }
+
+
+@cache.command(context_settings=CONTEXT_SETTINGS,
+               short_help='Lists volumes of test dependencies')
+@click.option('--location', '-l', default='')
+def volumes(location):
+    """Lists the volumes in which dev environments keep tox envs and the pip
+    cache, along with the hash of the dependencies their tox envs were
+    last built for. Volumes outlive their environments until evicted.
+
+    \b
+    $ di cache volumes
+    di_cache_agent_nginx_stub_default  nginx:stub:default  deps 3f2a9c0b71de
+    """
+    settings = load_settings()
+    location = location or settings.get('location', CHECKS_DIR)
+
+    cache_volumes, error = list_cache_volumes()
+    if error:
+        echo_failure('An unexpected Docker error (status {}) has occurred.'.format(error))
+        sys.exit(error)
+
+    if not cache_volumes:
+        echo_info('There are no cache volumes.')
+        return
+
+    environments = get_volume_environments(location)
+    width = max(len(volume['name']) for volume in cache_volumes)
+    for volume in cache_volumes:
+        environment = environments.get(volume['name'])
+        if environment:
+            echo_success('{}  {}  deps {}'.format(
+                volume['name'].ljust(width), volume['label'], environment['metadata'].get('cache_key') or '?'
+            ))
+        else:
+            echo_warning('{}  {}  (no environment)'.format(volume['name'].ljust(width), volume['label']))
+
+
+@cache.command(context_settings=CONTEXT_SETTINGS,
+               short_help='Removes volumes of test dependencies')
+@click.argument('patterns', nargs=-1)
+@click.option('--all', '-a', 'evict_all', is_flag=True,
+              help='Removes every cache volume.')
+def evict(patterns, evict_all):
+    """Removes the cache volumes of environments whose CHECK:FLAVOR:INSTANCE
+    matches any of the given globs. Volumes of running environments are in
+    use and thus kept.
+
+    \b
+    $ di cache evict 'nginx:*'
+    Evicting cache volumes... success!
+    Removed 1 volume.
+    """
+    if not (patterns or evict_all):
+        echo_failure('Missing a pattern such as `nginx:*`, or --all.')
+        sys.exit(1)
+
+    echo_waiting('Evicting cache volumes... ', nl=False)
+    cache_volumes, error = list_cache_volumes()
+    if error:
+        click.echo()
+        echo_failure('An unexpected Docker error (status {}) has occurred.'.format(error))
+        sys.exit(error)
+
+    names = [
+        volume['name'] for volume in cache_volumes
+        if evict_all or any(fnmatch(volume['label'], pattern) for pattern in patterns)
+    ]
+
+    # Each volume is removed on its own so that those in use do not prevent the others
+    errors = []
+    for name in names:
+        output, error = remove_volumes([name])
+        if error:
+            errors.append(output)
+
+    if errors:
+        click.echo()
+        for output in errors:
+            click.echo(output.rstrip())
+        echo_warning('{} of {} volumes could not be removed.'.format(len(errors), len(names)))
+    else:
+        echo_success('success!')
+
+    removed = len(names) - len(errors)
+    echo_info('Removed {} volume{}.'.format(removed, '' if removed == 1 else 's'))
@@ -1,26 +1,242 @@
+import json
 import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 import click
 
+from di.agent import parse_check_stats
 from di.checks import Checks
-from di.commands.utils import CONTEXT_SETTINGS, echo_failure
-from di.docker import run_check
+from di.commands.ls import list_environments, select_environments
+from di.commands.utils import (
+    CONTEXT_SETTINGS, echo_failure, echo_info, echo_success, echo_warning, get_environment_label
+)
+from di.docker import get_agent_version, run_check, time_check
+from di.metadata import read_env_metadata
 from di.settings import load_settings
-from di.utils import CHECKS_DIR, DEFAULT_NAME
+from di.utils import CHECKS_DIR, DEFAULT_NAME, get_statistics
 
 
-@click.command(context_settings=CONTEXT_SETTINGS, short_help='Runs a check')
-@click.argument('check_name')
+def benchmark_check(container_name, check_name, agent_version, runs, interval=0, reuse=False, output=None):
+    """Runs a check `runs` times and returns every run's wall and agent-reported
+    execution times in milliseconds, the latter being None if the agent does not
+    report it. With `reuse`, Agent 6 runs the check in a single process and only
+    reports its average, so there is a single sample covering all runs whose wall
+    time is that of the whole process, startup included, divided by `runs`.
+    """
+    samples = []
+    check_version = None
+    error = ''
+
+    if reuse:
+        result, returncode, elapsed = time_check(
+            container_name, check_name, agent_version, times=runs, pause=interval
+        )
+        stats = parse_check_stats(result, check_name)
+        check_version = stats['version']
+        error = result if returncode else ''
+        samples.append(OrderedDict([
+            ('wall', elapsed * 1000 / runs),
+            ('agent', stats['execution_time']),
+            ('returncode', returncode),
+        ]))
+    else:
+        for run in range(1, runs + 1):
+            if run > 1 and interval:
+                time.sleep(interval)
+
+            result, returncode, elapsed = time_check(container_name, check_name, agent_version)
+            stats = parse_check_stats(result, check_name)
+            check_version = check_version or stats['version']
+            error = result if returncode else error
+            samples.append(OrderedDict([
+                ('wall', elapsed * 1000),
+                ('agent', stats['execution_time']),
+                ('returncode', returncode),
+            ]))
+
+            if output is not None:
+                output('Run {}/{}: {:.1f} ms{}'.format(
+                    run, runs, elapsed * 1000, ' (failed, status {})'.format(returncode) if returncode else ''
+                ))
+
+    return OrderedDict([
+        ('check', check_name),
+        ('check_version', check_version),
+        ('agent_version', agent_version),
+        ('runs', runs),
+        ('interval', interval),
+        ('reuse', reuse),
+        ('failures', sum(1 for sample in samples if sample['returncode'])),
+        ('wall', get_statistics(sample['wall'] for sample in samples)),
+        ('agent', get_statistics(sample['agent'] for sample in samples if sample['agent'] is not None)),
+        ('samples', samples),
+        ('error', error),
+    ])
+
+
+def echo_benchmark(results):
+    echo_success('{:<12}{:>10}{:>10}{:>10}{:>10}'.format('ms', 'min', 'median', 'p95', 'max'))
+    for name in ('wall', 'agent'):
+        stats = results[name]
+        if stats:
+            echo_info('{:<12}{:>10.1f}{:>10.1f}{:>10.1f}{:>10.1f}'.format(name, *stats.values()))
+        else:
+            echo_info('{:<12}{:>10}'.format(name, 'n/a'))
+
+
+def check_environment(environment):
+    """Runs the check of an environment, as given by `di.commands.ls.list_environments`,
+    with its output captured and returns its exit status, duration and metric counts.
+    """
+    container_name = environment['container_name']
+    result = OrderedDict([
+        ('environment', get_environment_label(environment['check'], environment['flavor'], environment['instance'])),
+        ('returncode', 1),
+        ('duration', None),
+        ('metrics', None),
+        ('events', None),
+        ('service_checks', None),
+        ('output', ''),
+    ])
+
+    try:
+        agent_version = (
+            environment['metadata'].get('agent_version') or get_agent_version(container_name, running=True)
+        )
+        output, returncode, elapsed = time_check(container_name, environment['check'], agent_version)
+    except Exception as e:
+        result['output'] = str(e)
+        return result
+
+    stats = parse_check_stats(output, environment['check'])
+    result.update(
+        returncode=returncode, duration=elapsed * 1000, metrics=stats['metrics'],
+        events=stats['events'], service_checks=stats['service_checks'], output=output
+    )
+    return result
+
+
+def check_environments(environments, workers):
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        return list(executor.map(check_environment, environments))
+
+
+def echo_check_results(results):
+    width = max(len(result['environment']) for result in results + [{'environment': 'ENVIRONMENT'}])
+    row = '{:<%d}  {:<8}{:>10}{:>9}{:>8}{:>16}' % width
+
+    echo_success(row.format('ENVIRONMENT', 'STATUS', 'DURATION', 'METRICS', 'EVENTS', 'SERVICE CHECKS'))
+    for result in results:
+        line = row.format(
+            result['environment'],
+            'failed {}'.format(result['returncode']) if result['returncode'] else 'ok',
+            '-' if result['duration'] is None else '{:.0f} ms'.format(result['duration']),
+            *('-' if result[stat] is None else result[stat] for stat in ('metrics', 'events', 'service_checks'))
+        )
+        if result['returncode']:
+            echo_failure(line)
+        else:
+            echo_info(line)
+
+
+@click.command(context_settings=CONTEXT_SETTINGS, short_help='Runs checks')
+@click.argument('check_name', required=False)
 @click.argument('flavor', required=False, default=DEFAULT_NAME)
 @click.argument('instance_name', required=False, default=DEFAULT_NAME)
 @click.option('--direct', '-d', is_flag=True)
 @click.option('--location', '-l', default='')
-def check(check_name, flavor, instance_name, direct, location):
-    """Runs a check.
+@click.option('--runs', '-n', type=click.IntRange(1), default=1,
+              help='Runs the check this many times and reports timing statistics.')
+@click.option('--interval', '-i', type=click.FLOAT, default=0,
+              help='Seconds to wait between runs.')
+@click.option('--reuse', is_flag=True,
+              help='Runs every iteration in one agent process (Agent 6 only). Its startup is then '
+                   'paid once and spread across the runs\' wall time, and the agent only reports '
+                   'the average execution time.')
+@click.option('--json', 'json_file', type=click.Path(dir_okay=False),
+              help='Writes the benchmark or aggregated results to this file as JSON.')
+@click.option('--all', '-a', 'check_all', is_flag=True,
+              help='Runs the check of every running environment.')
+@click.option('--check', '-c', 'checks', multiple=True,
+              help='Runs the check of every running environment of this check.')
+@click.option('--flavor', 'flavors', multiple=True,
+              help='Runs the check of every running environment of this flavor.')
+@click.option('--match', '-m', 'patterns', multiple=True,
+              help='Runs the check of running environments whose CHECK:FLAVOR:INSTANCE matches this glob.')
+@click.option('--workers', '-w', type=click.INT,
+              help='The maximum number of checks to run at once.')
+def check(check_name, flavor, instance_name, direct, location, runs, interval, reuse, json_file,
+          check_all, checks, flavors, patterns, workers):
+    """Runs a check, or with selectors, those of several running environments at once.
 
     \b
     $ di check nginx
+
+    With --runs, the check's output is hidden and the wall time of every run
+    plus the execution time the agent reports are summarized instead:
+
+    \b
+    $ di check nginx -n 20 -i 0.5 --json nginx.json
+    Run 1/20: 512.3 ms
+    ...
+    ms                 min    median       p95       max
+    wall             498.2     505.7     531.0     540.9
+    agent             11.0      12.0      15.0      16.0
+
+    With selectors, checks run concurrently and their results are aggregated:
+
+    \b
+    $ di check --all
+    ENVIRONMENT          STATUS    DURATION  METRICS  EVENTS  SERVICE CHECKS
+    envoy:front:default  ok          611 ms      104       0               1
+    nginx:stub:default   ok          498 ms        7       0               1
     """
+    if check_all or checks or flavors or patterns:
+        if check_name or direct or runs > 1:
+            echo_failure('Selectors cannot be combined with a CHECK argument, --direct or --runs.')
+            sys.exit(1)
+
+        settings = load_settings()
+        location = location or settings.get('location', CHECKS_DIR)
+
+        environments, error = list_environments(location)
+        if error:
+            echo_failure('An unexpected Docker error (status {}) has occurred.'.format(error))
+            sys.exit(error)
+
+        environments = [environment for environment in environments if environment['running']]
+        if not check_all:
+            environments = select_environments(environments, checks, flavors, patterns)
+
+        if not environments:
+            echo_info('No matching running environments in `{}`.'.format(location))
+            return
+
+        workers = workers or settings.get('workers', 4)
+        echo_info('Running {} checks with up to {} workers...'.format(len(environments), workers))
+        click.echo()
+
+        results = check_environments(environments, workers)
+        for result in results:
+            if result['returncode']:
+                echo_failure('{} output:'.format(result['environment']))
+                click.echo(result['output'].rstrip())
+                click.echo()
+        echo_check_results(results)
+
+        if json_file:
+            with open(json_file, 'w') as f:
+                f.write(json.dumps(results, indent=2))
+            echo_info('Wrote results to `{}`'.format(json_file))
+
+        sys.exit(next((result['returncode'] for result in results if result['returncode']), 0))
+
+    if not check_name:
+        echo_failure('Missing argument "CHECK", or a selector such as --all.')
+        sys.exit(1)
+
     if check_name not in Checks:
         echo_failure('Check `{}` is not yet supported.'.format(check_name))
         sys.exit(1)
@@ -36,12 +252,42 @@ def check(check_name, flavor, instance_name, direct, location):
     location = check_class.get_location(
         location, instance_name=instance_name, direct=direct
     )
-    container_name = check_class.get_container_name(
+
+    # Recorded by `di start`, sparing an exec to detect the agent version
+    metadata = read_env_metadata(location)
+    container_name = metadata.get('container_name') or check_class.get_container_name(
         instance_name=instance_name, location=location, direct=direct
     )
+    agent_version = metadata.get('agent_version')
+
+    if runs > 1 or json_file:
+        agent_version = agent_version or get_agent_version(container_name, running=True)
+        if reuse and int(agent_version) < 6:
+            echo_warning('Agent {} cannot run a check several times in one process, running '
+                         'it separately instead.'.format(agent_version))
+            reuse = False
+
+        results = benchmark_check(
+            container_name, check_name, agent_version, runs, interval, reuse, output=echo_info
+        )
+        results['flavor'] = check_class.flavor
+        results['instance'] = instance_name
+
+        click.echo()
+        echo_benchmark(results)
+        if results['failures']:
+            click.echo(results['error'].rstrip())
+            echo_warning('{} of {} runs failed.'.format(results['failures'], len(results['samples'])))
+
+        if json_file:
+            with open(json_file, 'w') as f:
+                f.write(json.dumps(results, indent=2))
+            echo_info('Wrote results to `{}`'.format(json_file))
+
+        sys.exit(1 if results['failures'] else 0)
 
     try:
-        error = run_check(container_name, check_name)
+        error = run_check(container_name, check_name, agent_version_major=agent_version)
     except FileNotFoundError:
         echo_failure('Location `{}` does not exist.'.format(location))
         sys.exit(1)
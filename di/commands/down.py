@@ -0,0 +1,57 @@
+import sys
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+import toml
+
+from di.checks import Checks
+from di.commands.stop import stop_environment
+from di.commands.utils import (
+    CONTEXT_SETTINGS, Reporter, echo_failure, echo_info, get_environment_label, report_statuses
+)
+from di.manifest import load_manifest
+from di.settings import load_settings
+from di.utils import CHECKS_DIR
+
+
+@click.command(context_settings=CONTEXT_SETTINGS,
+               short_help='Stops environments listed in a manifest')
+@click.option('--file', '-f', 'manifest_file', required=True,
+              type=click.Path(exists=True, dir_okay=False),
+              help='The TOML manifest of environments.')
+@click.option('--location', '-l', default='')
+@click.option('--workers', '-w', type=click.INT,
+              help='The maximum number of environments to stop at once.')
+def down(manifest_file, location, workers):
+    """Stops environments listed in a manifest.
+
+    \b
+    $ di down -f envs.toml
+    """
+    try:
+        manifest = load_manifest(manifest_file)
+    except (ValueError, toml.TomlDecodeError) as e:
+        echo_failure('Invalid manifest `{}`: {}'.format(manifest_file, e))
+        sys.exit(1)
+
+    settings = load_settings()
+    location = location or manifest.get('location') or settings.get('location', CHECKS_DIR)
+    workers = workers or manifest.get('workers') or settings.get('workers', 4)
+
+    echo_info('Stopping {} environments with up to {} workers...'.format(len(manifest['environments']), workers))
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = OrderedDict()
+        for environment in manifest['environments']:
+            check_name, flavor, instance_name = environment
+            check_class = Checks[check_name][flavor]
+            env_location = check_class.get_location(location, instance_name=instance_name)
+            futures[environment] = executor.submit(
+                stop_environment, env_location, check_class.get_container_name(instance_name),
+                Reporter(get_environment_label(*environment))
+            )
+
+        statuses = OrderedDict((environment, future.result()) for environment, future in futures.items())
+
+    sys.exit(report_statuses(statuses, verb='stopped'))
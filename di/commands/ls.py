@@ -0,0 +1,129 @@
+import json
+import sys
+from fnmatch import fnmatch
+
+import click
+
+from di.checks import Checks
+from di.commands.utils import (
+    CONTEXT_SETTINGS, echo_failure, echo_info, echo_success, echo_warning, get_environment_label
+)
+from di.docker import running_containers
+from di.metadata import index_environments
+from di.settings import load_settings
+from di.utils import CHECKS_DIR
+
+# Every environment's agent container starts with `agent_{name}_{flavor}`
+CONTAINER_PREFIX = 'agent_'
+
+
+def get_container_name(environment):
+    container_name = environment['metadata'].get('container_name')
+    if container_name:
+        return container_name
+
+    # Environments started before their container name was recorded
+    flavors = Checks.get(environment['check'], {})
+    if environment['flavor'] in flavors:
+        return flavors[environment['flavor']].get_container_name(environment['instance'])
+
+    return ''
+
+
+def list_environments(location):
+    """Returns every environment under `location` along with whether
+    it is running, asking the daemon once for all of them.
+    """
+    environments = index_environments(location)
+    running, error = running_containers(CONTAINER_PREFIX)
+
+    for environment in environments:
+        environment['container_name'] = get_container_name(environment)
+        environment['running'] = environment['container_name'] in running
+
+    return environments, error
+
+
+def select_environments(environments, checks=(), flavors=(), patterns=()):
+    """Keeps environments matching every given kind of selector, with
+    `patterns` being globs matched against `CHECK:FLAVOR:INSTANCE`.
+    """
+    return [
+        environment for environment in environments
+        if (not checks or environment['check'] in checks) and
+        (not flavors or environment['flavor'] in flavors) and
+        (not patterns or any(
+            fnmatch(get_environment_label(environment['check'], environment['flavor'], environment['instance']), p)
+            for p in patterns
+        ))
+    ]
+
+
+@click.command('ls', context_settings=CONTEXT_SETTINGS, short_help='Lists environments')
+@click.option('--location', '-l', default='')
+@click.option('--running', '-r', 'running_only', is_flag=True,
+              help='Only lists running environments.')
+@click.option('--json', 'as_json', is_flag=True,
+              help='Prints environments as JSON.')
+def list_envs(location, running_only, as_json):
+    """Lists environments and whether they are running.
+
+    \b
+    $ di ls
+    envoy:front:default   running   prod  agent 6  front_port: 32768, admin_port: 32769
+    nginx:stub:default    stopped   dev   agent 6
+    """
+    settings = load_settings()
+    location = location or settings.get('location', CHECKS_DIR)
+
+    environments, error = list_environments(location)
+    if error:
+        echo_failure('Unable to query Docker (status {}), so every environment is shown as stopped.'.format(error))
+
+    if running_only:
+        environments = [environment for environment in environments if environment['running']]
+
+    if as_json:
+        click.echo(json.dumps([
+            {
+                'check': environment['check'],
+                'flavor': environment['flavor'],
+                'instance': environment['instance'],
+                'location': environment['location'],
+                'container_name': environment['container_name'],
+                'running': environment['running'],
+                'mode': environment['metadata'].get('mode'),
+                'agent_version': environment['metadata'].get('agent_version'),
+                'image': environment['metadata'].get('image'),
+                'ports': environment['metadata'].get('ports', {}),
+            }
+            for environment in environments
+        ], indent=2))
+        sys.exit(1 if error else 0)
+
+    if not environments:
+        echo_info('No environments found in `{}`.'.format(location))
+        sys.exit(1 if error else 0)
+
+    labels = [
+        get_environment_label(environment['check'], environment['flavor'], environment['instance'])
+        for environment in environments
+    ]
+    width = max(len(label) for label in labels)
+
+    for label, environment in zip(labels, environments):
+        metadata = environment['metadata']
+        line = '{}  {:<9} {:<5} {:<8} {}'.format(
+            label.ljust(width),
+            'running' if environment['running'] else 'stopped',
+            metadata.get('mode', '?'),
+            'agent {}'.format(metadata['agent_version']) if metadata.get('agent_version') else '',
+            ', '.join('{}: {}'.format(option, port) for option, port in metadata.get('ports', {}).items()),
+        ).rstrip()
+
+        if environment['running']:
+            echo_success(line)
+        else:
+            echo_warning(line)
+
+    sys.exit(1 if error else 0)
@@ -0,0 +1,173 @@
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+
+from di.commands.utils import (
+    CONTEXT_SETTINGS, echo_failure, echo_info, echo_success, echo_waiting, echo_warning
+)
+from di.docker import (
+    create_pool_container, get_api_key_hash, get_image_digest, list_pool_containers, remove_containers
+)
+from di.settings import load_settings
+from di.utils import get_compose_api_key
+
+
+def get_pool_images(settings, agents=()):
+    agents = agents or (5, 6)
+    return [
+        settings['agent{}'.format(agent)] for agent in agents
+        if settings.get('agent{}'.format(agent))
+    ]
+
+
+def get_stale_containers(containers, ttl, prune_all=False):
+    """Idle containers that are too old or whose image has since been updated."""
+    now = time.time()
+    digests = {}
+    stale = []
+
+    for container in containers:
+        image = container['image']
+        if image not in digests:
+            digests[image] = get_image_digest(image)
+
+        if prune_all or now - container['created'] >= ttl or container['digest'] != digests[image]:
+            stale.append(container)
+
+    return stale
+
+
+@click.group(context_settings=CONTEXT_SETTINGS, invoke_without_command=True,
+             short_help='Manages idle agent containers for fast starts')
+@click.pass_context
+def pool(ctx):
+    """Manages a pool of idle agent containers that `di start` claims in
+    prod mode instead of creating a new agent container, which skips the
+    agent's container creation and boot time.
+
+    The target number of containers per image is the `pool_size` setting
+    and containers older than `pool_ttl` seconds are evicted. Every claimed
+    container is replaced in the background while its environment starts.
+
+    \b
+    $ di pool
+    datadog/agent-dev:master
+      di_pool_6a0c11e9d4f2  (42s old)
+    """
+    if not ctx.invoked_subcommand:
+        ctx.invoke(list_pool)
+
+
+@pool.command('ls', context_settings=CONTEXT_SETTINGS,
+              short_help='Lists idle containers')
+def list_pool():
+    """Lists idle containers, grouped by image."""
+    containers, error = list_pool_containers()
+    if error:
+        echo_failure('An unexpected Docker error (status {}) has occurred.'.format(error))
+        sys.exit(error)
+
+    if not containers:
+        echo_info('The pool is empty.')
+        return
+
+    now = time.time()
+    for image in sorted(set(container['image'] for container in containers)):
+        echo_success(image)
+        for container in containers:
+            if container['image'] == image:
+                echo_info('  {}  ({}s old)'.format(container['name'], int(now - container['created'])))
+
+
+@pool.command(context_settings=CONTEXT_SETTINGS,
+              short_help='Creates idle containers up to the pool size')
+@click.option('--size', '-s', type=click.INT,
+              help='The number of idle containers per image, defaulting to the `pool_size` setting.')
+@click.option('--agent', '-a', 'agents', type=click.INT, multiple=True,
+              help='Only fills the pool of the given agent version\'s image, e.g. `-a 6`.')
+@click.option('--api_key', '-key')
+def fill(size, agents, api_key):
+    """Evicts stale containers, then creates idle containers for the
+    configured agent images until each has `--size` of them.
+
+    \b
+    $ di pool fill -s 2 -a 6
+    Filling the pool... success!
+    Created 2 containers, evicted 0.
+    """
+    settings = load_settings()
+    size = size if size is not None else settings.get('pool_size', 0)
+    if size < 1:
+        echo_failure('The pool size is 0; set `pool_size` or pass --size.')
+        sys.exit(1)
+
+    api_key, _ = get_compose_api_key(api_key or settings.get('api_key', '${DD_API_KEY}'))
+    key_hash = get_api_key_hash(api_key)
+
+    echo_waiting('Filling the pool... ', nl=False)
+    containers, error = list_pool_containers()
+    if error:
+        click.echo()
+        echo_failure('An unexpected Docker error (status {}) has occurred.'.format(error))
+        sys.exit(error)
+
+    stale = get_stale_containers(containers, settings.get('pool_ttl', 3600))
+    remove_containers([container['name'] for container in stale])
+    stale_names = set(container['name'] for container in stale)
+
+    missing = []
+    for image in get_pool_images(settings, agents):
+        idle = sum(
+            1 for container in containers
+            if container['name'] not in stale_names and container['image'] == image and container['key'] == key_hash
+        )
+        missing.extend([image] * max(0, size - idle))
+
+    errors = []
+    if missing:
+        with ThreadPoolExecutor(max_workers=max(1, settings.get('workers', 4))) as executor:
+            for name, output, error in executor.map(lambda image: create_pool_container(image, api_key), missing):
+                if error:
+                    errors.append(output)
+
+    if errors:
+        click.echo()
+        for output in errors:
+            click.echo(output.rstrip())
+        echo_warning('{} of {} containers could not be created.'.format(len(errors), len(missing)))
+    else:
+        echo_success('success!')
+
+    echo_info('Created {} containers, evicted {}.'.format(len(missing) - len(errors), len(stale)))
+
+
+@pool.command(context_settings=CONTEXT_SETTINGS,
+              short_help='Removes expired or outdated idle containers')
+@click.option('--all', '-a', 'prune_all', is_flag=True,
+              help='Removes every idle container.')
+def prune(prune_all):
+    """Removes idle containers older than `pool_ttl` seconds or
+    created from an image that has since been updated.
+
+    \b
+    $ di pool prune
+    Pruning the pool... success!
+    Removed 1 container.
+    """
+    settings = load_settings()
+
+    echo_waiting('Pruning the pool... ', nl=False)
+    containers, error = list_pool_containers()
+    if not error:
+        stale = get_stale_containers(containers, settings.get('pool_ttl', 3600), prune_all)
+        output, error = remove_containers([container['name'] for container in stale])
+
+    if error:
+        click.echo()
+        echo_failure('An unexpected Docker error (status {}) has occurred.'.format(error))
+        sys.exit(error)
+
+    echo_success('success!')
+    echo_info('Removed {} container{}.'.format(len(stale), '' if len(stale) == 1 else 's'))
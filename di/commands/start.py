@@ -1,107 +1,139 @@
 import os
 import sys
+import threading
+import time
 from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 
 import click
 
 from di.checks import Checks
 from di.commands.utils import (
-    CONTEXT_SETTINGS, echo_failure, echo_info, echo_success, echo_waiting, echo_warning
+    CONTEXT_SETTINGS, Reporter, echo_failure, echo_info, echo_warning, get_environment_label, report_statuses
 )
 from di.docker import (
-    check_dir_start, get_agent_version, pip_install_dev_deps,
-    pip_install_mounted_check, read_check_example_conf, update_image
+    PULL_POLICIES, check_dir_restart, check_dir_start, claim_pool_container, connect_container,
+    container_running, copy_to_container, create_cache_volume, create_pool_container, ensure_built,
+    get_compose_network, get_image_digest, image_is_fresh, introspect_image, pip_install_dev_deps,
+    pip_install_mounted_check, remove_containers, update_image
 )
+from di.metadata import read_env_metadata, update_env_metadata
 from di.settings import load_settings
-from di.structures import DockerCheck, VagrantCheck
+from di.structures import DockerCheck, VagrantCheck, find_requirements_file, get_dev_build
+from di.trace import Span, format_timings
 from di.utils import (
     CHECKS_BASE_PACKAGE, CHECKS_DIR, DEFAULT_NAME, dir_exists, file_exists, find_matching_file,
-    get_check_mount_dir, get_compose_api_key, read_file, remove_path, resolve_path
+    get_check_mount_dir, get_compose_api_key, read_file, resolve_path
 )
 
 
-@click.command(context_settings=CONTEXT_SETTINGS,
-               short_help='Starts a fully functioning integration')
-@click.argument('check_name')
-@click.argument('flavor', required=False, default=DEFAULT_NAME)
-@click.argument('instance_name', required=False, default=DEFAULT_NAME)
-@click.option('--options', '-o', nargs=2, multiple=True)
-@click.option('--direct', '-d', is_flag=True)
-@click.option('--location', '-l', default='')
-@click.option('--force', '-f', is_flag=True)
-@click.option('--api_key', '-key')
-@click.option('--ignore-missing', '-im', is_flag=True)
-@click.option('--prod/--dev', default=None)
-@click.option('--copy-conf/--use-conf', default=None)
-@click.option('--core', default='')
-@click.option('--extras', default='')
-@click.option('--agent', '-a', type=click.INT)
-@click.option('--image', '-i', default='')
-@click.option('--no-pull', '-np', is_flag=True)
-def start(check_name, flavor, instance_name, options, direct, location, force, api_key,
-          ignore_missing, prod, copy_conf, core, extras, agent, image, no_pull):
-    """Starts a fully functioning integration.
+class SharedResults:
+    """Computes a result once per key, even when requested from several threads
+    at the same time, e.g. pulling an image shared by many environments.
+    """
+    def __init__(self):
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, func, *args, **kwargs):
+        with self._lock:
+            future = self._futures.get(key)
+            owner = future is None
+            if owner:
+                future = self._futures[key] = Future()
+
+        if owner:
+            try:
+                future.set_result(func(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+
+        return future.result()
+
+
+class TaskGraph:
+    """Runs each task as soon as the tasks it requires have succeeded, recording
+    a span for each. Tasks return an exit status and those requiring a failed
+    task are skipped. Requirements must have been added before their dependents.
+    """
+    def __init__(self):
+        self._tasks = OrderedDict()
+        self.spans = []
+
+    def add(self, name, func, requires=()):
+        self._tasks[name] = (func, requires)
+
+    def run(self):
+        """Runs every task and returns the first non-zero status in the order tasks were added."""
+        futures = OrderedDict()
+
+        # Tasks waiting on their requirements hold a worker, so every task gets one
+        with ThreadPoolExecutor(max_workers=max(1, len(self._tasks))) as executor:
+            for name, (func, requires) in self._tasks.items():
+                futures[name] = executor.submit(
+                    self._run_task, name, func, [futures[requirement] for requirement in requires]
+                )
 
-    \b
-    $ di start nginx
-    Using docker image `datadog/agent-dev:master`
+            statuses = [future.result() for future in futures.values()]
 
-    Detecting the agent's major version...
-    Agent 6 detected
-    Reading the configuration file for `nginx`...
+        return next((status for status in statuses if status), 0)
 
-    Creating necessary files...
-    Successfully wrote:
-      C:\\Users\\Ofek\\AppData\\Local\\di-dev\\checks\\nginx\\stub\\default\\nginx.yaml
-      C:\\Users\\Ofek\\AppData\\Local\\di-dev\\checks\\nginx\\stub\\default\\docker-compose.yaml
-      C:\\Users\\Ofek\\AppData\\Local\\di-dev\\checks\\nginx\\stub\\default\\status.conf
+    def _run_task(self, name, func, requirements):
+        if any(requirement.result() for requirement in requirements):
+            return 0
 
-    Starting containers...
-    Success!
+        span = Span(name, 'start')
+        try:
+            return func()
+        finally:
+            self.spans.append(span.finish())
 
-    To run this check, do `di check nginx`.
+
+def parse_environment_specs(specs):
+    """Supports both the positional `CHECK [FLAVOR [INSTANCE]]` form
+    and any number of `CHECK[:FLAVOR[:INSTANCE]]` specs.
     """
-    if check_name not in Checks:
-        echo_failure('Check `{}` is not yet supported.'.format(check_name))
-        sys.exit(1)
+    multiple = (
+        len(specs) > 3 or
+        any(':' in spec for spec in specs) or
+        any(spec in Checks for spec in specs[1:])
+    )
 
-    if flavor not in Checks[check_name]:
-        echo_failure('Flavor `{}` is not yet supported.'.format(flavor))
-        sys.exit(1)
+    if multiple:
+        environments = []
+        for spec in specs:
+            parts = spec.split(':')
+            if len(parts) > 3 or not all(parts):
+                raise ValueError('Invalid environment `{}`, expected CHECK[:FLAVOR[:INSTANCE]]'.format(spec))
+            parts.extend([DEFAULT_NAME] * (3 - len(parts)))
+
+            environment = tuple(parts)
+            if environment not in environments:
+                environments.append(environment)
+        return environments
+    else:
+        return [tuple(specs) + (DEFAULT_NAME, ) * (3 - len(specs))]
 
-    check_class = Checks[check_name][flavor]
-    options = OrderedDict(options)
-    settings = load_settings()
 
-    user_api_key = api_key or settings.get('api_key', '${DD_API_KEY}')
-    api_key, evar = get_compose_api_key(user_api_key)
-    if not ignore_missing and api_key != user_api_key:
-        echo_warning(
-            "Environment variable {} doesn't exist; a well-formatted "
-            "fake API key will be used instead.".format(evar)
-        )
-        click.echo()
-    else:
-        api_key = user_api_key
+def start_environment(check_name, flavor, instance_name, config, reporter, shared):
+    """Runs the whole start pipeline for one environment and returns an exit status."""
+    check_class = Checks[check_name][flavor]
+    options = OrderedDict(config['options'])
+    location = config['location']
+    prod = config['prod']
+    direct = config['direct']
+    live_output = reporter.echo if config['verbose'] else None
+    start_time = time.perf_counter()
 
-    given_location = location
-    location = given_location or settings.get('location', CHECKS_DIR)
-    prod = prod if prod is not None else settings.get('mode', 'prod') == 'prod'
-    copy_conf = copy_conf if copy_conf is not None else settings.get('copy_conf', True)
+    # Stages in a task graph overlap each other
+    spans = []
 
     if prod:
         conf_path = ''
         check_dirs = None
     else:
-        core = resolve_path(core or settings.get('core', ''))
-        extras = resolve_path(extras or settings.get('extras', ''))
-
-        if not dir_exists(core):
-            echo_failure(
-                'All checks running in dev mode require `integrations-core` '
-                'for its {} dependency.'.format(CHECKS_BASE_PACKAGE)
-            )
-            sys.exit(1)
+        core = config['core']
+        extras = config['extras']
 
         core_check_dir = os.path.join(core, check_name)
         extras_check_dir = os.path.join(extras, check_name)
@@ -111,165 +143,586 @@ def start(check_name, flavor, instance_name, options, direct, location, force, a
         elif dir_exists(extras_check_dir):
             check_dir = extras_check_dir
         else:
-            echo_failure('Local check `{}` cannot be found in core nor extras.'.format(check_name))
-            echo_info('Auto-generation of new checks will be a feature soon!')
-            sys.exit(1)
+            reporter.failure('Local check `{}` cannot be found in core nor extras.'.format(check_name))
+            reporter.info('Auto-generation of new checks will be a feature soon!')
+            return 1
 
         if not file_exists(os.path.join(check_dir, 'setup.py')):
-            echo_failure('No `setup.py` detected.')
-            sys.exit(1)
+            reporter.failure('No `setup.py` detected.')
+            return 1
 
         conf_path = find_matching_file(os.path.join(check_dir, 'datadog_checks', check_name, 'data', 'conf.yaml*'))
         if not conf_path:
-            echo_failure('No `conf.yaml*` detected.')
-            sys.exit(1)
+            reporter.failure('No `conf.yaml*` detected.')
+            return 1
 
         check_dirs = check_dir, os.path.join(core, CHECKS_BASE_PACKAGE)
 
     if issubclass(check_class, DockerCheck):
-        agent_version = agent or settings.get('agent', '')
-        image = options.get('image') or image or settings.get('agent{}'.format(agent_version), '')
+        agent_version = config['agent']
+        image = (
+            options.get('image') or config['image'] or
+            config['settings'].get('agent{}'.format(agent_version), '')
+        )
         options['image'] = image
-        echo_info('Using docker image `{}`'.format(image))
-
-        if not no_pull:
-            echo_waiting('Pulling the latest version... ', nl=False)
-            output, error = update_image(image)
+        reporter.info('Using docker image `{}`'.format(image))
+        reporter.echo()
+
+        # What tasks compute for later ones and the rest of the pipeline
+        results = {'dev_image': ''}
+
+        def pull_image(name):
+            # Each inspection is a `docker` call, so the digest is resolved here
+            # once per image and passed on to every later step that needs it
+            digest = shared.get(('digest', name), get_image_digest, name)
+
+            if config['no_pull']:
+                pass
+            elif shared.get(('fresh', name), image_is_fresh, name, config['pull'], config['pull_ttl'], digest=digest):
+                reporter.info('Image `{}` is up to date according to the `{}` pull policy, skipping pull.'.format(
+                    name, config['pull']
+                ))
+            else:
+                reporter.waiting('Pulling the latest version of `{}`...'.format(name))
+                output, error, digest = shared.get(
+                    ('pull', name), update_image, name, output=live_output, digest=digest
+                )
+                if error:
+                    reporter.output(output)
+                    reporter.failure(
+                        'Unable to pull image `{}`. An unexpected Docker error '
+                        '(status {}) has occurred.'.format(name, error)
+                    )
+                    return error
+
+                reporter.success('Pulled `{}`'.format(name))
+
+            if name == image:
+                results['image_digest'] = digest
+            return 0
+
+        def prepare_build(build):
+            output, error, built = shared.get(
+                ('build', build.tag), ensure_built, build,
+                output=(lambda line: reporter.echo('[{}] {}'.format(build.name, line))) if config['verbose'] else None
+            )
+            if error:
+                reporter.output(output)
+                reporter.failure('Unable to build image `{}`. An unexpected Docker error '
+                                 '(status {}) has occurred.'.format(build.tag, error))
+                return error
+
+            reporter.success('{} `{}`'.format('Built' if built else 'Cached', build.tag))
+            return 0
+
+        def introspect():
+            reporter.waiting("Detecting the agent's major version...")
+            introspection, error = introspect_image(
+                image, checks=[check_name] if prod else [], digest=results['image_digest']
+            )
             if error:
-                click.echo()
-                click.echo(output.rstrip())
-                echo_failure(
-                    'Unable to pull image `{}`. An unexpected Docker error '
+                reporter.output(introspection['error'])
+                reporter.failure(
+                    'Unable to inspect image `{}`. An unexpected Docker error '
                     '(status {}) has occurred.'.format(image, error)
                 )
-                sys.exit(error)
-            echo_success('success!')
-
-        click.echo()
-        echo_waiting("Detecting the agent's major version...")
-        agent_version = get_agent_version(image)
-        echo_info('Agent {} detected'.format(agent_version))
-        click.echo()
-
-        echo_waiting('Reading the configuration file for `{}`... '.format(check_name), nl=False)
-        if prod:
-            conf_contents, error = read_check_example_conf(check_name, image, agent_version)
+                return error
+
+            results['introspection'] = introspection
+            reporter.info('Agent {} detected'.format(introspection['agent_version']))
+            return 0
+
+        def read_conf():
+            if prod:
+                results['conf_contents'] = results['introspection']['example_confs'][check_name]
+                if results['conf_contents'] is None:
+                    reporter.failure(
+                        'Unable to locate a configuration file. If this '
+                        'is a new check, please use the --dev flag.'
+                    )
+                    return 1
+            else:
+                results['conf_contents'] = read_file(conf_path)
+            reporter.success('Read the configuration file for `{}`'.format(check_name))
+            return 0
+
+        def build_dev_image():
+            # Dependencies are installed once per image and set of requirements rather than at every start
+            build = get_dev_build(image, results['image_digest'], check_dirs)
+            output, error, built = shared.get(('build', build.tag), ensure_built, build, output=live_output)
             if error:
-                click.echo()
-                echo_failure(
-                    'Unable to locate a configuration file. If this '
-                    'is a new check, please use the --dev flag.'
+                reporter.output(output)
+                reporter.warning(
+                    'Unable to build the dev image (status {}), so dependencies will be '
+                    'installed in the agent container instead.'.format(error)
                 )
-                sys.exit(1)
-        else:
-            conf_contents = read_file(conf_path)
-            if copy_conf:
-                conf_path = ''
-        echo_success('success!')
+            else:
+                reporter.success('{} dev image `{}`'.format('Built' if built else 'Cached', build.tag))
+                results['dev_image'] = build.tag
+            return 0
+
+        def check_running():
+            container_name = check_class.get_container_name(
+                instance_name, check_class.get_location(location, instance_name=instance_name, direct=direct), direct
+            )
+            results['was_running'] = container_running(container_name)[0]
+            return 0
+
+        # Only the agent image's own steps depend on each other; the images of other
+        # services and the state of the environment are prepared in the meantime
+        check_options = check_class.get_options(options)
+        graph = TaskGraph()
+        graph.add('pull', lambda: pull_image(image))
+        for service_image in check_class.get_service_images(check_options):
+            graph.add('pull {}'.format(service_image), lambda service_image=service_image: pull_image(service_image))
+        for build in check_class.get_distinct_builds(check_options):
+            graph.add('build {}'.format(build.name), lambda build=build: prepare_build(build))
+        graph.add('running', check_running)
+        graph.add('introspect', introspect, requires=('pull', ))
+        graph.add('conf', read_conf, requires=('introspect', ) if prod else ())
+        if not prod and config['dev_image']:
+            graph.add('dev image', build_dev_image, requires=('pull', ))
+
+        error = graph.run()
+        spans.extend(graph.spans)
+        if error:
+            return error
+
+        agent_version = results['introspection']['agent_version']
+        conf_contents = results['conf_contents']
+        image_digest = results['image_digest']
+        was_running = results['was_running']
+        dev_image = results['dev_image']
+        if dev_image:
+            options['image'] = dev_image
+        if not prod and config['copy_conf']:
+            conf_path = ''
 
     elif issubclass(check_class, VagrantCheck):
-        echo_failure('Vagrant checks are currently unsupported, "check" back soon!')
-        sys.exit(1)
+        reporter.failure('Vagrant checks are currently unsupported, "check" back soon!')
+        return 1
     else:
-        echo_failure('Local checks are currently unsupported, "check" back soon!')
-        sys.exit(1)
-
-    check_class = check_class(
-        d=location, api_key=api_key, conf_path=conf_path, conf_contents=conf_contents,
-        agent_version=agent_version, check_dirs=check_dirs, instance_name=instance_name,
-        direct=direct, **options
-    )
-    files = check_class.files.keys()
+        reporter.failure('Local checks are currently unsupported, "check" back soon!')
+        return 1
+
+    try:
+        check_class = check_class(
+            d=location, api_key=config['api_key'], conf_path=conf_path, conf_contents=conf_contents,
+            agent_version=agent_version, check_dirs=check_dirs, instance_name=instance_name,
+            direct=direct, **options
+        )
+    except ValueError as e:
+        reporter.failure(str(e))
+        return 1
+    fingerprint = check_class.get_fingerprint(image_digest)
 
     location = check_class.location
     if dir_exists(location):
-        force = force or settings.get('force', False)
-        if force or click.confirm('`{}` already exists. Do you want to recreate it?'.format(location)):
-            for file in files:
-                remove_path(file)
-        else:
-            sys.exit(2)
-
-    click.echo()
-    echo_waiting('Creating necessary files...')
-    check_class.write()
-
-    echo_success('Successfully wrote:')
-    for file in files:
-        echo_info('  {}'.format(file))
+        # --force always recreates, e.g. to repair an environment whose containers are broken
+        if (
+            was_running and not config['force'] and read_env_metadata(location).get('fingerprint') == fingerprint and
+            all(f.is_current() for f in check_class.files.values())
+        ):
+            if 'spec_hash' in config:
+                update_env_metadata(location, spec_hash=config['spec_hash'])
+            reporter.success('`{}` is already running and up to date.'.format(location))
+            return 0
+        elif not (config['force'] or config['confirm'](
+            '`{}` already exists. Do you want to recreate it?'.format(location)
+        )):
+            # Keeps the ports for when the recreation is confirmed later on
+            check_class.release_ports()
+            return 2
+
+    reporter.echo()
+    reporter.waiting('Creating necessary files...')
+    stage = Span('files', 'start')
+    written = check_class.write()
+    spans.append(stage.finish())
+
+    if written:
+        reporter.success('Successfully wrote:')
+        for file in written:
+            reporter.info('  {}'.format(file.file_path))
+    else:
+        reporter.success('All files are up to date.')
 
-    click.echo()
+    reporter.echo()
     if isinstance(check_class, DockerCheck):
-        echo_waiting('Starting containers... ', nl=False)
-        output, error = check_dir_start(location, build=check_class.requires_build)
+        # A warm agent comes from the pool rather than compose, so compose must leave it alone
+        warm = was_running and read_env_metadata(location).get('warm', False)
+        claimed = ''
+        if not was_running and prod and config['pool']:
+            claimed = claim_pool_container(image, config['api_key'], check_class.container_name, digest=image_digest)
+            if claimed:
+                warm = True
+                reporter.info('Claimed idle agent container `{}`'.format(claimed))
+
+                # Replaces the claimed container while the environment starts so that the pool
+                # keeps its size; not a daemon thread, so the process waits for it before exiting
+                threading.Thread(
+                    target=create_pool_container, args=(image, config['api_key']), kwargs={'digest': image_digest}
+                ).start()
+
+        def abort(error):
+            # A claimed container is no longer in the pool and not yet recorded as this environment's
+            if claimed:
+                remove_containers([check_class.container_name])
+            return error
+
+        stage = Span('up', 'start')
+        if check_class.cache_volume:
+            output, error = create_cache_volume(
+                check_class.cache_volume, get_environment_label(check_name, check_class.flavor, instance_name)
+            )
+            if error:
+                reporter.output(output)
+                reporter.failure('Unable to create volume `{}`. An unexpected Docker error '
+                                 '(status {}) has occurred.'.format(check_class.cache_volume, error))
+                return abort(error)
+
+        reporter.waiting('Starting containers... ', nl=config['verbose'])
+        output, error = check_dir_start(
+            location, build=check_class.requires_build, exclude=('agent', ) if warm else (), output=live_output
+        )
+        if not error and claimed:
+            output, error = connect_container(
+                check_class.container_name, get_compose_network(location, check_class.agent_network), 'agent'
+            )
         if error:
-            click.echo()
-            click.echo(output.rstrip())
-            echo_failure('An unexpected Docker error (status {}) has occurred.'.format(error))
-            sys.exit(error)
-        echo_success('success!')
+            reporter.echo()
+            reporter.output(output)
+            reporter.failure('An unexpected Docker error (status {}) has occurred.'.format(error))
+            return abort(error)
+        reporter.success('success!')
+
+        # Compose only recreates services whose definition changed, not those whose mounted files did
+        services = check_class.get_affected_services(written) if was_running else []
+        if warm:
+            # Nothing is mounted in a warm agent, but checks read their config when run
+            services = [service for service in services if service != 'agent']
+            if claimed or check_class.conf_path_local in (file.file_path for file in written):
+                output, error = copy_to_container(
+                    check_class.container_name, [(check_class.conf_path_local, check_class.conf_path_mount)]
+                )
+                if error:
+                    reporter.output(output)
+                    reporter.failure('Unable to copy the configuration file into the agent container.')
+                    return abort(error)
+        if services:
+            reporter.waiting('Restarting {}... '.format(', '.join(services)), nl=config['verbose'])
+            output, error = check_dir_restart(location, services, output=live_output)
+            if error:
+                reporter.echo()
+                reporter.output(output)
+                reporter.failure('An unexpected Docker error (status {}) has occurred.'.format(error))
+                return abort(error)
+            reporter.success('success!')
+
+        spans.append(stage.finish())
+
+        # Lets `di up` know whether this environment matches its manifest entry,
+        # later starts whether anything changed at all and other commands
+        # what they would otherwise have to ask the container
+        update_env_metadata(
+            location, spec_hash=config.get('spec_hash', ''), ports=check_class.ports, fingerprint=fingerprint,
+            warm=warm, check=check_name, flavor=check_class.flavor, instance=instance_name,
+            container_name=check_class.container_name, agent_version=agent_version, image=image,
+            image_digest=image_digest, mounts=check_class.get_mounts(), mode='prod' if prod else 'dev',
+            cache_volume=check_class.cache_volume, dev_image=dev_image
+        )
 
         if not prod:
-            click.echo()
-            echo_waiting('Upgrading `{}` check to the development version...'.format(check_name))
-            error = pip_install_mounted_check(check_class.container_name, check_name)
+            stage = Span('install', 'start')
+            reporter.echo()
+            reporter.waiting('Upgrading `{}` check to the development version...'.format(check_name))
+            error = pip_install_mounted_check(
+                check_class.container_name, check_name, cached=bool(check_class.cache_volume),
+                # Dependencies are in the dev image only if the check lists them in a requirements file
+                no_deps=bool(dev_image and find_requirements_file(check_dirs[0]))
+            )
             if error:
-                echo_warning(
+                reporter.warning(
                     'The development check mounted at `{}` may have not installed properly. '
                     'You might need to try it again yourself.'.format(get_check_mount_dir(check_name))
                 )
 
-            click.echo()
-            echo_waiting('Installing development dependencies...')
-            error = pip_install_dev_deps(check_class.container_name)
-            if error:
-                echo_warning(
-                    'The development dependencies may have not installed properly. '
-                    'You might need to try installing them again yourself.'
-                )
+            if not dev_image:
+                reporter.echo()
+                reporter.waiting('Installing development dependencies...')
+                error = pip_install_dev_deps(check_class.container_name, cached=bool(check_class.cache_volume))
+                if error:
+                    reporter.warning(
+                        'The development dependencies may have not installed properly. '
+                        'You might need to try installing them again yourself.'
+                    )
+            spans.append(stage.finish())
     elif isinstance(check_class, VagrantCheck):
-        echo_failure('Vagrant checks are currently unsupported, "check" back soon!')
-        sys.exit(1)
+        reporter.failure('Vagrant checks are currently unsupported, "check" back soon!')
+        return 1
     else:
-        echo_failure('Local checks are currently unsupported, "check" back soon!')
-        sys.exit(1)
+        reporter.failure('Local checks are currently unsupported, "check" back soon!')
+        return 1
 
     # Show how to use it
-    click.echo()
+    reporter.echo()
 
-    echo_info('Location: `{}`'.format(check_class.location))
+    reporter.info('Location: `{}`'.format(check_class.location))
     if isinstance(check_class, DockerCheck):
-        echo_info('Container name: `{}`'.format(check_class.container_name))
+        reporter.info('Container name: `{}`'.format(check_class.container_name))
+        for option, port in check_class.ports.items():
+            reporter.info('Host port `{}`: {} -> {}'.format(option, port, check_class.host_ports[option]))
+        reporter.info('Started in {:.1f} s:'.format(time.perf_counter() - start_time))
+        reporter.output(format_timings(sorted(spans, key=lambda span: span.start)))
     elif isinstance(check_class, VagrantCheck):
-        echo_failure('Vagrant checks are currently unsupported, "check" back soon!')
-        sys.exit(1)
+        reporter.failure('Vagrant checks are currently unsupported, "check" back soon!')
+        return 1
     else:
-        echo_failure('Local checks are currently unsupported, "check" back soon!')
-        sys.exit(1)
+        reporter.failure('Local checks are currently unsupported, "check" back soon!')
+        return 1
 
-    location_arg = '-l {} '.format(location) if given_location else ''
+    location_arg = '-l {} '.format(config['given_location']) if config['given_location'] else ''
     instance_arg = ' {}'.format(instance_name) if instance_name != DEFAULT_NAME else ''
     flavor_arg = ' {}'.format(flavor) if flavor != DEFAULT_NAME or instance_arg else ''
 
     if direct:
         if not prod:
-            echo_info('To test this check, do `di test -d {}{}{}{}`.'.format(
+            reporter.info('To test this check, do `di test -d {}{}{}{}`.'.format(
                 location_arg, check_name, flavor_arg, instance_arg
             ))
-        echo_info('To run this check, do `di check -d {}{}{}{}`.'.format(
+        reporter.info('To run this check, do `di check -d {}{}{}{}`.'.format(
             location_arg, check_name, flavor_arg, instance_arg
         ))
-        echo_info('To stop this check, do `di stop -d {}{}{}{}`.'.format(
+        reporter.info('To stop this check, do `di stop -d {}{}{}{}`.'.format(
             location_arg, check_name, flavor_arg, instance_arg
         ))
     else:
         if not prod:
-            echo_info('To test this check, do `di test {}{}{}`.'.format(
+            reporter.info('To test this check, do `di test {}{}{}`.'.format(
                 check_name, flavor_arg, instance_arg
             ))
-        echo_info('To run this check, do `di check {}{}{}`.'.format(
+        reporter.info('To run this check, do `di check {}{}{}`.'.format(
             check_name, flavor_arg, instance_arg
         ))
-        echo_info('To stop this check, do `di stop {}{}{}`.'.format(
+        reporter.info('To stop this check, do `di stop {}{}{}`.'.format(
             check_name, flavor_arg, instance_arg
         ))
+
+    return 0
+
+
+def start_environments(configs, workers, shared=None):
+    """Starts environments, given as a mapping of environment to config,
+    concurrently and returns each one's exit status.
+    """
+    shared = shared or SharedResults()
+    statuses = OrderedDict()
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = OrderedDict(
+            (environment, executor.submit(
+                start_environment, *environment, config=config,
+                reporter=Reporter(get_environment_label(*environment)), shared=shared
+            ))
+            for environment, config in configs.items()
+        )
+
+        for environment, future in futures.items():
+            try:
+                statuses[environment] = future.result()
+            except Exception as e:
+                Reporter(get_environment_label(*environment)).failure('Unexpected error: {}'.format(e))
+                statuses[environment] = 1
+
+    return statuses
+
+
+def build_start_config(settings, options, direct, location, force, api_key, ignore_missing,
+                       prod, copy_conf, core, extras, agent, image, no_pull, pull=None, verbose=False,
+                       pool=None, dev_image=None):
+    user_api_key = api_key or settings.get('api_key', '${DD_API_KEY}')
+    api_key, evar = get_compose_api_key(user_api_key)
+    if not ignore_missing and api_key != user_api_key:
+        echo_warning(
+            "Environment variable {} doesn't exist; a well-formatted "
+            "fake API key will be used instead.".format(evar)
+        )
+        click.echo()
+    else:
+        api_key = user_api_key
+
+    prod = prod if prod is not None else settings.get('mode', 'prod') == 'prod'
+
+    if not prod:
+        core = resolve_path(core or settings.get('core', ''))
+        extras = resolve_path(extras or settings.get('extras', ''))
+
+        if not dir_exists(core):
+            echo_failure(
+                'All checks running in dev mode require `integrations-core` '
+                'for its {} dependency.'.format(CHECKS_BASE_PACKAGE)
+            )
+            sys.exit(1)
+
+    return {
+        'settings': settings,
+        'options': OrderedDict(options),
+        'api_key': api_key,
+        'given_location': location,
+        'location': location or settings.get('location', CHECKS_DIR),
+        'direct': direct,
+        'force': force or settings.get('force', False),
+        'confirm': click.confirm,
+        'prod': prod,
+        'copy_conf': copy_conf if copy_conf is not None else settings.get('copy_conf', True),
+        'core': core,
+        'extras': extras,
+        'agent': agent or settings.get('agent', ''),
+        'image': image,
+        'no_pull': no_pull,
+        'pull': pull or 'ttl',
+        'pull_ttl': settings.get('pull_ttl', 3600),
+        'verbose': verbose,
+        'pool': pool if pool is not None else settings.get('pool_size', 0) > 0,
+        'dev_image': dev_image if dev_image is not None else settings.get('dev_image', True),
+    }
+
+
+def defer_recreations(environments, config):
+    """Returns a config per environment whose prompt to recreate an existing
+    environment, as prompts cannot interleave with concurrent output, instead
+    records it in the returned list to be asked about once all have run. Those
+    already running and up to date thus never prompt.
+    """
+    configs = OrderedDict()
+    deferred = []
+
+    for environment in environments:
+        def defer(message, environment=environment):
+            deferred.append((environment, message))
+            return False
+
+        configs[environment] = dict(config, confirm=defer)
+
+    return configs, deferred
+
+
+@click.command(context_settings=CONTEXT_SETTINGS,
+               short_help='Starts fully functioning integrations')
+@click.argument('specs', metavar='CHECK [FLAVOR [INSTANCE]] | CHECK[:FLAVOR[:INSTANCE]]...',
+                nargs=-1, required=True)
+@click.option('--options', '-o', nargs=2, multiple=True)
+@click.option('--direct', '-d', is_flag=True)
+@click.option('--location', '-l', default='')
+@click.option('--force', '-f', is_flag=True)
+@click.option('--api_key', '-key')
+@click.option('--ignore-missing', '-im', is_flag=True)
+@click.option('--prod/--dev', default=None)
+@click.option('--copy-conf/--use-conf', default=None)
+@click.option('--core', default='')
+@click.option('--extras', default='')
+@click.option('--agent', '-a', type=click.INT)
+@click.option('--image', '-i', default='')
+@click.option('--no-pull', '-np', is_flag=True)
+@click.option('--pull', type=click.Choice(PULL_POLICIES),
+              help='When to pull the agent image; `ttl` (the default) skips pulls '
+                   'for `pull_ttl` seconds after the last one.')
+@click.option('--workers', '-w', type=click.INT,
+              help='The maximum number of environments to start at once.')
+@click.option('--verbose', '-v', is_flag=True,
+              help='Shows the output of pulls and builds as they happen.')
+@click.option('--pool/--no-pool', default=None,
+              help='Whether to claim an idle agent container from `di pool` in prod mode; '
+                   'on by default when `pool_size` is set.')
+@click.option('--dev-image/--no-dev-image', default=None,
+              help='Whether to run dev mode agents from an image with the dependencies of the '
+                   'check preinstalled, built once per set of requirements (default: yes).')
+def start(specs, options, direct, location, force, api_key, ignore_missing, prod,
+          copy_conf, core, extras, agent, image, no_pull, pull, workers, verbose, pool, dev_image):
+    """Starts fully functioning integrations.
+
+    \b
+    $ di start nginx
+    Using docker image `datadog/agent-dev:master`
+
+    Detecting the agent's major version...
+    Agent 6 detected
+    Reading the configuration file for `nginx`...
+
+    Creating necessary files...
+    Successfully wrote:
+      C:\\Users\\Ofek\\AppData\\Local\\di-dev\\checks\\nginx\\stub\\default\\nginx.yaml
+      C:\\Users\\Ofek\\AppData\\Local\\di-dev\\checks\\nginx\\stub\\default\\docker-compose.yaml
+      C:\\Users\\Ofek\\AppData\\Local\\di-dev\\checks\\nginx\\stub\\default\\status.conf
+
+    Starting containers...
+    Success!
+
+    To run this check, do `di check nginx`.
+
+    Several environments are started concurrently when given as CHECK[:FLAVOR[:INSTANCE]]:
+
+    \b
+    $ di start nginx envoy nginx:stub:other
+    """
+    try:
+        environments = parse_environment_specs(specs)
+    except ValueError as e:
+        echo_failure(str(e))
+        sys.exit(1)
+
+    for check_name, flavor, _ in environments:
+        if check_name not in Checks:
+            echo_failure('Check `{}` is not yet supported.'.format(check_name))
+            sys.exit(1)
+
+        if flavor not in Checks[check_name]:
+            echo_failure('Flavor `{}` is not yet supported.'.format(flavor))
+            sys.exit(1)
+
+    if direct and len(environments) > 1:
+        echo_failure('Only one environment can be started at a time with --direct.')
+        sys.exit(1)
+
+    settings = load_settings()
+    config = build_start_config(
+        settings, options, direct, location, force, api_key, ignore_missing,
+        prod, copy_conf, core, extras, agent, image, no_pull, pull, verbose, pool, dev_image
+    )
+
+    if len(environments) == 1:
+        sys.exit(start_environment(*environments[0], config=config, reporter=Reporter(), shared=SharedResults()))
+
+    # Different specs, like `nginx` and `nginx:stub`, may refer to the same environment
+    environments = list(OrderedDict.fromkeys(
+        (check_name, Checks[check_name][flavor].flavor, instance_name)
+        for check_name, flavor, instance_name in environments
+    ))
+
+    workers = workers or settings.get('workers', 4)
+    echo_info('Starting {} environments with up to {} workers...'.format(len(environments), workers))
+    click.echo()
+
+    shared = SharedResults()
+    configs, deferred = defer_recreations(environments, config)
+    statuses = start_environments(configs, workers, shared)
+
+    if deferred:
+        click.echo()
+        confirmed = OrderedDict()
+        for environment, message in deferred:
+            if click.confirm(message):
+                confirmed[environment] = dict(configs[environment], force=True)
+            else:
+                del statuses[environment]
+
+        if confirmed:
+            click.echo()
+            echo_info('Recreating {} environments with up to {} workers...'.format(len(confirmed), workers))
+            click.echo()
+            statuses.update(start_environments(confirmed, workers, shared))
+
+    if not statuses:
+        sys.exit(2)
+
+    sys.exit(report_statuses(statuses))
@@ -1,31 +1,127 @@
 import sys
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 import click
 
 from di.checks import Checks
+from di.commands.ls import list_environments, select_environments
 from di.commands.utils import (
-    CONTEXT_SETTINGS, echo_failure, echo_success, echo_waiting, echo_warning
+    CONTEXT_SETTINGS, Reporter, echo_failure, echo_info, echo_success, echo_waiting, echo_warning,
+    get_environment_label, report_statuses
 )
-from di.docker import check_dir_down
+from di.docker import check_dir_down, check_dir_kill, remove_containers
+from di.metadata import read_env_metadata
 from di.settings import load_settings
-from di.utils import CHECKS_DIR, DEFAULT_NAME
+from di.utils import CHECKS_DIR, DEFAULT_NAME, dir_exists, remove_path
 
 
-@click.command(context_settings=CONTEXT_SETTINGS, short_help='Stops an integration')
-@click.argument('check_name')
+def stop_environment(location, container_name, reporter, kill=False, remove=False):
+    """Tears an environment down, killing its containers first with `kill`
+    rather than waiting for them to exit, and returns an exit status. With
+    `remove`, the environment's directory is deleted once it is down.
+    """
+    try:
+        # Compose does not know about agents claimed from the pool
+        metadata = read_env_metadata(location)
+        if metadata.get('warm'):
+            remove_containers([metadata.get('container_name') or container_name])
+
+        error = 0
+        if kill:
+            output, error = check_dir_kill(location)
+        if not error:
+            # Also removes the network, which is quick once containers are dead
+            output, error = check_dir_down(location)
+    except FileNotFoundError:
+        reporter.echo()
+        reporter.warning('Location `{}` already does not exist.'.format(location))
+        return 0
+
+    if error:
+        reporter.echo()
+        reporter.output(output)
+        reporter.failure('An unexpected Docker error (status {}) has occurred.'.format(error))
+    elif remove:
+        remove_path(location)
+    return error
+
+
+def stop_environments(environments, workers, kill=False, remove=False):
+    """Stops environments, as given by `di.commands.ls.list_environments`,
+    with at most `workers` at once and returns each one's exit status.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = OrderedDict()
+        for environment in environments:
+            label = (environment['check'], environment['flavor'], environment['instance'])
+            futures[label] = executor.submit(
+                stop_environment, environment['location'], environment['container_name'],
+                Reporter(get_environment_label(*label)), kill=kill, remove=remove
+            )
+
+        return OrderedDict((label, future.result()) for label, future in futures.items())
+
+
+@click.command(context_settings=CONTEXT_SETTINGS, short_help='Stops integrations')
+@click.argument('check_name', required=False)
 @click.argument('flavor', required=False, default=DEFAULT_NAME)
 @click.argument('instance_name', required=False, default=DEFAULT_NAME)
-@click.option('--remove', '-r', is_flag=True)
+@click.option('--remove', '-r', is_flag=True,
+              help='Also deletes the directory of every stopped environment.')
 @click.option('--direct', '-d', is_flag=True)
 @click.option('--location', '-l', default='')
-def stop(check_name, flavor, instance_name, remove, direct, location):
-    """Stops an integration.
+@click.option('--all', '-a', 'stop_all', is_flag=True,
+              help='Stops every environment in the location.')
+@click.option('--check', '-c', 'checks', multiple=True,
+              help='Stops every environment of this check.')
+@click.option('--flavor', 'flavors', multiple=True,
+              help='Stops every environment of this flavor.')
+@click.option('--match', '-m', 'patterns', multiple=True,
+              help='Stops environments whose CHECK:FLAVOR:INSTANCE matches this glob, e.g. `nginx:*:ci*`.')
+@click.option('--kill', '-k', is_flag=True,
+              help='Kills containers instead of waiting for them to shut down.')
+@click.option('--workers', '-w', type=click.INT,
+              help='The maximum number of environments to stop at once.')
+def stop(check_name, flavor, instance_name, remove, direct, location, stop_all, checks, flavors, patterns,
+         kill, workers):
+    """Stops an integration, or with selectors, several at once.
 
     \b
     $ di stop -r nginx
     Stopping containers... success!
-    Removing containers... success!
+    Removed `/home/ofek/.local/share/di-dev/checks/nginx/stub/default`
+
+    \b
+    $ di stop --all --kill
+    $ di stop -c nginx -m '*:ci-*'
     """
+    settings = load_settings()
+    location = location or settings.get('location', CHECKS_DIR)
+
+    if stop_all or checks or flavors or patterns:
+        if check_name or direct:
+            echo_failure('Selectors cannot be combined with a CHECK argument or --direct.')
+            sys.exit(1)
+
+        environments, _ = list_environments(location)
+        if not stop_all:
+            environments = select_environments(environments, checks, flavors, patterns)
+
+        if not environments:
+            echo_info('No matching environments in `{}`.'.format(location))
+            return
+
+        workers = workers or settings.get('workers', 4)
+        echo_info('Stopping {} environments with up to {} workers...'.format(len(environments), workers))
+
+        statuses = stop_environments(environments, workers, kill=kill, remove=remove)
+        sys.exit(report_statuses(statuses, verb='stopped'))
+
+    if not check_name:
+        echo_failure('Missing argument "CHECK", or a selector such as --all.')
+        sys.exit(1)
+
     if check_name not in Checks:
         echo_failure('Check `{}` is not yet supported.'.format(check_name))
         sys.exit(1)
@@ -35,25 +131,21 @@ def stop(check_name, flavor, instance_name, remove, direct, location):
         sys.exit(1)
 
     check_class = Checks[check_name][flavor]
-    settings = load_settings()
-    location = location or settings.get('location', CHECKS_DIR)
-
     location = check_class.get_location(
         location, instance_name=instance_name, direct=direct
     )
+    container_name = check_class.get_container_name(instance_name, location, direct)
 
     echo_waiting('Stopping containers... ', nl=False)
-
-    try:
-        output, error = check_dir_down(location)
-    except FileNotFoundError:
+    if not dir_exists(location):
         click.echo()
         echo_warning('Location `{}` already does not exist.'.format(location))
         sys.exit()
 
+    error = stop_environment(location, container_name, Reporter(), kill=kill, remove=remove)
     if error:
-        click.echo()
-        click.echo(output.rstrip())
-        echo_failure('An unexpected Docker error (status {}) has occurred.'.format(error))
         sys.exit(error)
     echo_success('success!')
+
+    if remove:
+        echo_info('Removed `{}`'.format(location))
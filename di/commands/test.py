@@ -1,12 +1,95 @@
 import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
 import click
 
 from di.checks import Checks
-from di.commands.utils import CONTEXT_SETTINGS, echo_failure
-from di.docker import test_check
+from di.commands.utils import (
+    CONTEXT_SETTINGS, Reporter, echo_failure, echo_info, echo_success, echo_waiting
+)
+from di.docker import (
+    commit_container, get_compose_network, list_tox_envs, prune_tox_workdirs, remove_image, test_check,
+    test_check_in_clone
+)
+from di.metadata import read_env_metadata, update_env_metadata
 from di.settings import load_settings
-from di.utils import CHECKS_DIR, DEFAULT_NAME
+from di.utils import CHECKS_BASE_PACKAGE, CHECKS_DIR, DEFAULT_NAME, get_check_mount_dir, get_deps_hash
+
+
+def split_envs(envs, parts):
+    """Deals tox envs round-robin, as neighbouring ones such as a version matrix tend to cost the same."""
+    return [shard for shard in (envs[i::parts] for i in range(parts)) if shard]
+
+
+def get_cache_key(metadata, check_name):
+    """Keys tox envs by the dependencies of the check and base package mounted into the agent."""
+    package_mounts = (get_check_mount_dir(check_name), get_check_mount_dir(CHECKS_BASE_PACKAGE))
+    return get_deps_hash(*(local for local, mount in metadata.get('mounts', []) if mount in package_mounts))
+
+
+def run_shard(image, container_name, clone_name, check_name, envs, network, cache_key):
+    start = time.perf_counter()
+    _, returncode = test_check_in_clone(
+        image, container_name, check_name, envs, name=clone_name, network=network, cache_key=cache_key,
+        output=Reporter(','.join(envs)).echo
+    )
+
+    return returncode, time.perf_counter() - start
+
+
+def test_in_parallel(container_name, check_name, network, parallel, cache_key=''):
+    """Runs every tox env of a check across up to `parallel` ephemeral clones
+    of its agent container and returns an exit status.
+    """
+    echo_waiting('Listing tox environments... ', nl=False)
+    envs, error = list_tox_envs(container_name, check_name)
+    if error:
+        click.echo()
+        click.echo(envs.rstrip())
+        echo_failure('Unable to list tox environments (status {}).'.format(error))
+        return error
+    echo_success(', '.join(envs))
+
+    # Snapshots the dev dependencies and check installed in the container at start. Names
+    # are unique per run, as the same environment may be tested several times at once.
+    image = 'di-test-{}-{}'.format(container_name.lower(), uuid.uuid4().hex[:8])
+    output, error = commit_container(container_name, image)
+    if error:
+        click.echo(output.rstrip())
+        echo_failure('Unable to snapshot container `{}` (status {}).'.format(container_name, error))
+        return error
+
+    shards = split_envs(envs, parallel)
+    echo_info('Running {} tox environments in {} containers...'.format(len(envs), len(shards)))
+    click.echo()
+
+    try:
+        with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+            futures = [
+                executor.submit(
+                    run_shard, image, container_name, '{}-{}'.format(image, i), check_name, shard, network,
+                    cache_key
+                )
+                for i, shard in enumerate(shards)
+            ]
+            results = [future.result() for future in futures]
+    finally:
+        remove_image(image)
+
+    click.echo()
+    width = max(len(','.join(shard)) for shard in shards)
+    for shard, (returncode, elapsed) in zip(shards, results):
+        line = '{}  {:<9} {:.1f} s'.format(
+            ','.join(shard).ljust(width), 'failed {}'.format(returncode) if returncode else 'passed', elapsed
+        )
+        if returncode:
+            echo_failure(line)
+        else:
+            echo_success(line)
+
+    return next((returncode for returncode, _ in results if returncode), 0)
 
 
 @click.command(context_settings=CONTEXT_SETTINGS,
@@ -17,11 +100,26 @@ from di.utils import CHECKS_DIR, DEFAULT_NAME
 @click.option('--full', is_flag=True)
 @click.option('--direct', '-d', is_flag=True)
 @click.option('--location', '-l', default='')
-def test(check_name, flavor, instance_name, full, direct, location):
+@click.option('--parallel', '-p', type=click.IntRange(1), default=1,
+              help='Runs every tox env, as with --full, split across this many '
+                   'containers cloned from the agent container.')
+@click.option('--cache/--no-cache', default=True,
+              help='Whether to keep tox envs in the environment\'s cache volume (default: yes).')
+def test(check_name, flavor, instance_name, full, direct, location, parallel, cache):
     """Tests a check running in dev mode.
 
     \b
     $ di test nginx
+
+    With --parallel, all tox envs run at once in ephemeral copies of the agent
+    container that share its mounts and network, and their output is merged:
+
+    \b
+    $ di test nginx -p 4
+
+    Environments started in dev mode keep tox envs and the pip cache in a
+    volume, so envs are only rebuilt when the `setup.py`, requirements or
+    `tox.ini` of the check or base package change. See `di cache volumes`.
     """
     if check_name not in Checks:
         echo_failure('Check `{}` is not yet supported.'.format(check_name))
@@ -38,12 +136,31 @@ def test(check_name, flavor, instance_name, full, direct, location):
     location = check_class.get_location(
         location, instance_name=instance_name, direct=direct
     )
-    container_name = check_class.get_container_name(
+
+    metadata = read_env_metadata(location)
+    if metadata.get('mode') == 'prod':
+        echo_failure('`{}` was started in prod mode, tests require the --dev flag.'.format(location))
+        sys.exit(1)
+
+    container_name = metadata.get('container_name') or check_class.get_container_name(
         instance_name=instance_name, location=location, direct=direct
     )
 
+    cache_key = ''
+    if cache and metadata.get('cache_volume'):
+        cache_key = get_cache_key(metadata, check_name)
+        if cache_key != metadata.get('cache_key'):
+            prune_tox_workdirs(container_name, cache_key)
+            update_env_metadata(location, cache_key=cache_key)
+
+    if parallel > 1:
+        sys.exit(test_in_parallel(
+            container_name, check_name, get_compose_network(location, check_class.agent_network), parallel,
+            cache_key=cache_key
+        ))
+
     try:
-        error = test_check(container_name, check_name, full=full)
+        error = test_check(container_name, check_name, full=full, cache_key=cache_key)
     except FileNotFoundError:
         echo_failure('Location `{}` does not exist.'.format(location))
         sys.exit(1)
@@ -0,0 +1,94 @@
+import sys
+from collections import OrderedDict
+
+import click
+import toml
+
+from di.checks import Checks
+from di.commands.start import build_start_config, start_environments
+from di.commands.utils import (
+    CONTEXT_SETTINGS, echo_failure, echo_info, echo_success, get_environment_label, report_statuses
+)
+from di.docker import PULL_POLICIES, running_containers
+from di.manifest import get_spec_hash, load_manifest
+from di.metadata import read_env_metadata
+from di.settings import load_settings
+
+
+@click.command(context_settings=CONTEXT_SETTINGS,
+               short_help='Creates environments listed in a manifest')
+@click.option('--file', '-f', 'manifest_file', required=True,
+              type=click.Path(exists=True, dir_okay=False),
+              help='The TOML manifest of environments.')
+@click.option('--location', '-l', default='')
+@click.option('--api_key', '-key')
+@click.option('--ignore-missing', '-im', is_flag=True)
+@click.option('--no-pull', '-np', is_flag=True)
+@click.option('--pull', type=click.Choice(PULL_POLICIES),
+              help='When to pull agent images, see `di start --help`.')
+@click.option('--workers', '-w', type=click.INT,
+              help='The maximum number of environments to start at once.')
+def up(manifest_file, location, api_key, ignore_missing, no_pull, pull, workers):
+    """Creates environments listed in a manifest. Only environments that are not
+    running or whose entry changed since they were created are (re)started.
+
+    \b
+    $ cat envs.toml
+    [[environments]]
+    check = "nginx"
+    instance = "old"
+    options = { version = "1.12" }
+
+    [[environments]]
+    check = "envoy"
+
+    \b
+    $ di up -f envs.toml
+    """
+    try:
+        manifest = load_manifest(manifest_file)
+    except (ValueError, toml.TomlDecodeError) as e:
+        echo_failure('Invalid manifest `{}`: {}'.format(manifest_file, e))
+        sys.exit(1)
+
+    mode = manifest.get('mode')
+    settings = load_settings()
+    config = build_start_config(
+        settings, options=(), direct=False, location=location or manifest.get('location', ''), force=True,
+        api_key=api_key, ignore_missing=ignore_missing, prod=None if mode is None else mode == 'prod',
+        copy_conf=None, core=manifest.get('core', ''), extras=manifest.get('extras', ''),
+        agent=None, image='', no_pull=no_pull, pull=pull
+    )
+
+    running, _ = running_containers('agent_')
+    configs = OrderedDict()
+
+    for environment, spec in manifest['environments'].items():
+        check_name, flavor, instance_name = environment
+        check_class = Checks[check_name][flavor]
+        spec_hash = get_spec_hash(environment, OrderedDict(spec, prod=config['prod']))
+
+        container_name = check_class.get_container_name(instance_name=instance_name)
+        env_location = check_class.get_location(config['location'], instance_name=instance_name)
+
+        if container_name in running and read_env_metadata(env_location).get('spec_hash') == spec_hash:
+            echo_success('{}  up to date'.format(get_environment_label(*environment)))
+            continue
+
+        configs[environment] = dict(
+            config, options=spec['options'], image=spec['image'],
+            agent=spec['agent'] or config['agent'], spec_hash=spec_hash
+        )
+
+    if not configs:
+        echo_info('All environments are up to date.')
+        return
+
+    workers = workers or manifest.get('workers') or settings.get('workers', 4)
+    if len(configs) < len(manifest['environments']):
+        click.echo()
+    echo_info('Starting {} environments with up to {} workers...'.format(len(configs), workers))
+    click.echo()
+
+    statuses = start_environments(configs, workers)
+    sys.exit(report_statuses(statuses))
@@ -1,3 +1,7 @@
+import threading
+from collections import OrderedDict
+from importlib import import_module
+
 import click
 
 CONTEXT_SETTINGS = {
@@ -9,6 +13,59 @@ UNKNOWN_OPTIONS = {
 }
 
 
+class LazyGroup(click.Group):
+    """A group whose subcommands, given as `module:attribute` paths along
+    with their short help, are only imported once they are invoked. Help
+    and completion list them by the short help given instead.
+    """
+    def __init__(self, *args, lazy_commands=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lazy_commands = lazy_commands or {}
+
+    def list_commands(self, ctx):
+        return sorted(set(super().list_commands(ctx)) | set(self.lazy_commands))
+
+    def get_command(self, ctx, cmd_name):
+        command = super().get_command(ctx, cmd_name)
+        if command is None and cmd_name in self.lazy_commands:
+            module, _, name = self.lazy_commands[cmd_name][0].partition(':')
+            command = getattr(import_module(module), name)
+            self.add_command(command, cmd_name)
+        return command
+
+    def get_short_helps(self, ctx, limit=45):
+        """Returns command name -> short help, without importing any command."""
+        short_helps = OrderedDict()
+        for cmd_name in self.list_commands(ctx):
+            command = self.commands.get(cmd_name)
+            if command is None:
+                short_helps[cmd_name] = self.lazy_commands[cmd_name][1]
+            elif not command.hidden:
+                short_helps[cmd_name] = command.get_short_help_str(limit)
+
+        return short_helps
+
+    def format_commands(self, ctx, formatter):
+        # Allows for 3 times the default spacing, like `click.Group`
+        limit = formatter.width - 6 - max(map(len, self.list_commands(ctx)), default=0)
+        short_helps = self.get_short_helps(ctx, limit)
+        if short_helps:
+            with formatter.section('Commands'):
+                formatter.write_dl(list(short_helps.items()))
+
+    def shell_complete(self, ctx, incomplete):
+        from click.shell_completion import CompletionItem
+
+        results = [
+            CompletionItem(cmd_name, help=short_help)
+            for cmd_name, short_help in self.get_short_helps(ctx).items()
+            if cmd_name.startswith(incomplete)
+        ]
+        # Options of the group itself, skipping the lookup of every command by `click.Group`
+        results.extend(click.Command.shell_complete(self, ctx, incomplete))
+        return results
+
+
 def echo_success(text, nl=True):
     click.secho(text, fg='cyan', bold=True, nl=nl)
 
@@ -27,3 +84,74 @@ def echo_waiting(text, nl=True):
 
 def echo_info(text, nl=True):
     click.secho(text, bold=True, nl=nl)
+
+
+class Reporter:
+    """Routes a command's progress output, prefixing each line with a label
+    when several environments are being handled concurrently.
+    """
+    STYLES = {
+        'success': {'fg': 'cyan', 'bold': True},
+        'failure': {'fg': 'red', 'bold': True},
+        'warning': {'fg': 'yellow', 'bold': True},
+        'waiting': {'fg': 'magenta', 'bold': True},
+        'info': {'bold': True},
+        'plain': {},
+    }
+    lock = threading.Lock()
+
+    def __init__(self, label=''):
+        self.label = label
+        self.pending = []
+
+    def echo(self, text='', style='plain', nl=True):
+        if not self.label:
+            click.secho(text, nl=nl, **self.STYLES[style])
+            return
+
+        if text:
+            self.pending.append(click.style(text, **self.STYLES[style]))
+
+        if nl:
+            line = ''.join(self.pending)
+            self.pending = []
+
+            # Blank spacer lines only make sense for a single environment
+            if line.strip():
+                with self.lock:
+                    click.echo('[{}] {}'.format(self.label, line))
+
+    def output(self, text):
+        for line in text.rstrip().splitlines():
+            self.echo(line)
+
+    def success(self, text, nl=True):
+        self.echo(text, 'success', nl)
+
+    def failure(self, text, nl=True):
+        self.echo(text, 'failure', nl)
+
+    def warning(self, text, nl=True):
+        self.echo(text, 'warning', nl)
+
+    def waiting(self, text, nl=True):
+        self.echo(text, 'waiting', nl)
+
+    def info(self, text, nl=True):
+        self.echo(text, 'info', nl)
+
+
+def get_environment_label(check_name, flavor, instance_name):
+    return '{}:{}:{}'.format(check_name, flavor, instance_name)
+
+
+def report_statuses(statuses, verb='started'):
+    click.echo()
+    for environment, status in statuses.items():
+        label = get_environment_label(*environment)
+        if status:
+            echo_failure('{}  failed (status {})'.format(label, status))
+        else:
+            echo_success('{}  {}'.format(label, verb))
+
+    return next((status for status in statuses.values() if status), 0)
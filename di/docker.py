@@ -1,180 +1,832 @@
+import hashlib
+import http.client
+import json
+import os
+import re
 import subprocess
+import sys
+import threading
+import time
+from collections import OrderedDict
 from subprocess import PIPE
+from tempfile import TemporaryDirectory
+
+from di.agent import A6_CONF_DIR, get_agent_exe_path, get_check_times_args, get_conf_example_glob
+from di.cache import (
+    get_cached_agent_version, get_cached_example_conf, get_pull_record, load_image_cache,
+    record_pull, remove_image_cache, update_image_cache
+)
+from di.engine import EngineClient, EngineError, get_socket_path
+from di.runner import run_command
+from di.settings import load_settings
+from di.trace import traced
+from di.utils import (
+    CACHE_MOUNT_DIR, CACHE_VOLUME_PREFIX, FAKE_API_KEY, NEED_SUBPROCESS_SHELL, ON_WINDOWS, get_check_mount_dir
+)
+
+BACKEND_ENV_VAR = 'DI_DOCKER_BACKEND'
+PULL_POLICIES = ('always', 'missing', 'ttl')
+
+POOL_LABEL = 'di.pool'
+CACHE_LABEL = 'di.cache'
+POOL_NAME_PREFIX = 'di_pool_'
+
+# Runs inside the image, so it must remain compatible with the Python 2 of Agent 5
+INTROSPECTION_SCRIPT = """\
+import glob, json, os, sys
+checks, dirs = json.loads(sys.argv[1]), json.loads(sys.argv[2])
+result = {'manifest': '', 'dirs': {}, 'confs': {}}
+try:
+    result['manifest'] = open('/opt/datadog-agent/version-manifest.txt').readline().strip()
+except (IOError, OSError):
+    pass
+for d in dirs:
+    result['dirs'][d] = os.path.isdir(d)
+for check, globs in checks.items():
+    result['confs'][check] = {}
+    for version, pattern in globs.items():
+        matches = glob.glob(pattern)
+        result['confs'][check][version] = open(matches[0]).read() if matches else None
+sys.stdout.write(json.dumps(result))
+"""
+__backend = None
+__backend_lock = threading.Lock()
+
+
+class CliBackend:
+    name = 'cli'
+
+    def run(self, image, command, env=None):
+        args = ['docker', 'run', '--rm']
+        for evar in env or []:
+            args.extend(['-e', evar])
+        args.append(image)
+        args.extend(command)
+
+        process = subprocess.run(args, stdout=PIPE, stderr=PIPE, shell=NEED_SUBPROCESS_SHELL)
+        return process.stdout.decode(), process.stderr.decode(), process.returncode
+
+    def exec(self, container, command, capture=True, workdir=None, env=None):
+        args = ['docker', 'exec']
+        if workdir:
+            args.extend(['--workdir', workdir])
+        for evar in env or []:
+            args.extend(['-e', evar])
+        args.append(container)
+        args.extend(command)
+
+        if capture:
+            process = subprocess.run(args, stdout=PIPE, stderr=PIPE, shell=NEED_SUBPROCESS_SHELL)
+            return process.stdout.decode(), process.stderr.decode(), process.returncode
+        else:
+            process = subprocess.run(args, shell=NEED_SUBPROCESS_SHELL)
+            return '', '', process.returncode
+
+    def containers(self, name):
+        process = subprocess.run([
+            'docker', 'ps', '-f', 'name={}'.format(name), '--format', '{{.Names}}'
+        ], stdout=PIPE, stderr=PIPE, shell=NEED_SUBPROCESS_SHELL)
 
-from di.agent import A6_CONF_DIR, get_agent_exe_path, get_conf_example_glob
-from di.utils import FAKE_API_KEY, NEED_SUBPROCESS_SHELL, chdir, get_check_mount_dir
+        return process.stdout.decode().split(), process.returncode
 
+    def pull(self, image, output=None, on_event=None):
+        return run_command(['docker', 'pull', image], output=output, on_event=on_event)
 
-def check_dir_start(d, build=False):
-    command = ['docker-compose', 'up', '-d']
-    if build:
-        command.append('--build')
+    def image_id(self, image):
+        process = subprocess.run([
+            'docker', 'image', 'inspect', '--format', '{{.Id}}', image
+        ], stdout=PIPE, stderr=PIPE, shell=NEED_SUBPROCESS_SHELL)
 
-    with chdir(d):
-        process = subprocess.run(command, stdout=PIPE, stderr=PIPE, shell=NEED_SUBPROCESS_SHELL)
+        return process.stdout.decode().strip() if not process.returncode else ''
 
-    return process.stdout.decode() + process.stderr.decode(), process.returncode
+    @staticmethod
+    def _call(args):
+        process = subprocess.run(args, stdout=PIPE, stderr=PIPE, shell=NEED_SUBPROCESS_SHELL)
+        return process.stdout.decode() + process.stderr.decode(), process.returncode
 
+    def run_detached(self, image, name, labels=None, env=None):
+        args = ['docker', 'run', '-d', '--name', name]
+        for key, value in (labels or {}).items():
+            args.extend(['--label', '{}={}'.format(key, value)])
+        for evar in env or []:
+            args.extend(['-e', evar])
+        args.append(image)
 
-def check_dir_down(d):
-    with chdir(d):
-        process = subprocess.run(['docker-compose', 'down'], stdout=PIPE, stderr=PIPE, shell=NEED_SUBPROCESS_SHELL)
+        return self._call(args)
 
-    return process.stdout.decode() + process.stderr.decode(), process.returncode
+    def labeled_containers(self, label, keys):
+        """Returns all containers with the label `label`, along with the values of their labels `keys`."""
+        process = subprocess.run([
+            'docker', 'ps', '-a', '--filter', 'label={}'.format(label), '--format',
+            '\t'.join(['{{.Names}}'] + ['{{{{.Label "{}"}}}}'.format(key) for key in keys])
+        ], stdout=PIPE, stderr=PIPE, shell=NEED_SUBPROCESS_SHELL)
 
+        containers = []
+        for line in process.stdout.decode().splitlines():
+            name, *values = line.split('\t')
+            containers.append({'name': name, 'labels': dict(zip(keys, values))})
 
-def check_dir_stop(d):
-    with chdir(d):
-        process = subprocess.run(['docker-compose', 'stop'], stdout=PIPE, stderr=PIPE, shell=NEED_SUBPROCESS_SHELL)
+        return containers, process.returncode
 
-    return process.stdout.decode() + process.stderr.decode(), process.returncode
+    def rename(self, container, name):
+        return self._call(['docker', 'rename', container, name])
 
+    def connect(self, container, network, alias):
+        return self._call(['docker', 'network', 'connect', '--alias', alias, network, container])
 
-def check_dir_kill(d):
-    with chdir(d):
-        process = subprocess.run(['docker-compose', 'kill'], stdout=PIPE, stderr=PIPE, shell=NEED_SUBPROCESS_SHELL)
+    def copy(self, container, local, remote):
+        return self._call(['docker', 'cp', local, '{}:{}'.format(container, remote)])
 
-    return process.stdout.decode() + process.stderr.decode(), process.returncode
+    def remove(self, containers):
+        return self._call(['docker', 'rm', '-f', *containers])
 
 
-def check_dir_remove_containers(d):
-    with chdir(d):
-        process = subprocess.run(['docker-compose', 'rm', '-f'], stdout=PIPE, stderr=PIPE, shell=NEED_SUBPROCESS_SHELL)
+class EngineBackend:
+    name = 'engine'
 
-    return process.stdout.decode() + process.stderr.decode(), process.returncode
+    def __init__(self, client=None):
+        self.client = client or EngineClient()
+
+    def run(self, image, command, env=None):
+        try:
+            return self.client.run(image, command, env=env)
+        except EngineError as e:
+            return '', e.message, 125
+        except (OSError, http.client.HTTPException) as e:
+            return '', str(e), 125
+
+    def exec(self, container, command, capture=True, workdir=None, env=None):
+        try:
+            return self.client.exec(container, command, capture=capture, workdir=workdir, env=env)
+        except EngineError as e:
+            error = e.message
+        except (OSError, http.client.HTTPException) as e:
+            error = str(e)
+
+        # Uncaptured output goes to the terminal, as would the CLI's error
+        if not capture:
+            sys.stderr.write('Error: {}\n'.format(error))
+            sys.stderr.flush()
+        return '', error, 1
+
+    def containers(self, name):
+        try:
+            containers = self.client.containers(name=name)
+        except (OSError, http.client.HTTPException, EngineError):
+            return [], 1
+
+        return [container['Names'][0].lstrip('/') for container in containers], 0
+
+    def pull(self, image, output=None, on_event=None):
+        try:
+            return self.client.pull(image, output=output, on_event=on_event)
+        except EngineError as e:
+            return e.message, 1
+        except (OSError, http.client.HTTPException) as e:
+            return str(e), 1
+
+    def image_id(self, image):
+        try:
+            return self.client.inspect_image(image)['Id']
+        except (OSError, http.client.HTTPException, EngineError):
+            return ''
+
+    @staticmethod
+    def _call(func, *args, **kwargs):
+        try:
+            func(*args, **kwargs)
+        except EngineError as e:
+            return e.message, 1
+        except (OSError, http.client.HTTPException) as e:
+            return str(e), 1
+
+        return '', 0
+
+    def run_detached(self, image, name, labels=None, env=None):
+        return self._call(self.client.run_detached, image, name=name, labels=labels, env=env)
+
+    def labeled_containers(self, label, keys):
+        try:
+            containers = self.client.containers(all=True, label=label)
+        except (OSError, http.client.HTTPException, EngineError):
+            return [], 1
+
+        return [
+            {
+                'name': container['Names'][0].lstrip('/'),
+                'labels': {key: (container.get('Labels') or {}).get(key, '') for key in keys},
+            }
+            for container in containers
+        ], 0
+
+    def rename(self, container, name):
+        return self._call(self.client.rename_container, container, name)
+
+    def connect(self, container, network, alias):
+        return self._call(self.client.connect_network, network, container, aliases=[alias])
+
+    def copy(self, container, local, remote):
+        try:
+            with open(local, 'rb') as f:
+                contents = f.read()
+        except OSError as e:
+            return str(e), 1
+
+        return self._call(self.client.put_file, container, remote, contents)
+
+    def remove(self, containers):
+        errors = []
+        for container in containers:
+            output, returncode = self._call(self.client.remove_container, container, force=True)
+            if returncode:
+                errors.append(output)
+
+        return '\n'.join(errors), 1 if errors else 0
+
+
+BACKENDS = {
+    CliBackend.name: CliBackend,
+    EngineBackend.name: EngineBackend,
+}
+
+
+def create_backend(name='auto'):
+    if name == 'auto':
+        socket_path = get_socket_path()
+        if not ON_WINDOWS and socket_path and os.path.exists(socket_path):
+            backend = EngineBackend(EngineClient(socket_path))
+            if backend.client.ping():
+                return backend
+
+        return CliBackend()
+
+    try:
+        return BACKENDS[name]()
+    except KeyError:
+        raise ValueError('Unknown Docker backend `{}`, must be one of: auto, {}'.format(
+            name, ', '.join(sorted(BACKENDS))
+        ))
 
 
+def get_backend():
+    global __backend
+
+    with __backend_lock:
+        if __backend is None:
+            __backend = create_backend(
+                os.environ.get(BACKEND_ENV_VAR) or load_settings().get('docker_backend', 'auto')
+            )
+
+        return __backend
+
+
+def set_backend(backend):
+    """Accepts either a backend name or an instance, e.g. one talking to a fake daemon."""
+    global __backend
+
+    with __backend_lock:
+        __backend = create_backend(backend) if isinstance(backend, str) else backend
+
+
+@traced('compose up', 'docker')
+def check_dir_start(d, build=False, exclude=(), output=None, on_event=None):
+    command = ['docker-compose', 'up', '-d']
+    if build:
+        command.append('--build')
+    for service in exclude:
+        command.extend(['--scale', '{}=0'.format(service)])
+
+    # Not chdir, since environments may be started from several threads
+    return run_command(command, cwd=d, output=output, on_event=on_event)
+
+
+@traced('compose restart', 'docker')
+def check_dir_restart(d, services=(), output=None, on_event=None):
+    return run_command(['docker-compose', 'restart', *services], cwd=d, output=output, on_event=on_event)
+
+
+@traced('compose down', 'docker')
+def check_dir_down(d, output=None, on_event=None):
+    return run_command(['docker-compose', 'down'], cwd=d, output=output, on_event=on_event)
+
+
+@traced('compose stop', 'docker')
+def check_dir_stop(d, output=None, on_event=None):
+    return run_command(['docker-compose', 'stop'], cwd=d, output=output, on_event=on_event)
+
+
+@traced('compose kill', 'docker')
+def check_dir_kill(d, output=None, on_event=None):
+    return run_command(['docker-compose', 'kill'], cwd=d, output=output, on_event=on_event)
+
+
+@traced('compose rm', 'docker')
+def check_dir_remove_containers(d, output=None, on_event=None):
+    return run_command(['docker-compose', 'rm', '-f'], cwd=d, output=output, on_event=on_event)
+
+
+@traced('compose top', 'docker')
 def check_dir_active(d):
-    with chdir(d):
-        process = subprocess.run(['docker-compose', 'top'], stdout=PIPE, stderr=PIPE, shell=NEED_SUBPROCESS_SHELL)
+    process = subprocess.run(['docker-compose', 'top'], cwd=d, stdout=PIPE, stderr=PIPE, shell=NEED_SUBPROCESS_SHELL)
 
     return not not process.stdout.decode().strip() + process.stderr.decode().strip(), process.returncode
 
 
+def run_in_image_or_container(image_or_container, command, running=False):
+    if running:
+        return get_backend().exec(image_or_container, command)
+    else:
+        return get_backend().run(
+            image_or_container, command, env=['DD_API_KEY={ak}'.format(ak=FAKE_API_KEY)]
+        )
+
+
+@traced('exec check', 'docker')
 def run_check(container, check, agent_version_major=None):
     exe_path = get_agent_exe_path(agent_version_major or get_agent_version(container, running=True))
-    process = subprocess.run([
-        'docker', 'exec', container, exe_path, 'check', check
-    ], shell=NEED_SUBPROCESS_SHELL)
+    _, _, returncode = get_backend().exec(container, [exe_path, 'check', check], capture=False)
+
+    return returncode
+
+
+@traced('exec check', 'docker')
+def time_check(container, check, agent_version_major, times=1, pause=0):
+    """Runs a check with its output captured and returns the output, exit
+    code and wall time in seconds. Agent 6 runs it `times` times in a single
+    process, pausing `pause` seconds between runs.
+    """
+    command = [get_agent_exe_path(agent_version_major), 'check', check]
+    if times > 1:
+        command.extend(get_check_times_args(times, pause))
+
+    start = time.perf_counter()
+    stdout, stderr, returncode = get_backend().exec(container, command)
+    elapsed = time.perf_counter() - start
+
+    return stdout + stderr, returncode, elapsed
 
-    return process.returncode
 
+def get_cache_env():
+    return ['PIP_CACHE_DIR={}/pip'.format(CACHE_MOUNT_DIR)]
 
-def test_check(container, check, full=False):
-    command = [
-        'docker', 'exec', '--workdir', get_check_mount_dir(check), container, 'tox', '--alwayscopy'
-    ]
+
+# Keeps clones from writing bytecode and pytest's cache into the source they share
+CLONE_ENV = (
+    'PYTHONDONTWRITEBYTECODE=1', 'PYTEST_ADDOPTS=-p no:cacheprovider',
+    'TOX_TESTENV_PASSENV=PYTHONDONTWRITEBYTECODE PYTEST_ADDOPTS',
+)
+
+
+def get_tox_workdir(cache_key):
+    return '{}/tox/{}'.format(CACHE_MOUNT_DIR, cache_key)
+
+
+@traced('exec tox', 'docker')
+def test_check(container, check, full=False, cache_key=''):
+    """Runs tox in the agent container. With a `cache_key`, tox envs live in the
+    container's cache volume under that key and pip reuses the volume's cache.
+    """
+    command = ['tox', '--alwayscopy']
+    if cache_key:
+        command.extend(['--workdir', get_tox_workdir(cache_key)])
     if not full:
         command.extend(['-e', check])
 
-    process = subprocess.run(command, shell=NEED_SUBPROCESS_SHELL)
+    _, _, returncode = get_backend().exec(
+        container, command, capture=False, workdir=get_check_mount_dir(check),
+        env=get_cache_env() if cache_key else None
+    )
 
-    return process.returncode
+    return returncode
 
 
-def pip_install_mounted_check(container, check):
-    process = subprocess.run([
-        'docker', 'exec', container, 'pip', 'install', '-e', get_check_mount_dir(check)
-    ], shell=NEED_SUBPROCESS_SHELL)
+@traced('exec prune tox workdirs', 'docker')
+def prune_tox_workdirs(container, cache_key):
+    """Removes tox envs built for other dependencies than those of `cache_key`."""
+    _, _, returncode = get_backend().exec(container, [
+        'find', '{}/tox'.format(CACHE_MOUNT_DIR), '-mindepth', '1', '-maxdepth', '1',
+        '!', '-name', cache_key, '-exec', 'rm', '-rf', '{}', '+'
+    ])
 
-    return process.returncode
+    return returncode
 
 
-def pip_install_dev_deps(container):
-    process = subprocess.run([
-        'docker', 'exec', container, 'pip', 'install', 'pytest', 'tox'
-    ], shell=NEED_SUBPROCESS_SHELL)
+@traced('exec tox -l', 'docker')
+def list_tox_envs(container, check):
+    stdout, stderr, returncode = get_backend().exec(
+        container, ['tox', '-l'], workdir=get_check_mount_dir(check)
+    )
+    if returncode:
+        return stdout + stderr, returncode
 
-    return process.returncode
+    return stdout.split(), 0
 
 
-def get_agent_version(image_or_container, running=False):
-    if running:
-        try:
-            version = subprocess.run([
-                'docker', 'exec', image_or_container, 'head', '--lines=1', '/opt/datadog-agent/version-manifest.txt'
-            ], stdout=PIPE, stderr=PIPE, shell=NEED_SUBPROCESS_SHELL).stdout.decode().strip().split()[-1][0]
-        except IndexError:
-            version = ''
-
-        if not version.isdigit():
-            if dir_exists('{}/disk'.format(A6_CONF_DIR), image_or_container, running=running):
-                version = '6'
-            else:
-                version = '5'
+@traced('commit', 'docker')
+def commit_container(container, tag):
+    process = subprocess.run(
+        ['docker', 'commit', container, tag], stdout=PIPE, stderr=PIPE, shell=NEED_SUBPROCESS_SHELL
+    )
+
+    return process.stdout.decode() + process.stderr.decode(), process.returncode
+
+
+@traced('remove image', 'docker')
+def remove_image(image):
+    process = subprocess.run(['docker', 'rmi', image], stdout=PIPE, stderr=PIPE, shell=NEED_SUBPROCESS_SHELL)
+
+    return process.stdout.decode() + process.stderr.decode(), process.returncode
+
+
+@traced('run tox', 'docker')
+def test_check_in_clone(image, container, check, envs, name='', network='', cache_key='', output=None,
+                        on_event=None):
+    """Runs tox envs in an ephemeral container from `image` that has the same
+    mounts as `container`. Tox's own working directory is distinct per set of
+    envs, as concurrent clones would otherwise build packages in the same place,
+    and clones of concurrent runs take turns with a working directory they share.
+    """
+    command = ['docker', 'run', '--rm', '--volumes-from', container, '--workdir', get_check_mount_dir(check)]
+    if name:
+        command.extend(['--name', name])
+    if network:
+        command.extend(['--network', network])
+    for evar in CLONE_ENV:
+        command.extend(['-e', evar])
+
+    envs = ','.join(envs)
+    if cache_key:
+        for evar in get_cache_env():
+            command.extend(['-e', evar])
+        workdir = '{}/{}'.format(get_tox_workdir(cache_key), envs)
+        command.extend([
+            '--entrypoint', 'sh', image, '-c', 'mkdir -p "$0" && exec flock "$0/.lock" tox "$@"', workdir
+        ])
     else:
-        try:
-            version = subprocess.run([
-                'docker', 'run', '-e', 'DD_API_KEY={ak}'.format(ak=FAKE_API_KEY), image_or_container,
-                'head', '--lines=1', '/opt/datadog-agent/version-manifest.txt'
-            ], stdout=PIPE, stderr=PIPE, shell=NEED_SUBPROCESS_SHELL).stdout.decode().strip().split()[-1][0]
-        except IndexError:
-            version = ''
-
-        if not version.isdigit():
-            if dir_exists('{}/disk'.format(A6_CONF_DIR), image_or_container, running=running):
-                version = '6'
-            else:
-                version = '5'
+        workdir = '/tmp/.tox'
+        command.extend(['--entrypoint', 'tox', image])
+    command.extend(['--alwayscopy', '--workdir', workdir, '-e', envs])
+
+    return run_command(command, output=output, on_event=on_event)
+
+
+@traced('pip install check', 'docker')
+def pip_install_mounted_check(container, check, cached=False, no_deps=False):
+    command = ['pip', 'install', '-e', get_check_mount_dir(check)]
+    if no_deps:
+        command.append('--no-deps')
+
+    _, _, returncode = get_backend().exec(
+        container, command, capture=False,
+        env=get_cache_env() if cached else None
+    )
+
+    return returncode
+
+
+@traced('pip install dev deps', 'docker')
+def pip_install_dev_deps(container, cached=False):
+    _, _, returncode = get_backend().exec(
+        container, ['pip', 'install', 'pytest', 'tox'], capture=False, env=get_cache_env() if cached else None
+    )
+
+    return returncode
+
+
+@traced('version detection', 'docker')
+def get_agent_version(image_or_container, running=False):
+    digest = '' if running else get_image_digest(image_or_container)
+    if digest:
+        version = get_cached_agent_version(digest)
+        if version:
+            return version
+
+    stdout, _, _ = run_in_image_or_container(
+        image_or_container, ['head', '--lines=1', '/opt/datadog-agent/version-manifest.txt'], running=running
+    )
+
+    try:
+        version = stdout.strip().split()[-1][0]
+    except IndexError:
+        version = ''
+
+    # Only cache results that came from a successful probe
+    detected = version.isdigit()
+    if not detected:
+        exists, returncode = dir_exists('{}/disk'.format(A6_CONF_DIR), image_or_container, running=running)
+        detected = not returncode
+        version = '6' if exists else '5'
+
+    if digest and detected:
+        update_image_cache(digest, image=image_or_container, agent_version=version)
 
     return version
 
 
+@traced('exec dir exists', 'docker')
 def dir_exists(d, image_or_container, running=False):
-    if running:
-        process = subprocess.run([
-            'docker', 'exec', image_or_container, 'python', '-c',
-            "import os;print(os.path.isdir('{d}'))".format(d=d)
-        ], stdout=PIPE, stderr=PIPE, shell=NEED_SUBPROCESS_SHELL)
-    else:
-        process = subprocess.run([
-            'docker', 'run', '-e', 'DD_API_KEY={ak}'.format(ak=FAKE_API_KEY), image_or_container,
-            'python', '-c', "import os;print(os.path.isdir('{d}'))".format(d=d)
-        ], stdout=PIPE, stderr=PIPE, shell=NEED_SUBPROCESS_SHELL)
+    stdout, _, returncode = run_in_image_or_container(
+        image_or_container, ['python', '-c', "import os;print(os.path.isdir('{d}'))".format(d=d)], running=running
+    )
 
-    return process.stdout.decode().strip() == 'True', process.returncode
+    return stdout.strip() == 'True', returncode
 
 
+@traced('conf read', 'docker')
 def read_file(path, image):
-    process = subprocess.run([
-        'docker', 'run', '-e', 'DD_API_KEY={ak}'.format(ak=FAKE_API_KEY), image, 'python', '-c',
-        "import sys;sys.stdout.write(open('{path}', 'r').read())".format(path=path)
-    ], stdout=PIPE, stderr=PIPE, shell=NEED_SUBPROCESS_SHELL)
+    stdout, _, returncode = run_in_image_or_container(
+        image, ['python', '-c', "import sys;sys.stdout.write(open('{path}', 'r').read())".format(path=path)]
+    )
 
-    return process.stdout.decode(), process.returncode
+    return stdout, returncode
 
 
+@traced('conf read', 'docker')
 def read_matching_glob(glob, image):
-    process = subprocess.run([
-        'docker', 'run', '-e', 'DD_API_KEY={ak}'.format(ak=FAKE_API_KEY), image, 'python', '-c',
+    stdout, _, returncode = run_in_image_or_container(image, [
+        'python', '-c',
         "import glob,sys;sys.stdout.write(open(glob.glob('{glob}')[0], 'r').read())".format(glob=glob)
-    ], stdout=PIPE, stderr=PIPE, shell=NEED_SUBPROCESS_SHELL)
+    ])
 
-    return process.stdout.decode(), process.returncode
+    return stdout, returncode
 
 
 def read_check_example_conf(check, image, agent_version_major=None):
+    digest = get_image_digest(image)
+    if digest:
+        contents = get_cached_example_conf(digest, check)
+        if contents is not None:
+            return contents, 0
+
     agent_version_major = agent_version_major or get_agent_version(image)
-    glob = get_conf_example_glob(check, agent_version_major)
-    process = subprocess.run([
-        'docker', 'run', '-e', 'DD_API_KEY={ak}'.format(ak=FAKE_API_KEY), image, 'python', '-c',
-        "import glob,sys;sys.stdout.write(open(glob.glob('{glob}')[0], 'r').read())".format(glob=glob)
-    ], stdout=PIPE, stderr=PIPE, shell=NEED_SUBPROCESS_SHELL)
+    contents, returncode = read_matching_glob(get_conf_example_glob(check, agent_version_major), image)
+
+    if digest and not returncode:
+        update_image_cache(digest, image=image, example_confs={check: contents})
+
+    return contents, returncode
+
+
+@traced('version detection', 'docker')
+def introspect_image(image, checks=(), dirs=(), digest=None):
+    """Gathers everything `start` needs to know about an image using at most one container.
+
+    Returns a dict with the agent's major version, the example conf of each
+    requested check (None if missing) and whether each requested directory exists.
+    The image's digest is inspected unless given.
+    """
+    digest = get_image_digest(image) if digest is None else digest
+    cache = load_image_cache(digest) if digest else {}
+    cached_confs = cache.get('example_confs', {})
+
+    if cache.get('agent_version') and not dirs and all(check in cached_confs for check in checks):
+        return {
+            'agent_version': cache['agent_version'],
+            'example_confs': {check: cached_confs[check] for check in checks},
+            'dirs': {},
+        }, 0
+
+    version_probe = '{}/disk'.format(A6_CONF_DIR)
+    globs = {
+        check: {version: get_conf_example_glob(check, version) for version in ('5', '6')}
+        for check in checks
+    }
+    stdout, stderr, returncode = run_in_image_or_container(image, [
+        'python', '-c', INTROSPECTION_SCRIPT, json.dumps(globs), json.dumps([version_probe, *dirs])
+    ])
+
+    try:
+        result = json.loads(stdout)
+    except ValueError:
+        return {'error': stderr or stdout}, returncode or 1
+
+    has_a6_conf_dir = result['dirs'].pop(version_probe, False)
+    try:
+        agent_version = result['manifest'].split()[-1][0]
+    except IndexError:
+        agent_version = ''
+
+    if not agent_version.isdigit():
+        agent_version = '6' if has_a6_conf_dir else '5'
+
+    example_confs = {
+        check: result['confs'][check]['6' if int(agent_version) >= 6 else '5']
+        for check in checks
+    }
+
+    if digest:
+        update_image_cache(digest, image=image, agent_version=agent_version, example_confs={
+            check: contents for check, contents in example_confs.items() if contents is not None
+        })
+
+    return {
+        'agent_version': agent_version,
+        'example_confs': example_confs,
+        'dirs': result['dirs'],
+    }, 0
+
+
+@traced('ps', 'docker')
+def container_running(container):
+    names, returncode = get_backend().containers(container)
 
-    return process.stdout.decode(), process.returncode
+    # The daemon's name filter also matches substrings
+    return container in names, returncode
 
 
-def container_running(container):
+@traced('ps', 'docker')
+def running_containers(prefix=''):
+    names, returncode = get_backend().containers(prefix)
+
+    return set(name for name in names if name.startswith(prefix)), returncode
+
+
+@traced('image inspect', 'docker')
+def get_image_digest(image):
+    return get_backend().image_id(image)
+
+
+@traced('pull', 'docker')
+def update_image(image, output=None, on_event=None, digest=None):
+    """Pulls an image, whose current digest is inspected unless given, and
+    returns the output, exit code and the digest of the image afterwards.
+    """
+    old_digest = get_image_digest(image) if digest is None else digest
+    output, returncode = get_backend().pull(image, output=output, on_event=on_event)
+
+    if returncode:
+        return output, returncode, old_digest
+
+    new_digest = get_image_digest(image)
+    record_pull(image, new_digest)
+
+    if old_digest and new_digest != old_digest:
+        remove_image_cache(old_digest)
+
+    return output, returncode, new_digest
+
+
+@traced('build', 'docker')
+def build_image(tag, d, output=None, on_event=None):
+    return run_command(['docker', 'build', '-t', tag, d], output=output, on_event=on_event)
+
+
+def ensure_built(build, output=None, on_event=None):
+    """Builds a `di.structures.Build` unless an image with its content-addressed tag
+    already exists. Returns the output, exit code and whether a build happened.
+    """
+    if get_image_digest(build.tag):
+        return '', 0, False
+
+    with TemporaryDirectory() as d:
+        build.write_context(d)
+        output, returncode = build_image(build.tag, d, output=output, on_event=on_event)
+
+    return output, returncode, True
+
+
+def image_is_fresh(image, policy='ttl', ttl=0, digest=None):
+    """Decides whether a pull can be skipped:
+
+    - always: never
+    - missing: when the image exists locally
+    - ttl: when the local image is the one we last pulled less than `ttl` seconds ago
+    """
+    if policy == 'always':
+        return False
+
+    digest = get_image_digest(image) if digest is None else digest
+    if not digest:
+        return False
+    elif policy == 'missing':
+        return True
+
+    record = get_pull_record(image)
+    return record.get('digest') == digest and time.time() - record.get('time', 0) < ttl
+
+
+def get_compose_network(d, network='default'):
+    # Compose names networks after the project, which defaults to the normalized directory name
+    project = re.sub(r'[^-_a-z0-9]', '', os.path.basename(os.path.normpath(d)).lower())
+    return '{}_{}'.format(project, network)
+
+
+def get_api_key_hash(api_key):
+    return hashlib.sha256(os.path.expandvars(api_key).encode('utf-8')).hexdigest()[:12]
+
+
+@traced('pool create', 'docker')
+def create_pool_container(image, api_key, digest=None):
+    name = '{}{}'.format(POOL_NAME_PREFIX, os.urandom(6).hex())
+    output, returncode = get_backend().run_detached(image, name, labels=OrderedDict([
+        (POOL_LABEL, image),
+        ('{}.created'.format(POOL_LABEL), str(int(time.time()))),
+        ('{}.digest'.format(POOL_LABEL), get_image_digest(image) if digest is None else digest),
+        ('{}.key'.format(POOL_LABEL), get_api_key_hash(api_key)),
+    ]), env=['DD_API_KEY={}'.format(os.path.expandvars(api_key))])
+
+    return name, output, returncode
+
+
+@traced('pool ls', 'docker')
+def list_pool_containers():
+    """Returns idle pool containers, oldest first. Claimed ones are renamed and thus excluded."""
+    labeled, returncode = get_backend().labeled_containers(
+        POOL_LABEL, ['{}{}'.format(POOL_LABEL, suffix) for suffix in ('', '.created', '.digest', '.key')]
+    )
+
+    containers = []
+    for container in labeled:
+        if container['name'].startswith(POOL_NAME_PREFIX):
+            labels = container['labels']
+            containers.append({
+                'name': container['name'],
+                'image': labels[POOL_LABEL],
+                'created': int(labels['{}.created'.format(POOL_LABEL)] or 0),
+                'digest': labels['{}.digest'.format(POOL_LABEL)],
+                'key': labels['{}.key'.format(POOL_LABEL)],
+            })
+
+    return sorted(containers, key=lambda c: c['created']), returncode
+
+
+@traced('pool claim', 'docker')
+def claim_pool_container(image, api_key, container_name, digest=None):
+    """Renames an idle pool container of `image` to `container_name`; renames are
+    atomic so concurrent claims never get the same container.
+    """
+    containers, _ = list_pool_containers()
+    key_hash = get_api_key_hash(api_key)
+    digest = get_image_digest(image) if digest is None else digest
+
+    for container in containers:
+        if container['image'] != image or container['key'] != key_hash or container['digest'] != digest:
+            continue
+
+        _, returncode = get_backend().rename(container['name'], container_name)
+        if not returncode:
+            return container['name']
+
+    return ''
+
+
+@traced('network connect', 'docker')
+def connect_container(container, network, alias):
+    return get_backend().connect(container, network, alias)
+
+
+@traced('copy', 'docker')
+def copy_to_container(container, files):
+    for local, remote in files:
+        output, returncode = get_backend().copy(container, local, remote)
+        if returncode:
+            return output, returncode
+
+    return '', 0
+
+
+@traced('remove containers', 'docker')
+def remove_containers(containers):
+    if not containers:
+        return '', 0
+
+    return get_backend().remove(containers)
+
+
+@traced('volume create', 'docker')
+def create_cache_volume(volume, label):
+    """Creates the cache volume of the environment `label` unless it already exists."""
     process = subprocess.run([
-        'docker', 'ps', '-f', 'name={container}'.format(container=container)
+        'docker', 'volume', 'create', '--label', '{}={}'.format(CACHE_LABEL, label), volume
     ], stdout=PIPE, stderr=PIPE, shell=NEED_SUBPROCESS_SHELL)
 
-    return len(process.stdout.decode().strip().splitlines()) > 1, process.returncode
+    return process.stdout.decode() + process.stderr.decode(), process.returncode
 
 
-def update_image(image):
+@traced('volume ls', 'docker')
+def list_cache_volumes():
+    """Returns cache volumes along with the label of the environment each was created for."""
     process = subprocess.run([
-        'docker', 'pull', image
+        'docker', 'volume', 'ls', '--filter', 'label={}'.format(CACHE_LABEL), '--format',
+        '{{{{.Name}}}}\t{{{{.Label "{}"}}}}'.format(CACHE_LABEL)
     ], stdout=PIPE, stderr=PIPE, shell=NEED_SUBPROCESS_SHELL)
 
-    return process.stdout.decode(), process.returncode
+    volumes = []
+    for line in process.stdout.decode().splitlines():
+        name, _, label = line.partition('\t')
+        if name.startswith(CACHE_VOLUME_PREFIX):
+            volumes.append({'name': name, 'label': label})
+
+    return volumes, process.returncode
+
+
+@traced('remove volumes', 'docker')
+def remove_volumes(volumes):
+    if not volumes:
+        return '', 0
+
+    process = subprocess.run(
+        ['docker', 'volume', 'rm', *volumes], stdout=PIPE, stderr=PIPE, shell=NEED_SUBPROCESS_SHELL
+    )
+
+    return process.stdout.decode() + process.stderr.decode(), process.returncode
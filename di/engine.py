@@ -0,0 +1,442 @@
+import base64
+import http.client
+import json
+import os
+import socket
+import struct
+import subprocess
+import sys
+import tarfile
+import threading
+from collections import deque
+from io import BytesIO
+from urllib.parse import quote, urlencode
+
+API_VERSION = '1.25'
+DEFAULT_SOCKET_PATH = '/var/run/docker.sock'
+
+# Frame header of multiplexed stdout/stderr streams: stream type, 3 padding bytes, big-endian size
+STREAM_HEADER = struct.Struct('>BxxxL')
+STDOUT = 1
+STDERR = 2
+
+# Images without a registry come from Docker Hub, whose credentials are stored under this key
+DEFAULT_REGISTRY = 'https://index.docker.io/v1/'
+
+# `WorkingDir` of exec instances requires API 1.35, so commands change directory themselves
+WORKDIR_SCRIPT = 'cd "$1" && shift && exec "$@"'
+
+
+class EngineError(Exception):
+    def __init__(self, status, message):
+        super().__init__('{} {}'.format(status, message))
+        self.status = status
+        self.message = message
+
+
+def get_socket_path():
+    host = os.environ.get('DOCKER_HOST', '')
+    if not host:
+        return DEFAULT_SOCKET_PATH
+    elif host.startswith('unix://'):
+        return host[len('unix://'):]
+
+    # TCP/SSH/named pipe daemons are left to the CLI
+    return ''
+
+
+def split_image(image):
+    if '@' in image:
+        repo, digest = image.split('@', 1)
+        return repo, digest
+
+    repo, sep, tag = image.rpartition(':')
+    # A colon followed by a slash belongs to a registry port, e.g. `localhost:5000/agent`
+    if not sep or '/' in tag:
+        return image, 'latest'
+
+    return repo, tag
+
+
+def get_registry(image):
+    first, sep, _ = image.partition('/')
+    # Like the CLI, only a first component that looks like a host is a registry
+    if sep and ('.' in first or ':' in first or first == 'localhost'):
+        return first
+
+    return DEFAULT_REGISTRY
+
+
+def get_docker_config_path():
+    config_dir = os.environ.get('DOCKER_CONFIG') or os.path.expanduser(os.path.join('~', '.docker'))
+    return os.path.join(config_dir, 'config.json')
+
+
+def get_registry_auth(image):
+    """Returns the `X-Registry-Auth` header value for pulling `image` with the
+    credentials stored by `docker login`, or an empty string if there are none.
+    """
+    try:
+        with open(get_docker_config_path(), 'r') as f:
+            config = json.loads(f.read())
+    except (FileNotFoundError, NotADirectoryError, ValueError):
+        return ''
+
+    registry = get_registry(image)
+    credentials = {}
+
+    helper = config.get('credHelpers', {}).get(registry) or config.get('credsStore')
+    if helper:
+        try:
+            process = subprocess.run(
+                ['docker-credential-{}'.format(helper), 'get'], input=registry.encode('utf-8'),
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE
+            )
+            if not process.returncode:
+                secret = json.loads(process.stdout.decode('utf-8'))
+                credentials = {'username': secret.get('Username', ''), 'password': secret.get('Secret', '')}
+        except (OSError, ValueError):
+            pass
+
+    if not credentials:
+        auth = config.get('auths', {}).get(registry, {}).get('auth')
+        if not auth:
+            return ''
+
+        username, _, password = base64.b64decode(auth).decode('utf-8').partition(':')
+        credentials = {'username': username, 'password': password}
+
+    credentials['serveraddress'] = registry
+    return base64.urlsafe_b64encode(json.dumps(credentials).encode('utf-8')).decode('ascii')
+
+
+def demultiplex(data):
+    stdout = []
+    stderr = []
+    offset = 0
+
+    while offset + STREAM_HEADER.size <= len(data):
+        stream, size = STREAM_HEADER.unpack_from(data, offset)
+        offset += STREAM_HEADER.size
+        chunk = data[offset:offset + size]
+        offset += size
+
+        if stream == STDERR:
+            stderr.append(chunk)
+        else:
+            stdout.append(chunk)
+
+    return b''.join(stdout), b''.join(stderr)
+
+
+def iter_frames(response):
+    while True:
+        header = response.read(STREAM_HEADER.size)
+        if len(header) < STREAM_HEADER.size:
+            break
+
+        stream, size = STREAM_HEADER.unpack(header)
+        yield stream, response.read(size)
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+class EngineClient:
+    """Minimal Docker Engine API client that keeps connections to the daemon alive
+    and reuses them across requests instead of spawning a `docker` process each time.
+    """
+    def __init__(self, socket_path=None, pool_size=4, timeout=None):
+        self.socket_path = socket_path or get_socket_path()
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._pool = deque()
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        with self._lock:
+            if self._pool:
+                return self._pool.pop(), True
+
+        return UnixHTTPConnection(self.socket_path, timeout=self.timeout), False
+
+    def _release(self, conn):
+        with self._lock:
+            if len(self._pool) < self.pool_size:
+                self._pool.append(conn)
+                return
+
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            while self._pool:
+                self._pool.pop().close()
+
+    def _send(self, method, path, params=None, body=None, headers=None):
+        url = '/v{}{}'.format(API_VERSION, path)
+        if params:
+            url = '{}?{}'.format(url, urlencode(params))
+
+        headers = dict(headers or {})
+        data = None
+        if isinstance(body, bytes):
+            data = body
+            headers['Content-Type'] = 'application/x-tar'
+        elif body is not None:
+            data = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+
+        conn, reused = self._acquire()
+        try:
+            conn.request(method, url, body=data, headers=headers)
+            return conn, conn.getresponse()
+        except (OSError, http.client.HTTPException):
+            conn.close()
+
+            # The daemon may have closed an idle keep-alive connection
+            if not reused:
+                raise
+
+        conn = UnixHTTPConnection(self.socket_path, timeout=self.timeout)
+        try:
+            conn.request(method, url, body=data, headers=headers)
+            return conn, conn.getresponse()
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            raise
+
+    def request(self, method, path, params=None, body=None):
+        conn, response = self._send(method, path, params=params, body=body)
+        try:
+            payload = response.read()
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            raise
+
+        if response.will_close:
+            conn.close()
+        else:
+            self._release(conn)
+
+        if response.status >= 400:
+            try:
+                message = json.loads(payload.decode('utf-8')).get('message', '')
+            except ValueError:
+                message = payload.decode('utf-8', 'replace')
+            raise EngineError(response.status, message)
+
+        return response.status, payload
+
+    def request_json(self, method, path, params=None, body=None):
+        _, payload = self.request(method, path, params=params, body=body)
+        return json.loads(payload.decode('utf-8')) if payload else None
+
+    def stream(self, method, path, params=None, body=None, headers=None):
+        """Returns a raw response that owns its connection; the connection is never pooled."""
+        conn, response = self._send(method, path, params=params, body=body, headers=headers)
+        if response.status >= 400:
+            payload = response.read()
+            conn.close()
+            try:
+                message = json.loads(payload.decode('utf-8')).get('message', '')
+            except ValueError:
+                message = payload.decode('utf-8', 'replace')
+            raise EngineError(response.status, message)
+
+        return conn, response
+
+    def ping(self):
+        try:
+            status, _ = self.request('GET', '/_ping')
+        except (OSError, http.client.HTTPException, EngineError):
+            return False
+        return status == 200
+
+    def containers(self, name=None, all=False, label=None):
+        filters = {}
+        if name:
+            filters['name'] = [name]
+        if label:
+            filters['label'] = [label]
+
+        params = {'all': int(all)}
+        if filters:
+            params['filters'] = json.dumps(filters)
+
+        return self.request_json('GET', '/containers/json', params=params)
+
+    def inspect_image(self, image):
+        return self.request_json('GET', '/images/{}/json'.format(quote(image, safe='')))
+
+    def pull(self, image, output=None, on_event=None, tail_lines=200):
+        repo, tag = split_image(image)
+        params = {'fromImage': repo}
+        if tag.startswith('sha256:'):
+            params['fromImage'] = '{}@{}'.format(repo, tag)
+        else:
+            params['tag'] = tag
+
+        if on_event is not None:
+            on_event(('start', ['pull', image]))
+
+        auth = get_registry_auth(image)
+        conn, response = self.stream(
+            'POST', '/images/create', params=params, headers={'X-Registry-Auth': auth} if auth else None
+        )
+        lines = deque(maxlen=tail_lines)
+        error = ''
+        try:
+            for line in response:
+                line = line.strip()
+                if not line:
+                    continue
+
+                try:
+                    message = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    continue
+
+                if 'error' in message:
+                    error = line = message['error']
+                # Skip the per-layer progress bars
+                elif message.get('status') and not message.get('progressDetail'):
+                    line = message['status']
+                    if message.get('id'):
+                        line = '{}: {}'.format(message['id'], line)
+                else:
+                    continue
+
+                lines.append(line)
+                if output is not None:
+                    output(line)
+                if on_event is not None:
+                    on_event(('line', line))
+        finally:
+            conn.close()
+
+        returncode = 1 if error else 0
+        if on_event is not None:
+            on_event(('exit', returncode))
+
+        return '\n'.join(lines), returncode
+
+    def create_container(self, config, name=None):
+        params = {'name': name} if name else None
+        try:
+            return self.request_json('POST', '/containers/create', params=params, body=config)['Id']
+        except EngineError as e:
+            if e.status != 404:
+                raise
+
+            # Like `docker run`, pulls images that are missing
+            output, returncode = self.pull(config['Image'])
+            if returncode:
+                raise EngineError(404, output.splitlines()[-1] if output else e.message)
+            return self.request_json('POST', '/containers/create', params=params, body=config)['Id']
+
+    def run_detached(self, image, name=None, labels=None, env=None):
+        """Creates and starts a container in the background, like `docker run -d`."""
+        container_id = self.create_container({'Image': image, 'Labels': labels or {}, 'Env': env or []}, name=name)
+        self.request('POST', '/containers/{}/start'.format(container_id))
+        return container_id
+
+    def rename_container(self, container, name):
+        self.request('POST', '/containers/{}/rename'.format(quote(container, safe='')), params={'name': name})
+
+    def remove_container(self, container, force=False):
+        self.request('DELETE', '/containers/{}'.format(quote(container, safe='')), params={'force': int(force)})
+
+    def connect_network(self, network, container, aliases=()):
+        self.request('POST', '/networks/{}/connect'.format(quote(network, safe='')), body={
+            'Container': container,
+            'EndpointConfig': {'Aliases': list(aliases)},
+        })
+
+    def put_file(self, container, path, contents):
+        """Writes a file into a container, like `docker cp`, as a single-file archive."""
+        archive = BytesIO()
+        with tarfile.open(fileobj=archive, mode='w') as tar:
+            info = tarfile.TarInfo(os.path.basename(path))
+            info.size = len(contents)
+            tar.addfile(info, BytesIO(contents))
+
+        self.request(
+            'PUT', '/containers/{}/archive'.format(quote(container, safe='')),
+            params={'path': os.path.dirname(path) or '/'}, body=archive.getvalue()
+        )
+
+    def run(self, image, command, env=None):
+        container_id = self.create_container({
+            'Image': image,
+            'Cmd': command,
+            'Env': env or [],
+            'Tty': False,
+            'AttachStdout': True,
+            'AttachStderr': True,
+        })
+
+        try:
+            self.request('POST', '/containers/{}/start'.format(container_id))
+            result = self.request_json('POST', '/containers/{}/wait'.format(container_id))
+            _, logs = self.request(
+                'GET', '/containers/{}/logs'.format(container_id), params={'stdout': 1, 'stderr': 1}
+            )
+        finally:
+            try:
+                self.request('DELETE', '/containers/{}'.format(container_id), params={'force': 1, 'v': 1})
+            except (OSError, http.client.HTTPException, EngineError):  # no cov
+                pass
+
+        stdout, stderr = demultiplex(logs)
+        return stdout.decode('utf-8', 'replace'), stderr.decode('utf-8', 'replace'), result.get('StatusCode', 1)
+
+    def exec(self, container, command, capture=True, workdir=None, env=None):
+        if workdir:
+            command = ['sh', '-c', WORKDIR_SCRIPT, 'sh', workdir] + list(command)
+
+        config = {
+            'Cmd': command,
+            'AttachStdout': True,
+            'AttachStderr': True,
+            'Tty': False,
+        }
+        if env:
+            config['Env'] = env
+
+        exec_id = self.request_json(
+            'POST', '/containers/{}/exec'.format(quote(container, safe='')), body=config
+        )['Id']
+
+        stdout = []
+        stderr = []
+        conn, response = self.stream(
+            'POST', '/exec/{}/start'.format(exec_id), body={'Detach': False, 'Tty': False}
+        )
+        try:
+            for stream, chunk in iter_frames(response):
+                if capture:
+                    (stderr if stream == STDERR else stdout).append(chunk)
+                else:
+                    out = sys.stderr if stream == STDERR else sys.stdout
+                    out.write(chunk.decode('utf-8', 'replace'))
+                    out.flush()
+        finally:
+            conn.close()
+
+        exit_code = self.request_json('GET', '/exec/{}/json'.format(exec_id)).get('ExitCode')
+        return (
+            b''.join(stdout).decode('utf-8', 'replace'),
+            b''.join(stderr).decode('utf-8', 'replace'),
+            1 if exit_code is None else exit_code
+        )
@@ -0,0 +1,63 @@
+import hashlib
+import json
+from collections import OrderedDict
+
+import toml
+
+from di.checks import Checks
+from di.utils import DEFAULT_NAME
+
+ENVIRONMENT_KEYS = {'check', 'flavor', 'instance', 'image', 'agent', 'options'}
+
+
+def load_manifest(path):
+    """Reads a TOML manifest of environments, e.g.:
+
+    location = "~/envs"
+    workers = 4
+
+    [[environments]]
+    check = "nginx"
+    instance = "latest"
+
+    [[environments]]
+    check = "nginx"
+    instance = "old"
+    image = "datadog/agent-dev:master"
+    options = { version = "1.12" }
+    """
+    with open(path, 'r') as f:
+        manifest = toml.loads(f.read(), OrderedDict)
+
+    environments = OrderedDict()
+    for i, environment in enumerate(manifest.get('environments', []), 1):
+        unknown = set(environment) - ENVIRONMENT_KEYS
+        if unknown:
+            raise ValueError('Environment #{} has unknown keys: {}'.format(i, ', '.join(sorted(unknown))))
+
+        check_name = environment.get('check', '')
+        flavor = environment.get('flavor', DEFAULT_NAME)
+        if check_name not in Checks:
+            raise ValueError('Environment #{}: check `{}` is not yet supported.'.format(i, check_name))
+        elif flavor not in Checks[check_name]:
+            raise ValueError('Environment #{}: flavor `{}` is not yet supported.'.format(i, flavor))
+
+        key = (check_name, Checks[check_name][flavor].flavor, str(environment.get('instance', DEFAULT_NAME)))
+        if key in environments:
+            raise ValueError('Environment #{} is a duplicate of `{}`.'.format(i, ':'.join(key)))
+
+        environments[key] = OrderedDict([
+            ('image', environment.get('image', '')),
+            ('agent', environment.get('agent')),
+            ('options', OrderedDict(
+                (option, str(value)) for option, value in environment.get('options', {}).items()
+            )),
+        ])
+
+    manifest['environments'] = environments
+    return manifest
+
+
+def get_spec_hash(environment, spec):
+    data = json.dumps([environment, spec], sort_keys=True)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
@@ -0,0 +1,65 @@
+import json
+import os
+
+from atomicwrites import atomic_write
+
+from di.utils import ensure_dir_exists
+
+METADATA_FILE = '.di.json'
+COMPOSE_FILE = 'docker-compose.yaml'
+
+
+def get_metadata_path(location):
+    return os.path.join(location, METADATA_FILE)
+
+
+def read_env_metadata(location):
+    try:
+        with open(get_metadata_path(location), 'r') as f:
+            return json.loads(f.read())
+    except (FileNotFoundError, NotADirectoryError, ValueError):
+        return {}
+
+
+def write_env_metadata(location, metadata):
+    ensure_dir_exists(location)
+    with atomic_write(get_metadata_path(location), overwrite=True) as f:
+        f.write(json.dumps(metadata, indent=2, sort_keys=True))
+
+
+def update_env_metadata(location, **fields):
+    metadata = read_env_metadata(location)
+    metadata.update(fields)
+    write_env_metadata(location, metadata)
+    return metadata
+
+
+def iter_dirs(d):
+    try:
+        return sorted(entry.name for entry in os.scandir(d) if entry.is_dir())
+    except (FileNotFoundError, NotADirectoryError):
+        return []
+
+
+def index_environments(location):
+    """Returns every environment in the `CHECK/FLAVOR/INSTANCE` layout under
+    `location` with its metadata. Environments started with --direct live
+    elsewhere and are not included.
+    """
+    environments = []
+
+    for check_name in iter_dirs(location):
+        for flavor in iter_dirs(os.path.join(location, check_name)):
+            for instance_name in iter_dirs(os.path.join(location, check_name, flavor)):
+                env_location = os.path.join(location, check_name, flavor, instance_name)
+                metadata = read_env_metadata(env_location)
+                if metadata or os.path.isfile(os.path.join(env_location, COMPOSE_FILE)):
+                    environments.append({
+                        'check': check_name,
+                        'flavor': flavor,
+                        'instance': instance_name,
+                        'location': env_location,
+                        'metadata': metadata,
+                    })
+
+    return environments
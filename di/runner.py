@@ -0,0 +1,38 @@
+import subprocess
+from collections import deque
+from subprocess import PIPE, STDOUT
+
+from di.utils import NEED_SUBPROCESS_SHELL
+
+# Enough context to diagnose a failure without holding e.g. an entire build log in memory
+DEFAULT_TAIL_LINES = 200
+
+
+def run_command(command, cwd=None, output=None, on_event=None, tail_lines=DEFAULT_TAIL_LINES):
+    """Runs a command with stderr merged into stdout, reading its output as it is produced.
+
+    Each line is passed to `output` if given, and only the last `tail_lines` lines
+    are kept for the returned output. `on_event` receives `('start', command)`,
+    `('line', line)` and `('exit', returncode)` tuples to track progress.
+    """
+    if on_event is not None:
+        on_event(('start', command))
+
+    process = subprocess.Popen(command, cwd=cwd, stdout=PIPE, stderr=STDOUT, shell=NEED_SUBPROCESS_SHELL)
+    tail = deque(maxlen=tail_lines)
+
+    with process.stdout:
+        for line in iter(process.stdout.readline, b''):
+            line = line.decode('utf-8', 'replace').rstrip('\r\n')
+            tail.append(line)
+
+            if output is not None:
+                output(line)
+            if on_event is not None:
+                on_event(('line', line))
+
+    returncode = process.wait()
+    if on_event is not None:
+        on_event(('exit', returncode))
+
+    return '\n'.join(tail), returncode
@@ -4,6 +4,7 @@ from collections import OrderedDict
 import toml
 from atomicwrites import atomic_write
 
+from di.trace import traced
 from di.utils import (
     APP_DIR, CHECKS_DIR, DEFAULT_NAME, copy_dict_merge, ensure_parent_dir_exists
 )
@@ -21,6 +22,12 @@ APP_SETTINGS = OrderedDict([
     ('extras', os.path.expanduser(os.path.join('~', 'dd', 'integrations-extras'))),
     ('force', False),
     ('copy_conf', True),
+    ('docker_backend', 'auto'),
+    ('workers', 4),
+    ('pull_ttl', 3600),
+    ('pool_size', 0),
+    ('pool_ttl', 3600),
+    ('dev_image', True),
 ])
 
 CHECK_SETTINGS = OrderedDict([
@@ -64,6 +71,7 @@ def copy_check_defaults(check_name=None):
     return defaults
 
 
+@traced('settings load')
 def load_settings():
     default_settings = copy_default_settings()
 
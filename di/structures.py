@@ -1,22 +1,86 @@
+import hashlib
+import json
 import os
+import threading
+from collections import OrderedDict
 
 from di.agent import get_conf_path
+from di.metadata import read_env_metadata
 from di.settings import copy_check_defaults
+from di.trace import traced
 from di.utils import (
-    CHECKS_BASE_PACKAGE, DEFAULT_NAME, basepath, dict_merge, ensure_parent_dir_exists,
-    get_check_mount_dir, resolve_path
+    CACHE_MOUNT_DIR, CHECKS_BASE_PACKAGE, DEFAULT_NAME, basepath, dict_merge, ensure_parent_dir_exists,
+    find_free_port, get_cache_volume, get_check_mount_dir, resolve_path
 )
 
+__allocated_ports = set()
+__port_lock = threading.Lock()
+
+
+def allocate_port():
+    # The OS may hand out the same free port twice before either is bound, e.g.
+    # when several environments are created at once, so remember what we gave out.
+    with __port_lock:
+        while True:
+            port = find_free_port()
+            if port not in __allocated_ports:
+                __allocated_ports.add(port)
+                return port
+
+
+def reserve_port(port):
+    """Records a port chosen elsewhere as given out and returns whether no
+    other environment of this process had been given it already.
+    """
+    with __port_lock:
+        if port in __allocated_ports:
+            return False
+
+        __allocated_ports.add(port)
+        return True
+
+
+def release_ports(ports):
+    with __port_lock:
+        __allocated_ports.difference_update(ports)
+
+
+def parse_port(option, value):
+    try:
+        port = int(value)
+    except (TypeError, ValueError):
+        port = 0
+
+    if not 0 < port < 65536:
+        raise ValueError('Option `{}` must be a port between 1 and 65535, not `{}`.'.format(option, value))
+
+    return port
+
 
 class File:
-    def __init__(self, file_path, contents, binary=False):
+    def __init__(self, file_path, contents, binary=False, services=()):
         self.file_path = file_path
-        self.contents = contents
+        self.contents = contents if isinstance(contents, (str, bytes)) else list(contents)
         self.write_mode = 'wb' if binary else 'w'
 
+        # Compose services that must be restarted when this file changes
+        self.services = services
+
         # Docker on Windows needs any imported scripts to have unix line endings.
         self.newline = '\n' if self.file_path.endswith('.sh') else None
 
+    def get_contents(self):
+        if isinstance(self.contents, (str, bytes)):
+            return self.contents
+        return (b'' if self.write_mode == 'wb' else '').join(self.contents)
+
+    def is_current(self):
+        try:
+            with open(self.file_path, 'rb' if self.write_mode == 'wb' else 'r') as f:
+                return f.read() == self.get_contents()
+        except (FileNotFoundError, NotADirectoryError, IsADirectoryError, UnicodeDecodeError):
+            return False
+
     def write(self):
         ensure_parent_dir_exists(self.file_path)
 
@@ -27,6 +91,73 @@ class File:
                 f.writelines(self.contents)
 
 
+class Build:
+    """An image built from in-memory inputs and tagged by their hash, so
+    that identical inputs are built once and then reused everywhere.
+    """
+    def __init__(self, name, dockerfile, files=None):
+        self.name = name
+        self.dockerfile = dockerfile
+        self.files = OrderedDict(sorted((files or {}).items()))
+
+        digest = hashlib.sha256()
+        for part in (name, dockerfile, *(item for entry in self.files.items() for item in entry)):
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\0')
+
+        self.digest = digest.hexdigest()
+        self.tag = 'di-{}:{}'.format(name, self.digest[:12])
+
+    def write_context(self, d):
+        File(os.path.join(d, 'Dockerfile'), self.dockerfile).write()
+        for file_name, contents in self.files.items():
+            File(os.path.join(d, file_name), contents).write()
+
+
+# Requirement files whose dependencies are baked into dev images, by preference
+REQUIREMENTS_FILES = ('requirements.txt', 'requirements.in')
+
+DEV_DOCKERFILE = """\
+FROM {image}
+LABEL di.base="{digest}"
+{copy}RUN pip install pytest tox{requirements}{cleanup}
+"""
+
+
+def find_requirements_file(d):
+    for file_name in REQUIREMENTS_FILES:
+        path = os.path.join(d, file_name)
+        if os.path.isfile(path):
+            return path
+
+    return ''
+
+
+def get_dev_build(image, digest, check_dirs):
+    """Returns the `Build` of an agent image with the dev dependencies and the
+    requirements of the check and base package in `check_dirs` installed, so
+    that dev environments only need to link the mounted check at start.
+    """
+    files = {}
+    for package, d in zip(('check', 'base'), check_dirs):
+        path = find_requirements_file(d)
+        if path:
+            with open(path, 'r') as f:
+                files['requirements/{}-{}'.format(package, os.path.basename(path))] = f.read()
+
+    dockerfile = DEV_DOCKERFILE.format(
+        image=image,
+        digest=digest,
+        copy='COPY requirements /tmp/di-requirements\n' if files else '',
+        requirements=''.join(
+            ' -r /tmp/di-requirements/{}'.format(file_name[len('requirements/'):]) for file_name in sorted(files)
+        ),
+        cleanup=' && rm -rf /tmp/di-requirements' if files else ''
+    )
+
+    return Build('agent-dev', dockerfile, files)
+
+
 class Check:
     name = 'check'
     flavor = DEFAULT_NAME
@@ -49,9 +180,13 @@ class Check:
         self.base_dir_local = base_dir
         self.base_dir_mount = get_check_mount_dir(CHECKS_BASE_PACKAGE)
 
-        self.options = dict_merge(copy_check_defaults(self.name), options)
+        self.options = self.get_options(options)
         self.files = {}
 
+    @classmethod
+    def get_options(cls, options):
+        return dict_merge(copy_check_defaults(cls.name), options)
+
     @classmethod
     def get_location(cls, d, instance_name=None, no_instance=False, direct=False):
         d = resolve_path(d)
@@ -71,14 +206,40 @@ class Check:
             path = './{}'.format(basepath(path))
         return path
 
+    @traced('file write')
     def write(self):
+        """Writes files whose contents changed and returns them, leaving
+        the others untouched so their modification times are preserved.
+        """
+        written = []
         for f in self.files.values():
-            f.write()
+            if not f.is_current():
+                f.write()
+                written.append(f)
+
+        return written
+
+    def get_fingerprint(self, *extra):
+        digest = hashlib.sha256()
+        for file_path, f in sorted(self.files.items()):
+            contents = f.get_contents()
+            digest.update(file_path.encode('utf-8'))
+            digest.update(contents if isinstance(contents, bytes) else contents.encode('utf-8'))
+
+        digest.update(json.dumps([sorted(self.options.items()), extra], default=str).encode('utf-8'))
+        return digest.hexdigest()
 
 
 class DockerCheck(Check):
+    # Whether the compose file has services with a `build` section
     requires_build = False
 
+    # Option name -> container port, for ports published on the host
+    host_ports = OrderedDict()
+
+    # The compose network the agent service is on, used to attach warm pool containers
+    agent_network = 'default'
+
     def __init__(self, d, api_key, conf_path, agent_version, check_dirs=None,
                  instance_name=None, no_instance=False, direct=False, **options):
         self.image = options.pop('image', '')
@@ -89,6 +250,10 @@ class DockerCheck(Check):
         )
 
         self.api_key = '- DD_API_KEY={api_key}'.format(api_key=api_key)
+        self.ports = self.get_host_ports()
+
+        # Compose file option -> Build, the option being replaced by the build's tag
+        self.builds = self.get_builds(self.options)
         self.container_name = self.get_container_name(instance_name, self.location, direct)
         self.compose_path = self.locate_file('docker-compose.yaml')
         self.conf_mount = '- {conf_path_local}:{conf_path_mount}'.format(
@@ -108,6 +273,18 @@ class DockerCheck(Check):
             )
         )
 
+        # Dev environments keep tox envs and the pip cache in a volume that outlives them
+        self.cache_volume = get_cache_volume(self.container_name) if self.check_dir_local else ''
+        self.cache_mount = '' if not self.cache_volume else (
+            '- {cache_volume}:{cache_dir_mount}'.format(
+                cache_volume=self.cache_volume,
+                cache_dir_mount=CACHE_MOUNT_DIR
+            )
+        )
+        self.cache_volumes = '' if not self.cache_volume else (
+            'volumes:\n  {cache_volume}:\n    external: true\n'.format(cache_volume=self.cache_volume)
+        )
+
     @classmethod
     def get_container_prefix(cls):
         return 'agent_{name}_{flavor}'.format(name=cls.name, flavor=cls.flavor)
@@ -119,6 +296,75 @@ class DockerCheck(Check):
         else:
             return '{}_{}'.format(cls.get_container_prefix(), instance_name or DEFAULT_NAME)
 
+    @classmethod
+    def get_builds(cls, options):
+        """Returns compose file option -> `Build`. Builds only depend on options so
+        that they can be prepared before the agent image is even inspected.
+        """
+        return OrderedDict()
+
+    @classmethod
+    def get_distinct_builds(cls, options):
+        """Several compose options, e.g. one per service, may reference the same
+        artifact and it must only be built once.
+        """
+        return list(OrderedDict((build.tag, build) for build in cls.get_builds(options).values()).values())
+
+    @classmethod
+    def get_service_images(cls, options):
+        """Returns the images of services other than the agent, which `di start`
+        pulls ahead of `docker-compose up` along with the agent image.
+        """
+        return []
+
+    def get_mounts(self):
+        """Returns the `[local, container]` paths mounted into the agent."""
+        mounts = [[self.conf_path_local, self.conf_path_mount]]
+        if self.check_dir_local:
+            mounts.append([self.check_dir_local, self.check_dir_mount])
+        if self.base_dir_local:
+            mounts.append([self.base_dir_local, self.base_dir_mount])
+
+        return mounts
+
+    def get_affected_services(self, files):
+        return sorted(set(service for f in files for service in f.services))
+
+    def get_host_ports(self):
+        """Keeps the ports previously assigned to this environment so that recreating
+        it does not move its endpoints; explicit options always take precedence.
+
+        Ports stay reserved for the rest of the process, as other environments
+        being started may otherwise be given them before they are bound. Raises
+        ValueError for an explicit port that is invalid or already given out.
+        """
+        previous_ports = read_env_metadata(self.location).get('ports', {})
+        ports = OrderedDict()
+
+        for option in self.host_ports:
+            if option in self.options:
+                try:
+                    port = parse_port(option, self.options.pop(option))
+                    if not reserve_port(port):
+                        raise ValueError('Port {} of option `{}` is already used by another environment.'.format(
+                            port, option
+                        ))
+                except ValueError:
+                    release_ports(ports.values())
+                    raise
+                ports[option] = port
+            # Previous ports are free while stopped, so another environment may have just been given one
+            elif option in previous_ports and reserve_port(previous_ports[option]):
+                ports[option] = previous_ports[option]
+            else:
+                ports[option] = allocate_port()
+
+        return ports
+
+    def release_ports(self):
+        """Lets the ports of an environment that will not be started be given out again."""
+        release_ports(self.ports.values())
+
     def format_compose_file(self, compose_file):
         return compose_file.format(
             image=self.image,
@@ -127,6 +373,10 @@ class DockerCheck(Check):
             conf_mount=self.conf_mount,
             check_mount=self.check_mount,
             base_mount=self.base_mount,
+            cache_mount=self.cache_mount,
+            cache_volumes=self.cache_volumes,
+            **{option: build.tag for option, build in self.builds.items()},
+            **self.ports,
             **self.options
         )
 
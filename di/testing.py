@@ -0,0 +1,559 @@
+import hashlib
+import itertools
+import json
+import os
+import posixpath
+import re
+import socketserver
+import stat
+import subprocess
+import sys
+import tarfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from io import BytesIO
+from tempfile import mkdtemp
+from urllib.parse import parse_qs, unquote, urlparse
+
+from di.engine import STDERR, STDOUT, STREAM_HEADER, EngineClient, split_image
+from di.utils import remove_path
+
+API_PREFIX = re.compile(r'^/v[\d.]+')
+
+EXAMPLE_CONF = """\
+init_config:
+
+instances:
+  - nginx_status_url: http://localhost:80/nginx_status/
+"""
+
+# Agent 6 output of `agent check`, as parsed by `di.agent.parse_check_stats`
+CHECK_OUTPUT = """\
+  Running Checks
+  ==============
+    {check} (1.0.0)
+    {underline}
+      Total Runs: 1
+      Metrics: 7, Total Metrics: 7
+      Events: 0, Total Events: 0
+      Service Checks: 1, Total Service Checks: 1
+      Average Execution Time : 12ms
+"""
+
+# Executed as both `docker` and `docker-compose`, keeping containers started by
+# compose in a state file so that later `docker ps` calls see them
+FAKE_CLI_SCRIPT = """\
+import hashlib, json, os, re, sys, time
+
+root = os.path.dirname(os.path.abspath(__file__))
+with open(os.path.join(root, 'config.json')) as f:
+    config = json.load(f)
+
+program = os.path.basename(sys.argv[0])
+args = sys.argv[1:]
+command = args[0] if args else ''
+state_file = os.path.join(root, 'state.json')
+
+with open(os.path.join(root, 'calls.log'), 'a') as f:
+    f.write(json.dumps([program] + args) + '\\n')
+
+time.sleep(config['latencies'].get('{} {}'.format(program, command), config['latencies'].get(program, 0)))
+
+exit_code = config['failures'].get('{} {}'.format(program, command), config['failures'].get(program, 0))
+if exit_code:
+    sys.stderr.write('Error: `{} {}` failed\\n'.format(program, command))
+    sys.exit(exit_code)
+
+
+def load_state():
+    try:
+        with open(state_file) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {'running': []}
+
+
+def save_state(state):
+    temp_file = '{}.{}'.format(state_file, os.getpid())
+    with open(temp_file, 'w') as f:
+        json.dump(state, f)
+    os.replace(temp_file, state_file)
+
+
+def compose_containers():
+    try:
+        with open('docker-compose.yaml') as f:
+            return re.findall(r'container_name:\\s*(\\S+)', f.read())
+    except IOError:
+        return []
+
+
+def image_id(image):
+    return 'sha256:{}'.format(hashlib.sha256(image.encode('utf-8')).hexdigest())
+
+
+def skip_options(args):
+    while args and args[0].startswith('-'):
+        args = args[2:] if args[0] in (
+            '--workdir', '-w', '-e', '--name', '--entrypoint', '--volumes-from', '--network', '-v'
+        ) else args[1:]
+    return args
+
+
+if program == 'docker-compose':
+    import fcntl
+
+    # Environments are started and stopped concurrently
+    with open(os.path.join(root, 'state.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        state = load_state()
+        containers = compose_containers()
+        if command == 'up':
+            state['running'] = sorted(set(state['running']) | set(containers))
+        elif command in ('down', 'stop', 'kill', 'rm'):
+            state['running'] = [c for c in state['running'] if c not in containers]
+        elif command == 'top':
+            sys.stdout.write('\\n'.join(c for c in containers if c in state['running']))
+        save_state(state)
+
+elif command == 'ps':
+    name = ''
+    for i, arg in enumerate(args):
+        if arg in ('-f', '--filter') and args[i + 1].startswith('name='):
+            name = args[i + 1][len('name='):]
+    for container in load_state()['running']:
+        if name in container:
+            sys.stdout.write('{}\\n'.format(container))
+
+elif command == 'volume':
+    state = load_state()
+    volumes = state.setdefault('volumes', {})
+    if args[1] == 'create':
+        volumes.setdefault(args[-1], args[args.index('--label') + 1].split('=', 1)[1])
+    elif args[1] == 'ls':
+        for name, label in sorted(volumes.items()):
+            sys.stdout.write('{}\\t{}\\n'.format(name, label))
+    elif args[1] == 'rm':
+        for name in args[2:]:
+            volumes.pop(name, None)
+    save_state(state)
+
+elif command == 'image' or command == 'inspect':
+    sys.stdout.write(image_id(args[-1]))
+
+elif command == 'pull':
+    sys.stdout.write('Status: Image is up to date for {}\\n'.format(args[-1]))
+
+elif command in ('run', 'exec'):
+    rest = skip_options(args[1:])
+    target, rest = rest[0], rest[1:]
+    if command == 'exec' and target not in load_state()['running']:
+        sys.stderr.write('Error: No such container: {}\\n'.format(target))
+        sys.exit(1)
+
+    if rest[:2] == ['python', '-c']:
+        checks, dirs = json.loads(rest[3]), json.loads(rest[4])
+        sys.stdout.write(json.dumps({
+            'manifest': 'agent {}'.format(config['agent_version']),
+            'dirs': {d: True for d in dirs},
+            'confs': {c: {v: config['example_conf'] for v in g} for c, g in checks.items()},
+        }))
+    elif rest[:2] == ['tox', '-l']:
+        sys.stdout.write('\\n'.join(config['tox_envs']))
+    elif '--entrypoint' in args and args[args.index('--entrypoint') + 1] in ('tox', 'sh'):
+        for env in rest[len(rest) - rest[::-1].index('-e')].split(','):
+            sys.stdout.write('  {}: commands succeeded\\n'.format(env))
+    elif rest[:1] == ['head']:
+        sys.stdout.write('agent {}\\n'.format(config['agent_version']))
+    elif rest[1:2] == ['check']:
+        sys.stdout.write(config['check_output'].format(check=rest[2], underline='-' * (len(rest[2]) + 8)))
+"""
+
+
+def frame(stream, data):
+    data = data.encode('utf-8') if isinstance(data, str) else data
+    return STREAM_HEADER.pack(stream, len(data)) + data
+
+
+def default_handler(target, command):
+    return '', '', 0
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _EngineRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.engine.record_connection()
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, data, status=200):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_body(self, body, status=200, content_type='text/plain', close=False):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        if close:
+            self.send_header('Connection', 'close')
+            self.close_connection = True
+        else:
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def read_json(self):
+        body = self.read_body()
+        return json.loads(body.decode('utf-8')) if body else {}
+
+    def dispatch(self, method):
+        url = urlparse(self.path)
+        path = API_PREFIX.sub('', url.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        if method == 'POST':
+            body = self.read_json()
+        elif method == 'PUT':
+            body = self.read_body()
+        else:
+            body = {}
+
+        engine = self.server.engine
+        engine.record_request(method, path)
+        if self.headers.get('X-Registry-Auth'):
+            engine.registry_auths.append(self.headers['X-Registry-Auth'])
+        if engine.latency:
+            time.sleep(engine.latency)
+
+        status, kind, data = engine.respond(method, unquote(path), query, body)
+        if kind == 'json':
+            self.send_json(data, status)
+        elif kind == 'stream':
+            self.send_body(data, status, content_type='application/vnd.docker.raw-stream', close=True)
+        else:
+            self.send_body(data, status)
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_PUT(self):
+        self.dispatch('PUT')
+
+    def do_DELETE(self):
+        self.dispatch('DELETE')
+
+
+class FakeEngine:
+    """Serves a small, in-memory subset of the Docker Engine API over a unix socket.
+
+    Commands that would run inside containers are delegated to `handler(target, command)`,
+    which receives an image for `run` or a container name for `exec` and must return
+    `(stdout, stderr, exit_code)`.
+    """
+    def __init__(self, socket_path=None, handler=None, images=None, running=None, latency=0):
+        self.temp_dir = '' if socket_path else mkdtemp()
+        self.socket_path = socket_path or os.path.join(self.temp_dir, 'docker.sock')
+        self.handler = handler or default_handler
+        self.images = {image: self.image_id(image) for image in images or ()}
+        self.running = list(running or ())
+        self.latency = latency
+        self.pull_errors = {}
+
+        self.requests = []
+        self.registry_auths = []
+        self.connections = 0
+        self.containers = {}
+        # Network -> `(container, aliases)` connected to it
+        self.networks = {}
+        # `(container, path)` -> contents of files copied into containers
+        self.files = {}
+        self.execs = {}
+        self._ids = itertools.count(1)
+
+        self._server = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def image_id(image):
+        return 'sha256:{}'.format(hashlib.sha256(image.encode('utf-8')).hexdigest())
+
+    def resolve(self, image):
+        """Images without a tag refer to their `latest` tag, as for the daemon."""
+        if image in self.images or split_image(image)[1] != 'latest' or image.endswith(':latest'):
+            return image
+        return '{}:latest'.format(image)
+
+    def find_container(self, ref):
+        """Returns the ID of the container with the ID or name `ref`, if any."""
+        if ref in self.containers:
+            return ref
+        return next((container_id for container_id, c in self.containers.items() if c.get('Name') == ref), None)
+
+    def list_containers(self, name='', label=''):
+        key, _, value = label.partition('=')
+        containers = [
+            {'Id': container, 'Names': ['/{}'.format(container)], 'Labels': {}}
+            for container in self.running if self.find_container(container) is None
+        ]
+        containers.extend(
+            {'Id': container_id, 'Names': ['/{}'.format(container['Name'])], 'Labels': container['Labels']}
+            for container_id, container in self.containers.items() if container.get('Name')
+        )
+
+        return [
+            container for container in containers
+            if name in container['Names'][0] and (
+                not key or key in container['Labels'] and (not value or container['Labels'][key] == value)
+            )
+        ]
+
+    def record_connection(self):
+        with self._lock:
+            self.connections += 1
+
+    def record_request(self, method, path):
+        with self._lock:
+            self.requests.append((method, path))
+
+    def client(self, **kwargs):
+        return EngineClient(self.socket_path, **kwargs)
+
+    def start(self):
+        self._server = _UnixHTTPServer(self.socket_path, _EngineRequestHandler)
+        self._server.engine = self
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+        if self.temp_dir:
+            remove_path(self.temp_dir)
+        else:
+            remove_path(self.socket_path)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def respond(self, method, path, query, body):
+        parts = path.strip('/').split('/')
+
+        if path == '/_ping':
+            return 200, 'text', b'OK'
+
+        elif parts[0] == 'images':
+            if method == 'POST' and parts[1] == 'create':
+                return self.pull(query)
+            elif method == 'GET' and parts[-1] == 'json':
+                image = self.resolve('/'.join(parts[1:-1]))
+                if image not in self.images:
+                    # Images can also be referenced by ID
+                    image = next((name for name, image_id in self.images.items() if image_id == image), image)
+                if image not in self.images:
+                    return 404, 'json', {'message': 'No such image: {}'.format(image)}
+                return 200, 'json', {
+                    'Id': self.images[image],
+                    'RepoTags': [image],
+                    'RepoDigests': ['{}@{}'.format(split_image(image)[0], self.images[image])],
+                }
+
+        elif parts[0] == 'containers':
+            if parts[1] == 'json':
+                filters = json.loads(query.get('filters', '{}'))
+                return 200, 'json', self.list_containers(filters.get('name', [''])[0], filters.get('label', [''])[0])
+            elif parts[1] == 'create':
+                if self.resolve(body['Image']) not in self.images:
+                    return 404, 'json', {'message': 'No such image: {}'.format(body['Image'])}
+
+                with self._lock:
+                    name = query.get('name')
+                    if name and (self.find_container(name) or name in self.running):
+                        return 409, 'json', {'message': 'Conflict. The container name "/{}" is in use'.format(name)}
+
+                    container_id = '{:064x}'.format(next(self._ids))
+                    self.containers[container_id] = {
+                        'Image': body['Image'], 'Cmd': body.get('Cmd'), 'Name': name, 'Labels': body.get('Labels') or {}
+                    }
+                return 201, 'json', {'Id': container_id, 'Warnings': []}
+
+            container_id = self.find_container(parts[1]) or parts[1]
+            if parts[-1] == 'exec':
+                if container_id not in self.running:
+                    return 404, 'json', {'message': 'No such container: {}'.format(container_id)}
+
+                with self._lock:
+                    exec_id = '{:064x}'.format(next(self._ids))
+                    self.execs[exec_id] = {'Container': container_id, 'Cmd': body['Cmd']}
+                return 201, 'json', {'Id': exec_id}
+
+            container = self.containers.get(container_id)
+            if container is None and method == 'DELETE' and container_id in self.running:
+                self.running.remove(container_id)
+                return 204, 'text', b''
+            elif container is None:
+                return 404, 'json', {'message': 'No such container: {}'.format(container_id)}
+
+            name = container.get('Name') or container_id
+            if method == 'DELETE':
+                with self._lock:
+                    self.containers.pop(container_id, None)
+                    if name in self.running:
+                        self.running.remove(name)
+                return 204, 'text', b''
+            elif parts[-1] == 'start':
+                if container['Cmd'] is None:
+                    # Detached, as for `docker run -d`
+                    self.running.append(name)
+                else:
+                    container['Result'] = self.handler(container['Image'], container['Cmd'])
+                return 204, 'text', b''
+            elif parts[-1] == 'rename':
+                with self._lock:
+                    new_name = query['name']
+                    if self.find_container(new_name) or new_name in self.running:
+                        return 409, 'json', {'message': 'Conflict. The name "/{}" is in use'.format(new_name)}
+
+                    container['Name'] = new_name
+                    if name in self.running:
+                        self.running[self.running.index(name)] = new_name
+                return 204, 'text', b''
+            elif parts[-1] == 'archive':
+                with tarfile.open(fileobj=BytesIO(body)) as tar:
+                    for member in tar.getmembers():
+                        path = posixpath.join(query['path'], member.name)
+                        self.files[(name, path)] = tar.extractfile(member).read()
+                return 200, 'text', b''
+            elif parts[-1] == 'wait':
+                return 200, 'json', {'StatusCode': container['Result'][2]}
+            elif parts[-1] == 'logs':
+                stdout, stderr, _ = container['Result']
+                return 200, 'stream', frame(STDOUT, stdout) + frame(STDERR, stderr)
+
+        elif parts[0] == 'networks' and parts[-1] == 'connect':
+            container = body['Container']
+            if self.find_container(container) is None and container not in self.running:
+                return 404, 'json', {'message': 'No such container: {}'.format(container)}
+
+            with self._lock:
+                self.networks.setdefault(parts[1], []).append((container, body['EndpointConfig']['Aliases']))
+            return 200, 'text', b''
+
+        elif parts[0] == 'exec':
+            execution = self.execs.get(parts[1])
+            if execution is None:
+                return 404, 'json', {'message': 'No such exec instance: {}'.format(parts[1])}
+            elif parts[-1] == 'start':
+                execution['Result'] = self.handler(execution['Container'], execution['Cmd'])
+                stdout, stderr, _ = execution['Result']
+                return 200, 'stream', frame(STDOUT, stdout) + frame(STDERR, stderr)
+            elif parts[-1] == 'json':
+                return 200, 'json', {'ExitCode': execution['Result'][2], 'Running': False}
+
+        return 404, 'json', {'message': 'page not found'}
+
+    def pull(self, query):
+        image = query['fromImage']
+        if 'tag' in query:
+            image = '{}:{}'.format(image, query['tag'])
+
+        if image in self.pull_errors:
+            messages = [{'error': self.pull_errors[image]}]
+        else:
+            self.images[image] = self.image_id(image)
+            messages = [
+                {'status': 'Pulling from {}'.format(query['fromImage']), 'id': query.get('tag', 'latest')},
+                {'status': 'Downloading', 'progressDetail': {'current': 1, 'total': 1}, 'id': 'layer'},
+                {'status': 'Digest: {}'.format(self.images[image])},
+                {'status': 'Status: Downloaded newer image for {}'.format(image)},
+            ]
+
+        return 200, 'stream', b''.join(json.dumps(message).encode('utf-8') + b'\r\n' for message in messages)
+
+
+class FakeDockerCLI:
+    """Puts fake `docker` and `docker-compose` executables on the PATH that
+    emulate just enough of the CLIs for di to start, check and stop environments.
+
+    `latency` is slept by every invocation and `latencies` overrides it per
+    program or per subcommand, e.g. `{'docker pull': 2, 'docker-compose': 0.5}`.
+    `failures` are the exit codes of invocations that fail, keyed likewise.
+    """
+    def __init__(self, latency=0, latencies=None, agent_version='6.2.0', failures=None):
+        self.temp_dir = mkdtemp()
+        self.config = {
+            'latencies': dict(latencies or {}),
+            'failures': dict(failures or {}),
+            'agent_version': agent_version,
+            'example_conf': EXAMPLE_CONF,
+            'check_output': CHECK_OUTPUT,
+            'tox_envs': ['py27', 'py36', 'flake8'],
+        }
+        self.config['latencies'].setdefault('docker', latency)
+        self.config['latencies'].setdefault('docker-compose', latency)
+
+        # The CLI backend is forced, a real daemon's socket would otherwise be used
+        self.env_vars = {
+            'PATH': '{}{}{}'.format(self.temp_dir, os.pathsep, os.environ.get('PATH', '')),
+            'DI_DOCKER_BACKEND': 'cli',
+        }
+
+    def calls(self):
+        try:
+            with open(os.path.join(self.temp_dir, 'calls.log')) as f:
+                return [json.loads(line) for line in f]
+        except FileNotFoundError:
+            return []
+
+    def start(self):
+        with open(os.path.join(self.temp_dir, 'config.json'), 'w') as f:
+            f.write(json.dumps(self.config))
+
+        script = '#!{}\n{}'.format(sys.executable, FAKE_CLI_SCRIPT)
+        for program in ('docker', 'docker-compose'):
+            path = os.path.join(self.temp_dir, program)
+            with open(path, 'w') as f:
+                f.write(script)
+            os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+        return self
+
+    def stop(self):
+        remove_path(self.temp_dir)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+def run_di(*args, env=None, input=None):
+    """Runs `di` in its own process, as settings and the Docker backend are only read once per process."""
+    return subprocess.run(
+        [sys.executable, '-m', 'di', *args], input=input, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+        env=env, universal_newlines=True
+    )
@@ -0,0 +1,115 @@
+import os
+import threading
+import time
+from functools import wraps
+
+# Modules decorate their functions with `traced` when imported, so anything
+# more than recording spans is only imported once tracing is requested.
+
+# Spans are only kept once enabled, e.g. by `di --timings`
+__spans = []
+__spans_lock = threading.Lock()
+__enabled = False
+__origin = time.perf_counter()
+
+
+class Span:
+    """A phase of a command, from its creation until `finish` or the end of a `with` block."""
+    def __init__(self, name, category='di', **args):
+        self.name = name
+        self.category = category
+        self.args = args
+        self.thread = threading.current_thread()
+        self.start = time.perf_counter()
+        self.end = None
+
+    @property
+    def duration(self):
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    def finish(self):
+        self.end = time.perf_counter()
+        record_span(self)
+
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.finish()
+
+
+def traced(name, category='di'):
+    """Records every call of the decorated function as a span. A leading
+    string argument, usually a container, image or directory, is recorded
+    as the span's target.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            target = args[0] if args and isinstance(args[0], str) else None
+            with Span(name, category, **({'target': target} if target else {})):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def record_span(span):
+    if __enabled:
+        with __spans_lock:
+            __spans.append(span)
+
+
+def enable_tracing():
+    global __enabled
+    __enabled = True
+
+
+def get_spans():
+    with __spans_lock:
+        return sorted(__spans, key=lambda span: span.start)
+
+
+def format_timings(spans):
+    """Returns one line per span with when it started relative to the
+    command, how long it took, and where it ran if not the main thread.
+    """
+    lines = ['{:>9} {:>9}  {:<8} {}'.format('start', 'duration', 'category', 'phase')]
+    for span in spans:
+        lines.append('{:>8.3f}s {:>8.3f}s  {:<8} {}{}{}'.format(
+            span.start - __origin, span.duration, span.category, span.name,
+            ' `{}`'.format(span.args['target']) if 'target' in span.args else '',
+            '' if span.thread is threading.main_thread() else '  [{}]'.format(span.thread.name)
+        ))
+
+    return '\n'.join(lines)
+
+
+def write_chrome_trace(path, spans):
+    """Writes spans as complete events of the Trace Event Format, which
+    Chrome's `about:tracing` and Perfetto display as a timeline per thread.
+    """
+    import json
+    from atomicwrites import atomic_write
+
+    pid = os.getpid()
+    events = []
+
+    for thread in sorted(set(span.thread for span in spans), key=lambda thread: thread.ident or 0):
+        events.append({
+            'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': thread.ident,
+            'args': {'name': thread.name},
+        })
+
+    for span in spans:
+        events.append({
+            'name': span.name, 'cat': span.category, 'ph': 'X', 'pid': pid, 'tid': span.thread.ident,
+            'ts': round((span.start - __origin) * 1000000), 'dur': round(span.duration * 1000000),
+            'args': span.args,
+        })
+
+    with atomic_write(path, overwrite=True) as f:
+        f.write(json.dumps({'traceEvents': events, 'displayTimeUnit': 'ms'}, indent=2))
@@ -1,13 +1,16 @@
+import hashlib
+import math
 import os
 import platform
 import shutil
+import socket
 from ast import literal_eval
+from collections import OrderedDict
 from contextlib import contextmanager
 from copy import deepcopy
 from glob import glob
 from pathlib import Path
 from tempfile import TemporaryDirectory
-from urllib.request import urlopen
 
 from appdirs import user_data_dir
 
@@ -17,6 +20,13 @@ CHECKS_DIR = os.path.join(APP_DIR, 'checks')
 DEFAULT_NAME = 'default'
 MOUNT_DIR = '/home'
 
+# Where the agent container of a dev environment mounts its volume of test dependencies
+CACHE_MOUNT_DIR = '/di/cache'
+CACHE_VOLUME_PREFIX = 'di_cache_'
+
+# Changes to any of these may change what a check's tox envs install
+DEPS_FILES = ('setup.py', 'requirements*.txt', 'requirements*.in', 'tox.ini')
+
 # Must be a certain length
 FAKE_API_KEY = 'a' * 32
 
@@ -36,6 +46,51 @@ def get_check_mount_dir(check):
     return '{}/{}'.format(MOUNT_DIR, check)
 
 
+def get_cache_volume(container_name):
+    return '{}{}'.format(CACHE_VOLUME_PREFIX, container_name)
+
+
+def get_deps_hash(*dirs):
+    """Hashes the files declaring the dependencies of the packages in `dirs`."""
+    digest = hashlib.sha256()
+    for d in dirs:
+        for pattern in DEPS_FILES:
+            for path in sorted(glob(os.path.join(d, pattern))):
+                digest.update(os.path.relpath(path, d).encode('utf-8'))
+                with open(path, 'rb') as f:
+                    digest.update(f.read())
+
+    return digest.hexdigest()[:12]
+
+
+def find_free_port():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        sock.bind(('', 0))
+        return sock.getsockname()[1]
+    finally:
+        sock.close()
+
+
+def get_statistics(samples):
+    """Summarizes samples with nearest-rank percentiles, which
+    unlike interpolation always report an observed value.
+    """
+    samples = sorted(samples)
+    if not samples:
+        return OrderedDict()
+
+    def percentile(p):
+        return samples[max(0, math.ceil(p / 100 * len(samples)) - 1)]
+
+    return OrderedDict([
+        ('min', samples[0]),
+        ('median', percentile(50)),
+        ('p95', percentile(95)),
+        ('max', samples[-1]),
+    ])
+
+
 def copy_dict_merge(d1, d2):
     d1 = deepcopy(d1)
     d1.update(deepcopy(d2))
@@ -96,6 +151,9 @@ def create_file(fname):
 
 
 def download_file(url, fname):
+    # Deferred as it is rarely needed and slow to import
+    from urllib.request import urlopen
+
     req = urlopen(url)
     with open(fname, 'wb') as f:
         while True:
@@ -0,0 +1,27 @@
+import os
+
+import pytest
+
+from di.testing import FakeDockerCLI, run_di
+
+
+class CLI:
+    """Runs `di` against fake `docker` and `docker-compose` executables, with
+    its settings and caches kept in a temporary directory.
+    """
+    def __init__(self, fake, d):
+        self.fake = fake
+        self.location = os.path.join(d, 'envs')
+        self.env = dict(os.environ, XDG_DATA_HOME=os.path.join(d, 'data'), **fake.env_vars)
+
+    def run(self, *args, input=None):
+        return run_di(*args, env=self.env, input=input)
+
+    def calls_since(self, start):
+        return self.fake.calls()[start:]
+
+
+@pytest.fixture
+def cli(tmpdir):
+    with FakeDockerCLI() as fake:
+        yield CLI(fake, str(tmpdir))
@@ -0,0 +1,30 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from di import cache
+
+
+def test_concurrent_updates_keep_every_entry(tmpdir, monkeypatch):
+    monkeypatch.setattr(cache, 'IMAGE_CACHE_DIR', str(tmpdir))
+    checks = ['check{}'.format(i) for i in range(20)]
+
+    with ThreadPoolExecutor(max_workers=len(checks)) as executor:
+        list(executor.map(
+            lambda check: cache.update_image_cache('sha256:abc', image='agent', example_confs={check: check}),
+            checks
+        ))
+
+    data = cache.load_image_cache('sha256:abc')
+    assert data['images'] == ['agent']
+    assert sorted(data['example_confs']) == sorted(checks)
+
+
+def test_clear_image_cache_keeps_pull_records(tmpdir, monkeypatch):
+    monkeypatch.setattr(cache, 'IMAGE_CACHE_DIR', str(tmpdir.join('images')))
+    monkeypatch.setattr(cache, 'PULLS_FILE', str(tmpdir.join('pulls.json')))
+    cache.update_image_cache('sha256:abc', image='agent')
+    cache.record_pull('agent', 'sha256:abc', timestamp=1)
+
+    cache.clear_image_cache()
+
+    assert cache.list_image_caches() == []
+    assert cache.get_pull_record('agent') == {'digest': 'sha256:abc', 'time': 1}
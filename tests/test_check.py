@@ -0,0 +1,75 @@
+import json
+
+
+def check_execs(calls):
+    return [call for call in calls if call[:2] == ['docker', 'exec'] and 'check' in call]
+
+
+class TestBenchmark:
+    def test_reuse_runs_one_process(self, cli, tmpdir):
+        assert cli.run('start', 'nginx', '-l', cli.location).returncode == 0
+        start = len(cli.fake.calls())
+        json_file = str(tmpdir.join('nginx.json'))
+
+        result = cli.run('check', 'nginx', '-l', cli.location, '-n', '3', '--reuse', '--json', json_file)
+
+        assert result.returncode == 0
+        execs = check_execs(cli.calls_since(start))
+        assert len(execs) == 1
+        assert execs[0][execs[0].index('--check-times') + 1] == '3'
+
+        with open(json_file) as f:
+            results = json.load(f)
+        assert results['reuse'] is True
+        assert results['runs'] == 3
+        assert len(results['samples']) == 1
+        assert results['agent']['median'] == 12.0
+
+    def test_runs_without_reuse_are_separate(self, cli, tmpdir):
+        assert cli.run('start', 'nginx', '-l', cli.location).returncode == 0
+        start = len(cli.fake.calls())
+        json_file = str(tmpdir.join('nginx.json'))
+
+        result = cli.run('check', 'nginx', '-l', cli.location, '-n', '3', '--json', json_file)
+
+        assert result.returncode == 0
+        execs = check_execs(cli.calls_since(start))
+        assert len(execs) == 3
+        assert not any('--check-times' in call for call in execs)
+
+        with open(json_file) as f:
+            assert len(json.load(f)['samples']) == 3
+
+
+class TestSelectors:
+    def test_only_running_matches_checked(self, cli, tmpdir):
+        assert cli.run('start', 'nginx', 'nginx:stub:other', 'envoy', '-l', cli.location).returncode == 0
+        assert cli.run('stop', 'nginx', 'stub', 'other', '-l', cli.location).returncode == 0
+        json_file = str(tmpdir.join('results.json'))
+
+        result = cli.run('check', '-c', 'nginx', '-l', cli.location, '--json', json_file)
+
+        assert result.returncode == 0
+        with open(json_file) as f:
+            results = json.load(f)
+        assert [r['environment'] for r in results] == ['nginx:stub:default']
+        assert results[0]['metrics'] == 7
+
+    def test_match(self, cli):
+        assert cli.run('start', 'nginx', 'envoy', '-l', cli.location).returncode == 0
+        start = len(cli.fake.calls())
+
+        result = cli.run('check', '-m', 'envoy:*', '-l', cli.location)
+
+        assert result.returncode == 0
+        assert [call[call.index('check') + 1] for call in check_execs(cli.calls_since(start))] == ['envoy']
+        assert 'envoy:front:default' in result.stdout
+        assert 'nginx:stub:default' not in result.stdout
+
+    def test_no_match(self, cli):
+        assert cli.run('start', 'nginx', '-l', cli.location).returncode == 0
+
+        result = cli.run('check', '--flavor', 'front', '-l', cli.location)
+
+        assert result.returncode == 0
+        assert 'No matching running environments' in result.stdout
@@ -0,0 +1,59 @@
+import json
+import subprocess
+import sys
+
+import click
+
+from di.cli import COMMANDS, di
+
+# Only needed once a command runs, and slow to import
+DEFERRED_MODULES = {'concurrent.futures', 'http.client', 'toml', 'urllib.request'}
+
+
+def get_loaded_modules(code):
+    process = subprocess.run(
+        [sys.executable, '-c', '{}\nimport json, sys\nprint(json.dumps(sorted(sys.modules)))'.format(code)],
+        stdout=subprocess.PIPE, check=True
+    )
+    modules = json.loads(process.stdout.decode().splitlines()[-1])
+
+    return [
+        module for module in modules
+        if module.startswith(('di.commands.', 'di.checks', 'di.docker', 'di.engine')) and module != 'di.commands.utils'
+        or module in DEFERRED_MODULES
+    ]
+
+
+def test_import_loads_no_command():
+    assert get_loaded_modules('import di.cli') == []
+
+
+def test_help_loads_no_command():
+    code = (
+        'from di.cli import di\n'
+        'try:\n'
+        '    di(["--help"], prog_name="di")\n'
+        'except SystemExit:\n'
+        '    pass'
+    )
+
+    assert get_loaded_modules(code) == []
+
+
+def test_completion_loads_no_command():
+    code = (
+        'from click.shell_completion import ShellComplete\n'
+        'from di.cli import di\n'
+        'items = ShellComplete(di, {}, "di", "_DI_COMPLETE").get_completions([], "")\n'
+        'assert [item.value for item in items] == sorted(%r)' % sorted(COMMANDS)
+    )
+
+    assert get_loaded_modules(code) == []
+
+
+def test_short_helps_match_commands():
+    ctx = click.Context(di)
+    short_helps = di.get_short_helps(ctx)
+
+    for cmd_name in COMMANDS:
+        assert di.get_command(ctx, cmd_name).get_short_help_str() == short_helps[cmd_name]
@@ -0,0 +1,155 @@
+import json
+import time
+
+import pytest
+
+from di import cache
+from di.docker import EngineBackend, image_is_fresh, introspect_image, set_backend, update_image
+from di.testing import EXAMPLE_CONF, FakeEngine
+
+IMAGE = 'datadog/agent-dev:master'
+
+
+class AgentImage:
+    """Answers introspection as an agent image with the given manifest would, recording every run."""
+    def __init__(self, manifest='agent 6.2.0', a6_conf_dir=True, stdout=None):
+        self.manifest = manifest
+        self.a6_conf_dir = a6_conf_dir
+        self.stdout = stdout
+        self.runs = []
+
+    def __call__(self, target, command):
+        self.runs.append(target)
+        if self.stdout is not None:
+            return self.stdout, 'agent crashed', 1
+
+        checks, dirs = json.loads(command[3]), json.loads(command[4])
+        return json.dumps({
+            'manifest': self.manifest,
+            'dirs': {d: self.a6_conf_dir if d.startswith('/etc/datadog-agent') else d == '/home' for d in dirs},
+            'confs': {check: {version: EXAMPLE_CONF for version in globs} for check, globs in checks.items()},
+        }), '', 0
+
+
+@pytest.fixture
+def caches(tmpdir, monkeypatch):
+    monkeypatch.setattr(cache, 'IMAGE_CACHE_DIR', str(tmpdir.join('images')))
+    monkeypatch.setattr(cache, 'PULLS_FILE', str(tmpdir.join('pulls.json')))
+
+
+@pytest.fixture
+def agent():
+    return AgentImage()
+
+
+@pytest.fixture
+def engine(caches, agent):
+    with FakeEngine(images=[IMAGE], handler=agent) as engine:
+        set_backend(EngineBackend(engine.client()))
+        try:
+            yield engine
+        finally:
+            set_backend(None)
+
+
+class TestIntrospectImage:
+    def test_single_container(self, engine, agent):
+        result, error = introspect_image(IMAGE, checks=['nginx'], dirs=['/home'])
+
+        assert error == 0
+        assert result == {'agent_version': '6', 'example_confs': {'nginx': EXAMPLE_CONF}, 'dirs': {'/home': True}}
+        assert agent.runs == [IMAGE]
+
+    def test_cached_by_digest(self, engine, agent):
+        introspect_image(IMAGE, checks=['nginx'])
+
+        result, error = introspect_image(IMAGE, checks=['nginx'])
+
+        assert error == 0
+        assert result == {'agent_version': '6', 'example_confs': {'nginx': EXAMPLE_CONF}, 'dirs': {}}
+        assert agent.runs == [IMAGE]
+
+    def test_uncached_check_runs_again(self, engine, agent):
+        introspect_image(IMAGE, checks=['nginx'])
+        introspect_image(IMAGE, checks=['nginx', 'envoy'])
+
+        assert agent.runs == [IMAGE, IMAGE]
+
+    def test_version_from_conf_dir(self, engine, agent):
+        agent.manifest = ''
+
+        assert introspect_image(IMAGE)[0]['agent_version'] == '6'
+
+    def test_agent_5(self, engine, agent):
+        agent.manifest = ''
+        agent.a6_conf_dir = False
+
+        assert introspect_image(IMAGE, checks=['nginx'])[0] == {
+            'agent_version': '5', 'example_confs': {'nginx': EXAMPLE_CONF}, 'dirs': {},
+        }
+
+    def test_error(self, engine, agent):
+        agent.stdout = 'not json'
+
+        result, error = introspect_image(IMAGE, checks=['nginx'])
+
+        assert error == 1
+        assert result == {'error': 'agent crashed'}
+        assert cache.load_image_cache(FakeEngine.image_id(IMAGE)) == {}
+
+
+class TestImageIsFresh:
+    def test_always(self, engine):
+        assert not image_is_fresh(IMAGE, policy='always', ttl=3600)
+
+    def test_missing(self, engine):
+        assert image_is_fresh(IMAGE, policy='missing')
+        assert not image_is_fresh('nginx:latest', policy='missing')
+
+    def test_ttl(self, engine):
+        cache.record_pull(IMAGE, FakeEngine.image_id(IMAGE))
+
+        assert image_is_fresh(IMAGE, ttl=3600)
+
+    def test_ttl_expired(self, engine):
+        cache.record_pull(IMAGE, FakeEngine.image_id(IMAGE), timestamp=time.time() - 7200)
+
+        assert not image_is_fresh(IMAGE, ttl=3600)
+
+    def test_ttl_other_image_pulled(self, engine):
+        # The local image is not the one we pulled, e.g. it was rebuilt or pulled by hand
+        cache.record_pull(IMAGE, 'sha256:other')
+
+        assert not image_is_fresh(IMAGE, ttl=3600)
+
+
+class TestUpdateImage:
+    def test_pull_records_digest(self, engine):
+        output, error, digest = update_image(IMAGE)
+
+        assert error == 0
+        assert 'Downloaded newer image' in output
+        assert digest == FakeEngine.image_id(IMAGE)
+        assert cache.get_pull_record(IMAGE)['digest'] == digest
+
+    def test_new_digest_drops_old_cache(self, engine):
+        engine.images[IMAGE] = 'sha256:old'
+        cache.update_image_cache('sha256:old', image=IMAGE, agent_version='6')
+
+        _, error, digest = update_image(IMAGE)
+
+        assert error == 0
+        assert digest == FakeEngine.image_id(IMAGE)
+        assert cache.load_image_cache('sha256:old') == {}
+
+    def test_failure_keeps_old_digest(self, engine):
+        engine.pull_errors[IMAGE] = 'manifest unknown'
+        cache.update_image_cache(FakeEngine.image_id(IMAGE), image=IMAGE, agent_version='6')
+
+        output, error, digest = update_image(IMAGE)
+
+        assert error
+        assert 'manifest unknown' in output
+        assert digest == FakeEngine.image_id(IMAGE)
+        assert cache.get_pull_record(IMAGE) == {}
+        assert cache.get_cached_agent_version(digest) == '6'
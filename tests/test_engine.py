@@ -0,0 +1,253 @@
+import base64
+import json
+import os
+import subprocess
+
+import pytest
+
+from di.docker import CliBackend, EngineBackend
+from di.engine import (
+    DEFAULT_REGISTRY, STDERR, STDOUT, EngineError, demultiplex, get_registry, get_registry_auth, split_image
+)
+from di.testing import FakeDockerCLI, FakeEngine, frame
+
+
+class TestSplitImage:
+    def test_tag(self):
+        assert split_image('datadog/agent-dev:master') == ('datadog/agent-dev', 'master')
+
+    def test_no_tag(self):
+        assert split_image('nginx') == ('nginx', 'latest')
+
+    def test_registry_port(self):
+        assert split_image('localhost:5000/agent') == ('localhost:5000/agent', 'latest')
+
+    def test_registry_port_and_tag(self):
+        assert split_image('localhost:5000/agent:6') == ('localhost:5000/agent', '6')
+
+    def test_digest(self):
+        assert split_image('nginx@sha256:abc') == ('nginx', 'sha256:abc')
+
+
+class TestDemultiplex:
+    def test_streams(self):
+        data = frame(STDOUT, 'out1') + frame(STDERR, 'err') + frame(STDOUT, 'out2')
+
+        assert demultiplex(data) == (b'out1out2', b'err')
+
+    def test_empty(self):
+        assert demultiplex(b'') == (b'', b'')
+
+    def test_truncated_header(self):
+        assert demultiplex(frame(STDOUT, 'out') + b'\x01\x00') == (b'out', b'')
+
+
+class TestRegistryAuth:
+    def test_registry(self):
+        assert get_registry('nginx') == DEFAULT_REGISTRY
+        assert get_registry('datadog/agent') == DEFAULT_REGISTRY
+        assert get_registry('localhost/agent') == 'localhost'
+        assert get_registry('registry.example.com:5000/agent:6') == 'registry.example.com:5000'
+
+    def test_auths(self, tmpdir, monkeypatch):
+        auth = base64.b64encode(b'user:pass').decode('ascii')
+        tmpdir.join('config.json').write(json.dumps({'auths': {'registry.example.com': {'auth': auth}}}))
+        monkeypatch.setenv('DOCKER_CONFIG', str(tmpdir))
+
+        header = get_registry_auth('registry.example.com/agent:6')
+
+        assert json.loads(base64.urlsafe_b64decode(header).decode('utf-8')) == {
+            'username': 'user', 'password': 'pass', 'serveraddress': 'registry.example.com'
+        }
+        assert get_registry_auth('nginx') == ''
+
+    def test_no_config(self, tmpdir, monkeypatch):
+        monkeypatch.setenv('DOCKER_CONFIG', str(tmpdir))
+
+        assert get_registry_auth('nginx') == ''
+
+
+class TestEngineClient:
+    def test_ping(self):
+        with FakeEngine() as engine:
+            assert engine.client().ping()
+
+    def test_ping_no_daemon(self, tmpdir):
+        with FakeEngine() as engine:
+            client = engine.client()
+        client.socket_path = str(tmpdir.join('missing.sock'))
+
+        assert not client.ping()
+
+    def test_keep_alive(self):
+        with FakeEngine(images=['nginx']) as engine:
+            client = engine.client()
+            for _ in range(5):
+                client.inspect_image('nginx')
+
+            assert engine.connections == 1
+            assert len(engine.requests) == 5
+
+    def test_reconnect_after_close(self):
+        with FakeEngine(images=['nginx']) as engine:
+            client = engine.client()
+            client.inspect_image('nginx')
+
+            # Pooled connections may be closed by the daemon while idle
+            for conn in client._pool:
+                conn.sock.close()
+            client.inspect_image('nginx')
+
+            assert engine.connections == 2
+
+    def test_error_message(self):
+        with FakeEngine() as engine:
+            with pytest.raises(EngineError) as e:
+                engine.client().inspect_image('nginx')
+
+            assert e.value.status == 404
+            assert e.value.message == 'No such image: nginx:latest'
+
+    def test_pull(self):
+        lines = []
+        with FakeEngine() as engine:
+            output, returncode = engine.client().pull('nginx:1.13', output=lines.append)
+
+            assert returncode == 0
+            assert 'nginx:1.13' in engine.images
+            # Progress bars are skipped
+            assert lines == output.splitlines()
+            assert not any('Downloading' in line for line in lines)
+
+    def test_pull_error(self):
+        with FakeEngine() as engine:
+            engine.pull_errors['private/agent:6'] = 'pull access denied'
+            output, returncode = engine.client().pull('private/agent:6')
+
+            assert returncode == 1
+            assert output == 'pull access denied'
+
+    def test_pull_registry_auth(self, tmpdir, monkeypatch):
+        auth = base64.b64encode(b'user:pass').decode('ascii')
+        tmpdir.join('config.json').write(json.dumps({'auths': {DEFAULT_REGISTRY: {'auth': auth}}}))
+        monkeypatch.setenv('DOCKER_CONFIG', str(tmpdir))
+
+        with FakeEngine() as engine:
+            engine.client().pull('datadog/agent-dev:master')
+
+            assert len(engine.registry_auths) == 1
+            credentials = json.loads(base64.urlsafe_b64decode(engine.registry_auths[0]).decode('utf-8'))
+            assert credentials['username'] == 'user'
+
+    def test_run(self):
+        def handler(target, command):
+            return 'ran {} in {}'.format(' '.join(command), target), 'warning', 3
+
+        with FakeEngine(images=['nginx'], handler=handler) as engine:
+            stdout, stderr, returncode = engine.client().run('nginx', ['echo', 'hi'])
+
+            assert (stdout, stderr, returncode) == ('ran echo hi in nginx', 'warning', 3)
+            # The container is removed afterwards
+            assert engine.containers == {}
+
+    def test_run_pulls_missing_image(self, monkeypatch):
+        monkeypatch.setenv('DOCKER_CONFIG', os.devnull)
+
+        with FakeEngine() as engine:
+            _, _, returncode = engine.client().run('nginx', ['true'])
+
+            assert returncode == 0
+            assert 'nginx:latest' in engine.images
+
+    def test_run_missing_image_pull_error(self, monkeypatch):
+        monkeypatch.setenv('DOCKER_CONFIG', os.devnull)
+
+        with FakeEngine() as engine:
+            engine.pull_errors['nginx:latest'] = 'manifest unknown'
+            with pytest.raises(EngineError) as e:
+                engine.client().run('nginx', ['true'])
+
+            assert e.value.message == 'manifest unknown'
+
+    def test_exec(self):
+        commands = []
+
+        def handler(target, command):
+            commands.append((target, command))
+            return 'out', 'err', 0
+
+        with FakeEngine(running=['agent'], handler=handler) as engine:
+            result = engine.client().exec('agent', ['ls'], workdir='/home', env=['A=1'])
+
+            assert result == ('out', 'err', 0)
+            # `WorkingDir` is not available in the API version used
+            assert commands == [('agent', ['sh', '-c', 'cd "$1" && shift && exec "$@"', 'sh', '/home', 'ls'])]
+
+    def test_exec_missing_container(self):
+        with FakeEngine() as engine:
+            with pytest.raises(EngineError) as e:
+                engine.client().exec('agent', ['ls'])
+
+            assert e.value.message == 'No such container: agent'
+
+
+class TestEngineBackend:
+    def test_exec_error_shown_when_not_captured(self, capsys):
+        with FakeEngine() as engine:
+            _, stderr, returncode = EngineBackend(engine.client()).exec('agent', ['ls'], capture=False)
+
+        assert returncode == 1
+        assert stderr == 'No such container: agent'
+        assert capsys.readouterr().err == 'Error: No such container: agent\n'
+
+
+@pytest.fixture
+def fake_cli(monkeypatch):
+    with FakeDockerCLI(failures={'docker rm': 1}) as fake:
+        for name, value in fake.env_vars.items():
+            monkeypatch.setenv(name, value)
+        yield fake
+
+
+def compose_up(tmpdir, container):
+    tmpdir.join('docker-compose.yaml').write('services:\n  agent:\n    container_name: {}\n'.format(container))
+    subprocess.run(['docker-compose', 'up', '-d'], cwd=str(tmpdir), check=True)
+
+
+class TestCliBackend:
+    def test_run(self, fake_cli):
+        stdout, stderr, returncode = CliBackend().run('agent', ['head', '-1', 'manifest'], env=['A=1'])
+
+        assert (stdout, stderr, returncode) == ('agent 6.2.0\n', '', 0)
+        assert fake_cli.calls()[-1] == ['docker', 'run', '--rm', '-e', 'A=1', 'agent', 'head', '-1', 'manifest']
+
+    def test_exec(self, fake_cli, tmpdir):
+        compose_up(tmpdir, 'agent')
+
+        stdout, _, returncode = CliBackend().exec('agent', ['tox', '-l'], workdir='/check', env=['A=1'])
+
+        assert (stdout, returncode) == ('py27\npy36\nflake8', 0)
+        assert fake_cli.calls()[-1] == [
+            'docker', 'exec', '--workdir', '/check', '-e', 'A=1', 'agent', 'tox', '-l'
+        ]
+
+    def test_exec_missing_container(self, fake_cli):
+        stdout, stderr, returncode = CliBackend().exec('agent', ['ls'])
+
+        assert (stdout, stderr, returncode) == ('', 'Error: No such container: agent\n', 1)
+
+    def test_containers(self, fake_cli, tmpdir):
+        compose_up(tmpdir, 'agent_nginx_stub_default')
+
+        assert CliBackend().containers('agent_nginx') == (['agent_nginx_stub_default'], 0)
+        assert CliBackend().containers('agent_envoy') == ([], 0)
+
+    def test_pull_and_image_id(self, fake_cli):
+        output, returncode = CliBackend().pull('nginx:latest')
+
+        assert returncode == 0
+        assert 'Image is up to date for nginx:latest' in output
+        assert CliBackend().image_id('nginx:latest').startswith('sha256:')
+
+    def test_failure(self, fake_cli):
+        assert CliBackend().remove(['agent']) == ('Error: `docker rm` failed\n', 1)
@@ -0,0 +1,118 @@
+import json
+import os
+
+import pytest
+
+from di.docker import (
+    EngineBackend, claim_pool_container, connect_container, copy_to_container, create_pool_container,
+    get_api_key_hash, list_pool_containers, remove_containers, set_backend
+)
+from di.testing import EXAMPLE_CONF, FakeDockerCLI, FakeEngine, run_di
+
+IMAGE = 'datadog/agent-dev:master'
+
+
+def agent_handler(target, command):
+    """Answers the introspection of `di start` as an Agent 6 image would."""
+    if command[:2] == ['python', '-c']:
+        checks, dirs = json.loads(command[3]), json.loads(command[4])
+        return json.dumps({
+            'manifest': 'agent 6.2.0',
+            'dirs': {d: True for d in dirs},
+            'confs': {check: {version: EXAMPLE_CONF for version in globs} for check, globs in checks.items()},
+        }), '', 0
+    return '', '', 0
+
+
+@pytest.fixture
+def engine():
+    with FakeEngine(images=[IMAGE], handler=agent_handler) as engine:
+        set_backend(EngineBackend(engine.client()))
+        try:
+            yield engine
+        finally:
+            set_backend(None)
+
+
+class TestPoolContainers:
+    def test_create(self, engine):
+        name, _, error = create_pool_container(IMAGE, 'key')
+
+        assert error == 0
+        assert name in engine.running
+        containers, _ = list_pool_containers()
+        assert [(c['name'], c['image'], c['key']) for c in containers] == [(name, IMAGE, get_api_key_hash('key'))]
+        assert containers[0]['digest'] == engine.images[IMAGE]
+
+    def test_claim(self, engine):
+        name, _, _ = create_pool_container(IMAGE, 'key')
+
+        assert claim_pool_container(IMAGE, 'key', 'agent_nginx_stub_default') == name
+        assert 'agent_nginx_stub_default' in engine.running
+        # Claimed containers are no longer idle
+        assert list_pool_containers()[0] == []
+        assert claim_pool_container(IMAGE, 'key', 'agent_nginx_stub_other') == ''
+
+    def test_claim_other_api_key(self, engine):
+        create_pool_container(IMAGE, 'key')
+
+        assert claim_pool_container(IMAGE, 'other', 'agent_nginx_stub_default') == ''
+
+    def test_connect_and_copy(self, engine, tmpdir):
+        create_pool_container(IMAGE, 'key')
+        claim_pool_container(IMAGE, 'key', 'agent')
+        conf = tmpdir.join('nginx.yaml')
+        conf.write('instances: []\n')
+
+        assert connect_container('agent', 'default_default', 'agent') == ('', 0)
+        assert copy_to_container('agent', [(str(conf), '/etc/datadog-agent/conf.d/nginx.d/nginx.yaml')]) == ('', 0)
+        assert engine.networks == {'default_default': [('agent', ['agent'])]}
+        assert engine.files[('agent', '/etc/datadog-agent/conf.d/nginx.d/nginx.yaml')] == b'instances: []\n'
+
+    def test_connect_missing_container(self, engine):
+        output, error = connect_container('agent', 'default_default', 'agent')
+
+        assert error == 1
+        assert output == 'No such container: agent'
+
+    def test_remove(self, engine):
+        name, _, _ = create_pool_container(IMAGE, 'key')
+
+        assert remove_containers([name]) == ('', 0)
+        assert engine.running == []
+        assert list_pool_containers()[0] == []
+
+
+class TestStartFromPool:
+    """`di start` against the fake daemon, with compose left to the fake CLI."""
+    def start(self, engine, tmpdir, **fake_options):
+        with FakeDockerCLI(**fake_options) as fake:
+            env = dict(os.environ, XDG_DATA_HOME=str(tmpdir.join('data')), **fake.env_vars)
+            env.update(DI_DOCKER_BACKEND='engine', DOCKER_HOST='unix://{}'.format(engine.socket_path))
+            return run_di(
+                'start', 'nginx', '-l', str(tmpdir.join('envs')),
+                '--prod', '--pool', '--no-pull', '-key', 'key', env=env
+            )
+
+    def test_claim(self, engine, tmpdir):
+        name, _, _ = create_pool_container(IMAGE, 'key')
+
+        result = self.start(engine, tmpdir)
+
+        assert result.returncode == 0, result.stdout
+        assert 'Claimed idle agent container `{}`'.format(name) in result.stdout
+        assert engine.networks == {'default_default': [('agent_nginx_stub_default', ['agent'])]}
+        assert ('agent_nginx_stub_default', '/etc/datadog-agent/conf.d/nginx.d/nginx.yaml') in engine.files
+        # The claimed container is replaced
+        idle = [c['name'] for c in list_pool_containers()[0]]
+        assert len(idle) == 1 and idle != [name]
+
+    def test_abort_removes_claimed_container(self, engine, tmpdir):
+        name, _, _ = create_pool_container(IMAGE, 'key')
+
+        result = self.start(engine, tmpdir, failures={'docker-compose up': 1})
+
+        assert result.returncode == 1
+        assert 'agent_nginx_stub_default' not in engine.running
+        idle = [c['name'] for c in list_pool_containers()[0]]
+        assert len(idle) == 1 and idle != [name]
@@ -0,0 +1,94 @@
+import os
+import sys
+
+import pytest
+
+from di import cache
+from di.checks import registry
+from di.checks.registry import Flavors, discover_plugins, register_plugins
+from di.utils import DEFAULT_NAME
+
+
+def install(site, name, entry_points):
+    dist_info = site.join('{}-1.0.dist-info'.format(name))
+    dist_info.join('METADATA').write('Metadata-Version: 2.1\nName: {}\nVersion: 1.0\n'.format(name), ensure=True)
+    dist_info.join('entry_points.txt').write('[di.checks]\n{}\n'.format(
+        '\n'.join('{} = {}'.format(*entry_point) for entry_point in entry_points)
+    ))
+
+
+@pytest.fixture
+def site(tmpdir, monkeypatch):
+    monkeypatch.setattr(cache, 'PLUGINS_FILE', str(tmpdir.join('plugins.json')))
+
+    site = tmpdir.mkdir('site-packages')
+    install(site, 'di_redis', [('redis', 'di_redis:Redis'), ('redis.sentinel', 'di_redis:Sentinel')])
+    # Installs below must change its modification time
+    os.utime(str(site), (0, 0))
+
+    # Like with `python -m di`, the current directory comes first
+    monkeypatch.setattr(sys, 'path', ['', str(site)] + sys.path)
+    return site
+
+
+def discover(site):
+    return discover_plugins()
+
+
+class TestDiscoverPlugins:
+    def test_plugins_discovered(self, site):
+        assert discover(site) == {
+            'redis': {DEFAULT_NAME: 'di_redis:Redis', 'sentinel': 'di_redis:Sentinel'},
+        }
+
+    def test_cache_hit(self, site, monkeypatch, tmpdir):
+        plugins = discover(site)
+        monkeypatch.setattr(registry, 'iter_entry_points', pytest.fail)
+        # The current directory is not part of the key, even when it is a project's checkout
+        project = tmpdir.mkdir('project')
+        project.mkdir('project.egg-info')
+        monkeypatch.chdir(str(project))
+
+        assert discover(site) == plugins
+
+    def test_install_invalidates_cache(self, site):
+        discover(site)
+        install(site, 'di_mysql', [('mysql', 'di_mysql:MySQL')])
+
+        assert discover(site)['mysql'] == {DEFAULT_NAME: 'di_mysql:MySQL'}
+
+    def test_reinstall_in_place_invalidates_cache(self, site):
+        discover(site)
+        entry_points = site.join('di_redis-1.0.dist-info', 'entry_points.txt')
+        entry_points.write('[di.checks]\nredis = di_redis:NewRedis\n')
+        os.utime(str(entry_points), (1, 1))
+
+        assert discover(site) == {'redis': {DEFAULT_NAME: 'di_redis:NewRedis'}}
+
+    def test_pkg_resources_fallback(self, site, monkeypatch):
+        pkg_resources = pytest.importorskip('pkg_resources')
+        monkeypatch.setitem(sys.modules, 'importlib.metadata', None)
+        monkeypatch.setattr(pkg_resources, 'iter_entry_points', pkg_resources.WorkingSet([str(site)]).iter_entry_points)
+
+        assert discover(site) == {
+            'redis': {DEFAULT_NAME: 'di_redis:Redis', 'sentinel': 'di_redis:Sentinel'},
+        }
+        assert cache.load_plugin_cache()['sources'] == [str(site.join('di_redis-1.0.dist-info'))]
+
+
+class TestRegisterPlugins:
+    def test_existing_flavors_kept(self):
+        checks = {'nginx': Flavors([(DEFAULT_NAME, 'di.checks.nginx.stub:NginxStub')])}
+
+        register_plugins(checks, {'nginx': {DEFAULT_NAME: 'other:Nginx', 'plus': 'other:NginxPlus'}})
+
+        assert dict(checks['nginx'].paths) == {
+            DEFAULT_NAME: 'di.checks.nginx.stub:NginxStub', 'plus': 'other:NginxPlus',
+        }
+
+    def test_new_check_defaults_to_first_flavor(self):
+        checks = {}
+
+        register_plugins(checks, {'redis': {'sentinel': 'di_redis:Sentinel', 'cluster': 'di_redis:Cluster'}})
+
+        assert checks['redis'].paths[DEFAULT_NAME] == 'di_redis:Cluster'
@@ -0,0 +1,69 @@
+import os
+
+
+def compose_ups(calls):
+    return [call for call in calls if call[:2] == ['docker-compose', 'up']]
+
+
+class TestFastPath:
+    def test_unchanged_environment_kept(self, cli):
+        assert cli.run('start', 'nginx', '-l', cli.location).returncode == 0
+        start = len(cli.fake.calls())
+
+        result = cli.run('start', 'nginx', '-l', cli.location)
+
+        assert result.returncode == 0
+        assert 'is already running and up to date' in result.stdout
+        assert compose_ups(cli.calls_since(start)) == []
+
+    def test_changed_environment_recreated(self, cli):
+        assert cli.run('start', 'nginx', '-l', cli.location).returncode == 0
+        start = len(cli.fake.calls())
+
+        result = cli.run('start', 'nginx', '-l', cli.location, '-o', 'version', '1.13', input='y\n')
+
+        assert result.returncode == 0
+        assert 'already exists. Do you want to recreate it?' in result.stdout
+        assert len(compose_ups(cli.calls_since(start))) == 1
+
+    def test_edited_file_recreated(self, cli):
+        assert cli.run('start', 'nginx', '-l', cli.location).returncode == 0
+        with open(os.path.join(cli.location, 'nginx', 'stub', 'default', 'nginx.yaml'), 'a') as f:
+            f.write('# edited\n')
+        start = len(cli.fake.calls())
+
+        result = cli.run('start', 'nginx', '-l', cli.location, input='y\n')
+
+        assert result.returncode == 0
+        assert 'already exists. Do you want to recreate it?' in result.stdout
+        assert len(compose_ups(cli.calls_since(start))) == 1
+
+    def test_stopped_environment_recreated(self, cli):
+        assert cli.run('start', 'nginx', '-l', cli.location).returncode == 0
+        assert cli.run('stop', 'nginx', '-l', cli.location).returncode == 0
+        start = len(cli.fake.calls())
+
+        result = cli.run('start', 'nginx', '-l', cli.location, input='y\n')
+
+        assert result.returncode == 0
+        assert 'is already running and up to date' not in result.stdout
+        assert len(compose_ups(cli.calls_since(start))) == 1
+
+    def test_force_recreates_unchanged_environment(self, cli):
+        assert cli.run('start', 'nginx', '-l', cli.location).returncode == 0
+        start = len(cli.fake.calls())
+
+        result = cli.run('start', 'nginx', '-l', cli.location, '--force')
+
+        assert result.returncode == 0
+        assert 'is already running and up to date' not in result.stdout
+        assert len(compose_ups(cli.calls_since(start))) == 1
+
+
+class TestHostPorts:
+    def test_invalid_port_reported(self, cli):
+        result = cli.run('start', 'envoy:front', '-l', cli.location, '-o', 'front_port', 'abc')
+
+        assert result.returncode == 1
+        assert 'Option `front_port` must be a port between 1 and 65535, not `abc`.' in result.stdout
+        assert 'Traceback' not in result.stdout
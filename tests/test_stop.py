@@ -0,0 +1,63 @@
+import os
+
+import pytest
+
+
+def env_dir(cli, check, flavor, instance='default'):
+    return os.path.join(cli.location, check, flavor, instance)
+
+
+class TestRemove:
+    def test_remove(self, cli):
+        assert cli.run('start', 'nginx', '-l', cli.location).returncode == 0
+
+        result = cli.run('stop', 'nginx', '-l', cli.location, '--remove')
+
+        assert result.returncode == 0
+        assert not os.path.exists(env_dir(cli, 'nginx', 'stub'))
+
+    def test_stop_keeps_directory(self, cli):
+        assert cli.run('start', 'nginx', '-l', cli.location).returncode == 0
+
+        assert cli.run('stop', 'nginx', '-l', cli.location).returncode == 0
+        assert os.path.isdir(env_dir(cli, 'nginx', 'stub'))
+
+    def test_remove_selected(self, cli):
+        assert cli.run('start', 'nginx', 'nginx:stub:other', 'envoy', '-l', cli.location).returncode == 0
+
+        result = cli.run('stop', '-c', 'nginx', '-l', cli.location, '--remove')
+
+        assert result.returncode == 0
+        assert not os.path.exists(env_dir(cli, 'nginx', 'stub'))
+        assert not os.path.exists(env_dir(cli, 'nginx', 'stub', 'other'))
+        assert os.path.isdir(env_dir(cli, 'envoy', 'front'))
+
+
+class TestSelectors:
+    @pytest.mark.parametrize('selectors, stopped', [
+        (['--all'], ['nginx:stub:default', 'nginx:stub:other', 'envoy:front:default']),
+        (['-c', 'nginx'], ['nginx:stub:default', 'nginx:stub:other']),
+        (['--flavor', 'front'], ['envoy:front:default']),
+        (['-m', '*:other'], ['nginx:stub:other']),
+        (['-c', 'nginx', '-m', '*:default'], ['nginx:stub:default']),
+        (['-c', 'envoy', '-m', '*:other'], []),
+    ])
+    def test_selected_environments_stopped(self, cli, selectors, stopped):
+        assert cli.run('start', 'nginx', 'nginx:stub:other', 'envoy', '-l', cli.location).returncode == 0
+        start = len(cli.fake.calls())
+
+        result = cli.run('stop', '-l', cli.location, *selectors)
+
+        assert result.returncode == 0
+        downs = [call for call in cli.calls_since(start) if call[:2] == ['docker-compose', 'down']]
+        assert len(downs) == len(stopped)
+        for label in stopped:
+            assert '{}  stopped'.format(label) in result.stdout
+        if not stopped:
+            assert 'No matching environments' in result.stdout
+
+    def test_selectors_and_check_exclusive(self, cli):
+        result = cli.run('stop', 'nginx', '--all', '-l', cli.location)
+
+        assert result.returncode == 1
+        assert 'Selectors cannot be combined' in result.stdout
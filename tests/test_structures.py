@@ -0,0 +1,68 @@
+import pytest
+
+from di.checks.envoy.front import EnvoyFront
+from di.metadata import write_env_metadata
+from di.structures import release_ports
+from di.testing import EXAMPLE_CONF
+
+
+def create(d, instance_name, **options):
+    return EnvoyFront(
+        d=d, api_key='', conf_path='', conf_contents=EXAMPLE_CONF, agent_version='6',
+        instance_name=instance_name, **options
+    )
+
+
+class TestHostPorts:
+    def test_previous_ports_kept(self, tmpdir):
+        first = create(str(tmpdir), 'first')
+        write_env_metadata(first.location, {'ports': first.ports})
+        first.release_ports()
+
+        second = create(str(tmpdir), 'first')
+        second.release_ports()
+
+        assert second.ports == first.ports
+
+    def test_previous_port_given_out_again(self, tmpdir):
+        first = create(str(tmpdir), 'first')
+        write_env_metadata(first.location, {'ports': first.ports})
+        first.release_ports()
+
+        # Another environment is given a port while the first is stopped
+        other = create(str(tmpdir), 'other', front_port=first.ports['front_port'])
+        second = create(str(tmpdir), 'first')
+        release_ports(list(other.ports.values()) + list(second.ports.values()))
+
+        assert second.ports['front_port'] != first.ports['front_port']
+        assert second.ports['admin_port'] == first.ports['admin_port']
+
+    def test_explicit_port_not_given_out(self, tmpdir, monkeypatch):
+        free_ports = iter([4000, 4001, 4002])
+        monkeypatch.setattr('di.structures.find_free_port', lambda: next(free_ports))
+
+        first = create(str(tmpdir), 'first', front_port=4000, admin_port=4003)
+        second = create(str(tmpdir), 'second')
+        first.release_ports()
+        second.release_ports()
+
+        assert first.ports['front_port'] == 4000
+        assert set(second.ports.values()) == {4001, 4002}
+
+    @pytest.mark.parametrize('value', ['abc', '0', '65536', '-80'])
+    def test_invalid_explicit_port(self, tmpdir, value):
+        with pytest.raises(ValueError, match='must be a port between 1 and 65535'):
+            create(str(tmpdir), 'first', front_port=value)
+
+    def test_explicit_port_already_given_out(self, tmpdir):
+        first = create(str(tmpdir), 'first')
+        with pytest.raises(ValueError, match='already used by another environment'):
+            create(str(tmpdir), 'second', front_port=5000, admin_port=first.ports['admin_port'])
+
+        # The ports the failed environment reserved are free again, but not those of the first
+        other = create(str(tmpdir), 'other', front_port=5000)
+        first.release_ports()
+        other.release_ports()
+
+        assert other.ports['front_port'] == 5000
+        assert other.ports['admin_port'] != first.ports['admin_port']
@@ -0,0 +1,49 @@
+import pytest
+
+
+def calls_of(calls, command):
+    return [call for call in calls if call[:2] == ['docker', command]]
+
+
+def option_values(call, option):
+    return [call[i + 1] for i, arg in enumerate(call) if arg == option]
+
+
+@pytest.fixture
+def dev_cli(cli, tmpdir):
+    core = tmpdir.mkdir('core')
+    core.join('nginx', 'setup.py').write('', ensure=True)
+    core.join('nginx', 'datadog_checks', 'nginx', 'data', 'conf.yaml.example').write('instances: [{}]\n', ensure=True)
+    core.join('datadog_checks_base', 'setup.py').write('', ensure=True)
+
+    assert cli.run('start', 'nginx', '-l', cli.location, '--dev', '--core', str(core)).returncode == 0
+    return cli
+
+
+class TestParallel:
+    def test_runs_do_not_share_names(self, dev_cli):
+        start = len(dev_cli.fake.calls())
+        for _ in range(2):
+            assert dev_cli.run('test', 'nginx', '-l', dev_cli.location, '-p', '2').returncode == 0
+        calls = dev_cli.calls_since(start)
+
+        images = [call[-1] for call in calls_of(calls, 'commit')]
+        clones = [name for call in calls_of(calls, 'run') for name in option_values(call, '--name')]
+
+        assert len(set(images)) == 2
+        assert len(set(clones)) == 4
+        assert [call[-1] for call in calls_of(calls, 'rmi')] == images
+
+    def test_clones_have_own_workdirs(self, dev_cli):
+        start = len(dev_cli.fake.calls())
+
+        result = dev_cli.run('test', 'nginx', '-l', dev_cli.location, '-p', '2')
+        runs = calls_of(dev_cli.calls_since(start), 'run')
+
+        assert result.returncode == 0
+        workdirs = [option_values(call, '--workdir')[-1] for call in runs]
+        assert len(set(workdirs)) == 2
+        assert all(workdir.startswith('/di/cache/tox/') for workdir in workdirs)
+        # Concurrent runs take turns with the workdir of the same envs
+        assert all('flock' in call[call.index('-c') + 1] for call in runs)
+        assert all('PYTHONDONTWRITEBYTECODE=1' in option_values(call, '-e') for call in runs)